@@ -13,3 +13,32 @@ SECRET_KEY = os.getenv("SECRET_KEY", "jalmitra-hackathon-secret-key-2026")
 MAPPLS_CLIENT_ID = os.getenv("MAPPLS_CLIENT_ID", "")
 MAPPLS_CLIENT_SECRET = os.getenv("MAPPLS_CLIENT_SECRET", "")
 MAPPLS_REST_KEY = os.getenv("MAPPLS_REST_KEY", "")
+
+# Shared process pool for CPU-bound work (ensemble, seasonal refits, backtests, route search)
+WORKER_PROCESSES = int(os.getenv("WORKER_PROCESSES", str(os.cpu_count() or 1)))
+
+# Drought ensemble (Monte Carlo) defaults
+ENSEMBLE_SAMPLES = int(os.getenv("ENSEMBLE_SAMPLES", "2000"))
+ENSEMBLE_WORKERS = int(os.getenv("ENSEMBLE_WORKERS", str(WORKER_PROCESSES)))
+
+# Interpolated WSI raster (memory-mapped grids, one file per recompute)
+RASTER_DIR = os.getenv("RASTER_DIR", "./rasters")
+
+# Fitted per-village forecasting models (one directory per model version)
+MODEL_REGISTRY_DIR = os.getenv("MODEL_REGISTRY_DIR", "./model_registry")
+
+# Tankers reserved by auto-allocation return to the pool if their trip never starts
+TRIP_RESERVATION_HOURS = float(os.getenv("TRIP_RESERVATION_HOURS", "12"))
+
+# Route solver budgets per /routes/optimize call (CVRP search, then local search)
+ROUTE_SOLVER_TIME_LIMIT_S = float(os.getenv("ROUTE_SOLVER_TIME_LIMIT_S", "2"))
+ROUTE_IMPROVE_TIME_BUDGET_MS = float(os.getenv("ROUTE_IMPROVE_TIME_BUDGET_MS", "200"))
+
+# Cached /routes/optimize answers (LRU size, max age; change-feed events invalidate earlier)
+ROUTE_CACHE_SIZE = int(os.getenv("ROUTE_CACHE_SIZE", "32"))
+ROUTE_CACHE_TTL_S = float(os.getenv("ROUTE_CACHE_TTL_S", "300"))
+
+# Depot operating hours (local time; timestamps are stored in UTC) for time-window routing
+DEPOT_OPEN_HOUR = int(os.getenv("DEPOT_OPEN_HOUR", "6"))
+DEPOT_CLOSE_HOUR = int(os.getenv("DEPOT_CLOSE_HOUR", "20"))
+DEPOT_UTC_OFFSET_MIN = int(os.getenv("DEPOT_UTC_OFFSET_MIN", "330"))  # IST
@@ -1,12 +1,73 @@
 """
 Priority-based tanker allocation engine.
 Score = population × 0.3 + severity × 0.4 + days_since_last × 0.2 + vulnerable × 0.1
+Tankers are matched to villages with a min-cost assignment over priority,
+capacity fit and distance from the tanker's current position.
 """
-from typing import List, Dict
+from typing import Any, List, Dict, Optional
 from datetime import datetime, timedelta
+import uuid
+import numpy as np
+from scipy.optimize import linear_sum_assignment
 from sqlalchemy.orm import Session
-from sqlalchemy import func, desc
-from app.models import Village, WaterStressRecord, Trip, Tanker, WaterRequest
+from sqlalchemy import func, desc, update
+from sqlalchemy.exc import IntegrityError
+from app.models import Village, WaterStressRecord, Trip, Tanker, WaterRequest, LatestWSI, AllocationRun, AllocationRunTrip
+from app.ml.wsi_calculator import round1
+from app.ml.distance_matrix import haversine_matrix
+from app.ml.spatial_index import spatial_index
+from app.config import TRIP_RESERVATION_HOURS
+
+# Assignment cost = distance_km × w - (priority × w + delivered share of largest tanker × w + tanker fill × w)
+ASSIGNMENT_WEIGHTS = {
+    "priority": 1.0,
+    "delivered": 20.0,
+    "utilisation": 10.0,
+    "distance_km": 0.25,
+}
+MAX_ASSIGNMENT_KM = 150
+INFEASIBLE_COST = 1e9
+OPEN_TRIP_STATUSES = ("assigned", "in_transit")
+# Allowed trip status changes (delivered / cancelled are final)
+TRIP_TRANSITIONS = {
+    "assigned": {"in_transit", "delivered", "cancelled"},
+    "in_transit": {"delivered", "cancelled"},
+}
+
+
+def solve_assignment(
+    priority: np.ndarray,
+    demand: np.ndarray,
+    capacity: np.ndarray,
+    distance_km: np.ndarray,
+):
+    """
+    Optimal one-tanker-per-village assignment.
+    priority/demand are per village, capacity per tanker, distance_km is (tankers, villages).
+    Returns (tanker_idx, village_idx) arrays; pairs beyond MAX_ASSIGNMENT_KM are dropped.
+    """
+    n_tankers, n_villages = distance_km.shape
+    if n_tankers == 0 or n_villages == 0:
+        return np.array([], dtype=int), np.array([], dtype=int)
+
+    delivered = np.minimum(capacity[:, None], demand[None, :]).astype(float)
+    cost = distance_km * ASSIGNMENT_WEIGHTS["distance_km"]
+    cost -= priority[None, :] * ASSIGNMENT_WEIGHTS["priority"]
+    cost -= delivered * (ASSIGNMENT_WEIGHTS["delivered"] / capacity.max())
+    delivered /= np.maximum(capacity, 1)[:, None]
+    cost -= delivered * ASSIGNMENT_WEIGHTS["utilisation"]
+    cost[distance_km > MAX_ASSIGNMENT_KM] = INFEASIBLE_COST
+
+    # With more villages than tankers, each tanker's optimal village is among its
+    # n_tankers cheapest (one of those is always free to swap to), so drop the rest.
+    columns = np.arange(n_villages)
+    if n_villages > 2 * n_tankers:
+        columns = np.unique(np.argpartition(cost, n_tankers - 1, axis=1)[:, :n_tankers])
+        cost = cost[:, columns]
+
+    rows, cols = linear_sum_assignment(cost)
+    feasible = cost[rows, cols] < INFEASIBLE_COST
+    return rows[feasible], columns[cols[feasible]]
 
 
 class AllocationEngine:
@@ -19,15 +80,26 @@ class AllocationEngine:
         "pending_requests": 0.10,
     }
 
+    SEVERITY_SCORES = {
+        "normal": 10,
+        "watch": 30,
+        "warning": 55,
+        "critical": 80,
+        "emergency": 100,
+    }
+
+    QUANTITY_MULTIPLIERS = {
+        "normal": 0.5,
+        "watch": 0.7,
+        "warning": 1.0,
+        "critical": 1.3,
+        "emergency": 1.5,
+    }
+
+    NEVER_SUPPLIED_DAYS = 30
+
     def _severity_score(self, severity: str) -> float:
-        mapping = {
-            "normal": 10,
-            "watch": 30,
-            "warning": 55,
-            "critical": 80,
-            "emergency": 100,
-        }
-        return mapping.get(severity, 50)
+        return self.SEVERITY_SCORES.get(severity, 50)
 
     def _days_since_last_supply(self, db: Session, village_id: int) -> int:
         last_trip = db.query(Trip).filter(
@@ -36,7 +108,7 @@ class AllocationEngine:
         ).order_by(Trip.completed_at.desc()).first()
 
         if not last_trip or not last_trip.completed_at:
-            return 30  # assume 30 days if never supplied
+            return self.NEVER_SUPPLIED_DAYS  # assume 30 days if never supplied
         return (datetime.utcnow() - last_trip.completed_at).days
 
     def _pending_request_count(self, db: Session, village_id: int) -> int:
@@ -85,56 +157,340 @@ class AllocationEngine:
     def _recommend_quantity(self, village: Village, wsi: WaterStressRecord) -> int:
         """Recommend water quantity based on population and severity."""
         base = village.population * 20  # 20 liters per person per day
-        multiplier = {
-            "normal": 0.5,
-            "watch": 0.7,
-            "warning": 1.0,
-            "critical": 1.3,
-            "emergency": 1.5,
-        }.get(wsi.severity, 1.0)
+        multiplier = self.QUANTITY_MULTIPLIERS.get(wsi.severity, 1.0)
         return int(base * multiplier)
 
+    def ranking_rows(
+        self, db: Session, village_ids: Optional[List[int]] = None, district: Optional[str] = None
+    ) -> List[tuple]:
+        """
+        (village, latest WSI, last delivery, pending requests) for every village
+        with a WSI record, in a single query.
+        """
+        last_delivery = db.query(
+            Trip.village_id.label("village_id"),
+            func.max(Trip.completed_at).label("completed_at"),
+        ).filter(
+            Trip.status == "delivered",
+            Trip.completed_at.isnot(None),
+        ).group_by(Trip.village_id).subquery()
+
+        pending = db.query(
+            WaterRequest.village_id.label("village_id"),
+            func.count(WaterRequest.id).label("requests"),
+        ).filter(
+            WaterRequest.status.in_(["pending", "approved"])
+        ).group_by(WaterRequest.village_id).subquery()
+
+        query = db.query(
+            Village, WaterStressRecord, last_delivery.c.completed_at, pending.c.requests
+        ).join(
+            LatestWSI, LatestWSI.village_id == Village.id
+        ).join(
+            WaterStressRecord, WaterStressRecord.id == LatestWSI.record_id
+        ).outerjoin(
+            last_delivery, last_delivery.c.village_id == Village.id
+        ).outerjoin(
+            pending, pending.c.village_id == Village.id
+        )
+        if village_ids is not None:
+            query = query.filter(Village.id.in_(village_ids))
+        if district:
+            query = query.filter(Village.district == district)
+        return query.all()
+
+    def score_rows(self, rows: List[tuple]) -> Dict[str, Any]:
+        """Vectorised priority scoring of ranking_rows() output."""
+        villages = [row[0] for row in rows]
+        records = [row[1] for row in rows]
+        population = np.array([v.population for v in villages], dtype=float)
+        severity_score = np.array([self._severity_score(r.severity) for r in records], dtype=float)
+        multiplier = np.array([self.QUANTITY_MULTIPLIERS.get(r.severity, 1.0) for r in records])
+
+        now = np.datetime64(datetime.utcnow(), "us")
+        completed = np.array([row[2] or now for row in rows], dtype="datetime64[us]")
+        days = (now - completed) // np.timedelta64(1, "D")
+        days = np.where([row[2] is None for row in rows], self.NEVER_SUPPLIED_DAYS, days).astype(int)
+        requests = np.array([row[3] or 0 for row in rows], dtype=int)
+
+        pop_score = np.minimum(100, (population / 50000) * 100)
+        days_score = np.minimum(100, (days / 30) * 100)
+        request_score = np.minimum(100, requests * 25)
+        priority = (
+            severity_score * self.WEIGHTS["severity"] +
+            pop_score * self.WEIGHTS["population"] +
+            days_score * self.WEIGHTS["days_since_supply"] +
+            request_score * self.WEIGHTS["pending_requests"]
+        )
+
+        return {
+            "villages": villages,
+            "records": records,
+            "ids": np.array([v.id for v in villages]),
+            "priority": round1(np.clip(priority, 0, 100)),
+            "severity_score": severity_score,
+            "pop_score": pop_score,
+            "days": days,
+            "days_score": days_score,
+            "requests": requests,
+            "request_score": request_score,
+            "recommended": (population * 20 * multiplier).astype(np.int64),
+        }
+
+    def _entry(self, scored: Dict[str, Any], i: int) -> Dict:
+        village, record = scored["villages"][i], scored["records"][i]
+        return {
+            "village_id": village.id,
+            "village_name": village.name,
+            "district": village.district,
+            "taluka": village.taluka,
+            "priority_score": float(scored["priority"][i]),
+            "wsi_score": record.wsi_score,
+            "severity": record.severity,
+            "population": village.population,
+            "days_since_last_supply": int(scored["days"][i]),
+            "pending_requests": int(scored["requests"][i]),
+            "recommended_liters": int(scored["recommended"][i]),
+            "components": {
+                "severity": {"score": float(scored["severity_score"][i]), "weight": self.WEIGHTS["severity"]},
+                "population": {"score": float(scored["pop_score"][i]), "weight": self.WEIGHTS["population"]},
+                "days_since_supply": {"score": float(scored["days_score"][i]), "weight": self.WEIGHTS["days_since_supply"]},
+                "pending_requests": {"score": int(scored["request_score"][i]), "weight": self.WEIGHTS["pending_requests"]},
+            },
+        }
+
+    def score_villages(self, db: Session, village_ids: Optional[List[int]] = None) -> List[Dict]:
+        """Priority entries (unordered) for the given villages, or all villages with a WSI record."""
+        rows = self.ranking_rows(db, village_ids)
+        if not rows:
+            return []
+        scored = self.score_rows(rows)
+        return [self._entry(scored, i) for i in range(len(rows))]
+
     def get_prioritized_villages(self, db: Session, limit: int = 20) -> List[Dict]:
-        """Get ranked list of villages by priority score."""
-        villages = db.query(Village).all()
-        results = []
-
-        for village in villages:
-            wsi = db.query(WaterStressRecord).filter(
-                WaterStressRecord.village_id == village.id
-            ).order_by(WaterStressRecord.date.desc()).first()
-
-            if wsi:
-                results.append(self.calculate_priority(db, village, wsi))
-
-        results.sort(key=lambda x: x["priority_score"], reverse=True)
-        return results[:limit]
-
-    def allocate_tankers(self, db: Session) -> List[Dict]:
-        """Auto-allocate available tankers to highest-priority villages."""
-        prioritized = self.get_prioritized_villages(db, limit=50)
-        available_tankers = db.query(Tanker).filter(
-            Tanker.status == "available"
-        ).all()
+        """Get ranked list of villages by priority score (ties broken by village id)."""
+        rows = self.ranking_rows(db)
+        if not rows:
+            return []
+        scored = self.score_rows(rows)
+        priority, ids = scored["priority"], scored["ids"]
 
-        allocations = []
-        for i, village_data in enumerate(prioritized):
-            if i >= len(available_tankers):
-                break
+        # Top-K: keep everything tied with the K-th score, then order by (score desc, id asc)
+        if limit < len(rows):
+            kth = np.partition(priority, len(rows) - limit)[len(rows) - limit]
+            candidates = np.flatnonzero(priority >= kth)
+        else:
+            candidates = np.arange(len(rows))
+        order = candidates[np.lexsort((ids[candidates], -priority[candidates]))][:limit]
+        return [self._entry(scored, i) for i in order]
+
+    def allocate_tankers(self, db: Session, district: Optional[str] = None) -> List[Dict]:
+        """Auto-allocate available tankers to villages by optimal assignment, highest priority first."""
+        rows = self.ranking_rows(db, district=district)
+        tanker_query = db.query(Tanker).filter(Tanker.status == "available")
+        if district:
+            tanker_query = tanker_query.filter(Tanker.district == district)
+        available_tankers = tanker_query.order_by(Tanker.id).all()
+        if not rows or not available_tankers:
+            return []
+
+        scored = self.score_rows(rows)
+        villages = scored["villages"]
+        # Current position, falling back to the depot
+        tanker_lat = np.array([
+            t.current_latitude if t.current_latitude is not None else t.depot_latitude
+            for t in available_tankers
+        ], dtype=float)
+        tanker_lng = np.array([
+            t.current_longitude if t.current_longitude is not None else t.depot_longitude
+            for t in available_tankers
+        ], dtype=float)
+        distance = haversine_matrix(
+            tanker_lat, tanker_lng,
+            [v.latitude for v in villages], [v.longitude for v in villages],
+        )
+        distance = np.nan_to_num(distance, nan=0.0)  # position unknown: rank on priority/capacity only
+        capacity = np.array([t.capacity_liters for t in available_tankers], dtype=float)
 
-            tanker = available_tankers[i]
+        tanker_idx, village_idx = solve_assignment(
+            scored["priority"], scored["recommended"], capacity, distance
+        )
+        order = np.lexsort((scored["ids"][village_idx], -scored["priority"][village_idx]))
+
+        allocations = []
+        for k in order:
+            t, v = tanker_idx[k], village_idx[k]
+            tanker = available_tankers[t]
             allocations.append({
-                **village_data,
+                **self._entry(scored, v),
+                "assigned_liters": int(min(tanker.capacity_liters, scored["recommended"][v])),
                 "assigned_tanker": {
                     "id": tanker.id,
                     "registration": tanker.registration_number,
                     "capacity": tanker.capacity_liters,
                     "driver": tanker.driver_name,
                     "driver_phone": tanker.driver_phone,
+                    "distance_km": round(float(distance[t, v]), 2),
                 },
             })
 
         return allocations
 
+    def _claim(self, db: Session, tanker_ids: List[int]) -> set:
+        """
+        Atomically flip available -> on_trip; returns the ids this run actually won.
+        Only the assigned tankers are touched, so a concurrent run loses just the
+        tankers both solutions picked, not the whole fleet.
+        """
+        if not tanker_ids:
+            return set()
+        claimed = db.execute(
+            update(Tanker)
+            .where(Tanker.id.in_(tanker_ids), Tanker.status == "available")
+            .values(status="on_trip")
+            .returning(Tanker.id)
+            .execution_options(synchronize_session=False)
+        ).scalars().all()
+        return set(claimed)
+
+    def run_auto_allocation(
+        self, db: Session, idempotency_key: Optional[str] = None, district: Optional[str] = None
+    ) -> Dict:
+        """
+        Allocate and persist: reserves tankers, writes one Trip per assignment and
+        records the run, all in one transaction. Repeating an idempotency key
+        returns the stored result of the first run instead of allocating again.
+        """
+        key = idempotency_key or uuid.uuid4().hex
+        existing = db.query(AllocationRun).filter(AllocationRun.idempotency_key == key).first()
+        if existing:
+            return self._replay(existing)
+
+        run = AllocationRun(idempotency_key=key, district=district, status="running")
+        db.add(run)
+        try:
+            db.flush()
+        except IntegrityError:
+            # Another request with the same key won the insert
+            db.rollback()
+            return self._replay(db.query(AllocationRun).filter(AllocationRun.idempotency_key == key).one())
+
+        try:
+            allocations = self.allocate_tankers(db, district)
+            claimed = self._claim(db, [a["assigned_tanker"]["id"] for a in allocations])
+            allocations = [a for a in allocations if a["assigned_tanker"]["id"] in claimed]
+
+            now = datetime.utcnow()
+            trips = [
+                Trip(
+                    tanker_id=a["assigned_tanker"]["id"],
+                    village_id=a["village_id"],
+                    status="assigned",
+                    quantity_liters=a["assigned_liters"],
+                    priority_score=a["priority_score"],
+                    scheduled_at=now,
+                    route_distance_km=a["assigned_tanker"]["distance_km"],
+                    notes=f"auto-allocation {key}",
+                )
+                for a in allocations
+            ]
+            db.add_all(trips)
+            db.flush()
+            db.add_all(AllocationRunTrip(trip_id=trip.id, run_id=run.id) for trip in trips)
+            for allocation, trip in zip(allocations, trips):
+                allocation["trip_id"] = trip.id
+
+            run.status = "completed"
+            run.trips_created = len(trips)
+            run.completed_at = now
+            run.result = {
+                "run_id": run.id,
+                "idempotency_key": key,
+                "district": district,
+                "trips_created": len(trips),
+                "allocations": allocations,
+            }
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        # The claim is a bulk update the change feed does not see
+        spatial_index.mark_tankers(claimed)
+        return {**run.result, "replayed": False}
+
+    def _release(self, db: Session, tanker_ids: List[int]) -> List[int]:
+        """on_trip -> available for tankers left without an open trip (ORM updates, so the change feed sees them)."""
+        busy = {
+            row[0] for row in db.query(Trip.tanker_id).filter(
+                Trip.tanker_id.in_(tanker_ids), Trip.status.in_(OPEN_TRIP_STATUSES)
+            ).distinct()
+        }
+        released = []
+        for tanker in db.query(Tanker).filter(Tanker.id.in_(tanker_ids), Tanker.status == "on_trip").all():
+            if tanker.id not in busy:
+                tanker.status = "available"
+                released.append(tanker.id)
+        return released
+
+    def update_trip_status(self, db: Session, trip_id: int, status: str) -> Optional[Dict]:
+        """
+        Move a trip along assigned -> in_transit -> delivered (or cancelled) and
+        return its tanker to the pool once it has no open trip. Returns None for
+        an unknown trip; raises ValueError for a transition that isn't allowed.
+        """
+        trip = db.query(Trip).filter(Trip.id == trip_id).first()
+        if trip is None:
+            return None
+        if status not in TRIP_TRANSITIONS.get(trip.status, set()):
+            raise ValueError(f"Cannot move a {trip.status} trip to {status}")
+        now = datetime.utcnow()
+        trip.status = status
+        if status == "in_transit":
+            trip.started_at = now
+        elif status == "delivered":
+            trip.completed_at = now
+        db.flush()
+        released = self._release(db, [trip.tanker_id]) if status in ("delivered", "cancelled") else []
+        db.commit()
+        return {"id": trip.id, "status": trip.status, "tanker_id": trip.tanker_id, "tanker_released": bool(released)}
+
+    def expire_reservations(self, db: Session, now: Optional[datetime] = None) -> Dict:
+        """
+        Cancel trips reserved by an allocation run that are still 'assigned' after
+        TRIP_RESERVATION_HOURS, and release their tankers plus any other run
+        tanker left on_trip with no open trip. Manual and seeded trips are untouched.
+        """
+        now = now or datetime.utcnow()
+        cutoff = now - timedelta(hours=TRIP_RESERVATION_HOURS)
+        stale = db.query(Trip).join(AllocationRunTrip, AllocationRunTrip.trip_id == Trip.id).filter(
+            Trip.status == "assigned", Trip.scheduled_at < cutoff
+        ).all()
+        for trip in stale:
+            trip.status = "cancelled"
+            trip.notes = f"{trip.notes or ''} [reservation expired]".strip()
+        db.flush()
+        run_tankers = [
+            row[0] for row in db.query(Tanker.id).join(Trip, Trip.tanker_id == Tanker.id)
+            .join(AllocationRunTrip, AllocationRunTrip.trip_id == Trip.id)
+            .filter(Tanker.status == "on_trip").distinct()
+        ]
+        released = self._release(db, run_tankers) if run_tankers else []
+        db.commit()
+        return {"trips_cancelled": len(stale), "tankers_released": len(released)}
+
+    @staticmethod
+    def _replay(run: AllocationRun) -> Dict:
+        if run.status != "completed":
+            return {
+                "run_id": run.id,
+                "idempotency_key": run.idempotency_key,
+                "district": run.district,
+                "status": run.status,
+                "trips_created": 0,
+                "allocations": [],
+                "replayed": True,
+            }
+        return {**run.result, "replayed": True}
+
 
 allocation_engine = AllocationEngine()
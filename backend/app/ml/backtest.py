@@ -0,0 +1,321 @@
+"""
+Rolling-origin backtest for the drought predictor.
+Historical rainfall, groundwater and trips are bucketed onto a monthly grid. At
+every origin month the predictor state (linear trends, Holt-Winters fits) is
+rebuilt from data up to that month only, projected over the horizons and scored
+against the WSI observed at each target month (recomputed from the same
+components the live calculator uses). Each origin is one fold; folds run in the
+ensemble process pool and record their own wall time and peak traced memory.
+"""
+import time
+import tracemalloc
+from concurrent.futures import FIRST_COMPLETED, wait
+from datetime import datetime
+from typing import Dict, List, Sequence
+
+import numpy as np
+from sqlalchemy.orm import Session
+
+from app.models import Village, RainfallData, GroundwaterData, Trip
+from app.ml.wsi_calculator import WaterStressCalculator, round1
+from app.ml.wsi_aggregates import RAINFALL_WINDOW_DAYS, GROUNDWATER_READINGS, TRIP_WINDOW_DAYS
+from app.ml.ensemble import trend_fit
+from app.ml.process_pool import get_pool
+from app.ml.seasonal import fit_holt_winters
+from app.ml.drought_predictor import DroughtPredictor, drought_predictor, MODEL_VERSION, SEASONAL_HISTORY
+
+DEFAULT_HORIZONS = (30, 60, 90)
+MIN_HISTORY_MONTHS = 6
+TREND_WINDOW = 12  # readings per linear trend fit, as in DroughtPredictor.trend_inputs
+MODELS = ("persistence", "linear-trend", "holt-winters")
+
+_calculator = WaterStressCalculator()
+
+
+def _month_label(month_index: int) -> str:
+    return f"{month_index // 12}-{month_index % 12 + 1:02d}"
+
+
+def load_history(db: Session) -> Dict[str, np.ndarray]:
+    """Monthly (villages x months) grids; months without a reading are NaN (trips: 0)."""
+    villages = db.query(Village.id, Village.population).order_by(Village.id).all()
+    index = {vid: i for i, (vid, _) in enumerate(villages)}
+    rain = db.query(RainfallData.village_id, RainfallData.date, RainfallData.rainfall_mm, RainfallData.normal_rainfall_mm).all()
+    gw = db.query(GroundwaterData.village_id, GroundwaterData.date, GroundwaterData.level_meters).order_by(GroundwaterData.date).all()
+    trips = db.query(Trip.village_id, Trip.created_at).filter(Trip.created_at.isnot(None)).all()
+
+    dates = [r[1] for r in rain] + [r[1] for r in gw]
+    if not villages or not dates:
+        return {}
+    first = min(d.year * 12 + d.month - 1 for d in dates)
+    last = max(d.year * 12 + d.month - 1 for d in dates)
+    n, t = len(villages), last - first + 1
+
+    def cells(rows):
+        rows = [r for r in rows if r[0] in index and first <= r[1].year * 12 + r[1].month - 1 <= last]
+        return (
+            np.array([index[r[0]] for r in rows], dtype=int),
+            np.array([r[1].year * 12 + r[1].month - 1 - first for r in rows], dtype=int),
+            rows,
+        )
+
+    # Rainfall: monthly totals of actual and normal
+    i, m, rows = cells(rain)
+    rain_actual, rain_normal, rain_count = np.zeros((n, t)), np.zeros((n, t)), np.zeros((n, t))
+    np.add.at(rain_actual, (i, m), [r[2] for r in rows])
+    np.add.at(rain_normal, (i, m), [r[3] or 0 for r in rows])
+    np.add.at(rain_count, (i, m), 1)
+
+    # Groundwater: newest reading in each month (rows are date-ordered)
+    i, m, rows = cells(gw)
+    groundwater = np.full((n, t), np.nan)
+    if rows:
+        _, last_seen = np.unique((i * t + m)[::-1], return_index=True)
+        keep = len(rows) - 1 - last_seen
+        groundwater[i[keep], m[keep]] = np.array([r[2] for r in rows])[keep]
+
+    i, m, rows = cells(trips)
+    trip_count = np.zeros((n, t))
+    np.add.at(trip_count, (i, m), 1)
+
+    return {
+        "village_ids": np.array([v[0] for v in villages]),
+        "population": np.array([v[1] for v in villages], dtype=float),
+        "first_month": first,
+        "rainfall": np.where(rain_count > 0, rain_actual, np.nan),
+        "rain_actual": rain_actual,
+        "rain_normal": rain_normal,
+        "rain_count": rain_count,
+        "groundwater": groundwater,
+        "trips": trip_count,
+    }
+
+
+def _window(grid: np.ndarray, origin: int, limit: int):
+    """
+    Last `limit` non-NaN values up to and including `origin`, per row, left-aligned
+    (oldest first) and zero-padded. Returns (values, counts, month index of newest value).
+    """
+    history = grid[:, :origin + 1]
+    valid = ~np.isnan(history)
+    from_end = valid[:, ::-1].cumsum(axis=1)[:, ::-1]  # valid points at or after each column
+    counts = np.minimum(valid.sum(axis=1), limit)
+    keep = valid & (from_end <= limit)
+    rows, cols = np.nonzero(keep)
+    values = np.zeros((len(grid), limit))
+    values[rows, counts[rows] - from_end[rows, cols]] = history[rows, cols]
+    newest = np.where(valid.any(axis=1), origin - np.argmax(valid[:, ::-1], axis=1), -1)
+    return values, counts, newest
+
+
+def observed_wsi(history: Dict[str, np.ndarray], month: int):
+    """WSI at the end of `month` from the live calculator's component windows. Returns (wsi, known)."""
+    rain_months = max(1, RAINFALL_WINDOW_DAYS // 30)
+    trip_months = max(1, TRIP_WINDOW_DAYS // 30)
+    lo = max(0, month - rain_months + 1)
+    gw, gw_count, _ = _window(history["groundwater"], month, GROUNDWATER_READINGS)
+    rows = np.arange(len(gw))
+    raw = {
+        "rain_actual": history["rain_actual"][:, lo:month + 1].sum(axis=1),
+        "rain_normal": history["rain_normal"][:, lo:month + 1].sum(axis=1),
+        "rain_count": history["rain_count"][:, lo:month + 1].sum(axis=1),
+        "gw_recent": gw[rows, np.maximum(gw_count - 1, 0)],
+        "gw_oldest": gw[:, 0],
+        "gw_count": gw_count,
+        "trips": history["trips"][:, max(0, month - trip_months + 1):month + 1].sum(axis=1),
+    }
+    rainfall, groundwater, demand = _calculator._component_scores(raw)
+    population = _calculator._population_scores(history["population"])
+    known = (raw["rain_count"] > 0) & (raw["rain_normal"] != 0) & (gw_count >= 2)
+    return _calculator._weighted_wsi(rainfall, groundwater, population, demand), known
+
+
+def run_fold(history: Dict[str, np.ndarray], origin: int, horizons: Sequence[int]) -> Dict:
+    """Score every model at one origin month. Pure NumPy so it can run in a worker process."""
+    tracing = tracemalloc.is_tracing()
+    if not tracing:
+        tracemalloc.start()
+    tracemalloc.reset_peak()
+    started = time.perf_counter()
+
+    days = np.asarray(horizons, dtype=int)
+    months_ahead = days / 30
+    steps = np.maximum(1, np.rint(months_ahead).astype(int))
+    current, known = observed_wsi(history, origin)
+    targets = [observed_wsi(history, origin + s) for s in steps]
+    actual = np.stack([wsi for wsi, _ in targets], axis=1)
+    scored = known[:, None] & np.stack([k for _, k in targets], axis=1)
+
+    # Linear trend over the last readings (as DroughtPredictor.trend_inputs)
+    rain, rain_counts, _ = _window(history["rainfall"], origin, TREND_WINDOW)
+    gw, gw_counts, _ = _window(history["groundwater"], origin, TREND_WINDOW)
+    rain_trend, gw_trend = trend_fit(rain, rain_counts)[0], trend_fit(gw, gw_counts)[0]
+    rainfall_change = rain_trend[:, None] * months_ahead
+    gw_change = gw_trend[:, None] * months_ahead
+    linear = round1(DroughtPredictor.wsi_from_changes(current[:, None], rainfall_change, gw_change))
+
+    # Holt-Winters refitted on the history available at the origin; linear where a series is missing
+    rain, rain_counts, rain_newest = _window(history["rainfall"], origin, SEASONAL_HISTORY)
+    gw, gw_counts, gw_newest = _window(history["groundwater"], origin, SEASONAL_HISTORY)
+    fittable = np.flatnonzero((rain_counts > 0) & (gw_counts > 0))
+    seasonal_change, seasonal_gw_change = rainfall_change.copy(), gw_change.copy()
+    if len(fittable):
+        first = history["first_month"]
+        newest = np.concatenate([rain_newest[fittable], gw_newest[fittable]])
+        fitted = fit_holt_winters(
+            np.vstack([rain[fittable], gw[fittable]]),
+            np.concatenate([rain_counts[fittable], gw_counts[fittable]]),
+            (first + newest) % 12 + 1,
+        )
+        k = len(fittable)
+        seasonal_change[fittable], seasonal_gw_change[fittable] = DroughtPredictor.seasonal_changes(
+            fitted["trend"][:k],
+            fitted["trend"][k:],
+            fitted["seasonal"][k:],
+            (first + origin) % 12,
+            (first + origin + steps) % 12,
+            months_ahead,
+        )
+    holt_winters = round1(DroughtPredictor.wsi_from_changes(current[:, None], seasonal_change, seasonal_gw_change))
+
+    predictions = {
+        "persistence": np.repeat(current[:, None], len(days), axis=1),
+        "linear-trend": linear,
+        "holt-winters": holt_winters,
+    }
+    actual_severity = _calculator.severity_index(actual)
+    metrics = {
+        name: {
+            "abs_error": np.where(scored, np.abs(predicted - actual), 0.0).sum(axis=0).tolist(),
+            "hits": (scored & (_calculator.severity_index(predicted) == actual_severity)).sum(axis=0).tolist(),
+        }
+        for name, predicted in predictions.items()
+    }
+
+    wall = time.perf_counter() - started
+    peak = tracemalloc.get_traced_memory()[1]
+    if not tracing:
+        tracemalloc.stop()
+    return {
+        "origin": _month_label(history["first_month"] + origin),
+        "villages": len(current),
+        "samples": scored.sum(axis=0).tolist(),
+        "metrics": metrics,
+        "wall_s": wall,
+        "peak_memory_bytes": peak,
+    }
+
+
+def _per_1k(value: float, villages: int) -> float:
+    return value * 1000 / max(villages, 1)
+
+
+def run_backtest(
+    db: Session,
+    horizons: Sequence[int] = DEFAULT_HORIZONS,
+    workers: int = 1,
+    min_history: int = MIN_HISTORY_MONTHS,
+) -> Dict:
+    """Run every rolling-origin fold and return a JSON-serialisable report."""
+    started = time.perf_counter()
+    horizons = sorted(set(int(h) for h in horizons))
+    history = load_history(db)
+    if not history:
+        return {"error": "no rainfall / groundwater history to backtest"}
+
+    months = history["rainfall"].shape[1]
+    max_step = max(1, round(max(horizons) / 30))
+    origins = list(range(min_history - 1, months - max_step))
+    if workers > 1 and len(origins) > 1:
+        # The pool is shared; keep at most `workers` folds queued on it at a time
+        pool, results, pending = get_pool(), {}, {}
+        for i, origin in enumerate(origins):
+            if len(pending) >= workers:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                results.update((pending.pop(f), f.result()) for f in done)
+            pending[pool.submit(run_fold, history, origin, horizons)] = i
+        results.update((pending[f], f.result()) for f in pending)
+        folds = [results[i] for i in range(len(origins))]
+    else:
+        folds = [run_fold(history, origin, horizons) for origin in origins]
+
+    metrics = {}
+    for name in MODELS:
+        metrics[name] = {}
+        for j, h in enumerate(horizons):
+            samples = sum(f["samples"][j] for f in folds)
+            abs_error = sum(f["metrics"][name]["abs_error"][j] for f in folds)
+            hits = sum(f["metrics"][name]["hits"][j] for f in folds)
+            metrics[name][str(h)] = {
+                "mae": round(abs_error / samples, 3) if samples else None,
+                "severity_hit_rate": round(hits / samples, 4) if samples else None,
+                "samples": samples,
+            }
+
+    villages = len(history["village_ids"])
+    throughput = {"backtest_wall_s": None}
+    if folds:
+        throughput.update({
+            "fold_wall_s_per_1k_villages": round(_per_1k(np.mean([f["wall_s"] for f in folds]), villages), 4),
+            "fold_peak_mb_per_1k_villages": round(_per_1k(max(f["peak_memory_bytes"] for f in folds) / 2 ** 20, villages), 3),
+        })
+
+    # Live predictor on the current data, for run-over-run speed comparison
+    tracing = tracemalloc.is_tracing()
+    if not tracing:
+        tracemalloc.start()
+    tracemalloc.reset_peak()
+    live_started = time.perf_counter()
+    drought_predictor.predict_matrix(db, horizons)
+    live_wall = time.perf_counter() - live_started
+    live_peak = tracemalloc.get_traced_memory()[1]
+    if not tracing:
+        tracemalloc.stop()
+    throughput.update({
+        "predict_matrix_wall_s_per_1k_villages": round(_per_1k(live_wall, villages), 4),
+        "predict_matrix_peak_mb_per_1k_villages": round(_per_1k(live_peak / 2 ** 20, villages), 3),
+    })
+    throughput["backtest_wall_s"] = round(time.perf_counter() - started, 3)
+
+    return {
+        "generated_at": datetime.utcnow().isoformat(),
+        "model_version": MODEL_VERSION,
+        "villages": villages,
+        "history": {
+            "from": _month_label(history["first_month"]),
+            "to": _month_label(history["first_month"] + months - 1),
+            "months": months,
+        },
+        "horizons_days": horizons,
+        "workers": workers,
+        "metrics": metrics,
+        "throughput": throughput,
+        "folds": [
+            {
+                "origin": f["origin"],
+                "samples": f["samples"],
+                "wall_s": round(f["wall_s"], 4),
+                "peak_memory_mb": round(f["peak_memory_bytes"] / 2 ** 20, 3),
+            }
+            for f in folds
+        ],
+    }
+
+
+def compare_reports(current: Dict, baseline: Dict) -> List[str]:
+    """Human-readable MAE / hit-rate / throughput deltas between two reports."""
+    lines = []
+    for name, by_horizon in current.get("metrics", {}).items():
+        for h, m in by_horizon.items():
+            base = baseline.get("metrics", {}).get(name, {}).get(h)
+            if not base or m["mae"] is None or base["mae"] is None:
+                continue
+            lines.append(
+                f"{name:>13} {h:>4}d  MAE {base['mae']:.3f} -> {m['mae']:.3f} ({m['mae'] - base['mae']:+.3f})  "
+                f"hit-rate {base['severity_hit_rate']:.3f} -> {m['severity_hit_rate']:.3f}"
+            )
+    for key, value in current.get("throughput", {}).items():
+        base = baseline.get("throughput", {}).get(key)
+        if isinstance(value, (int, float)) and isinstance(base, (int, float)):
+            lines.append(f"{key}: {base} -> {value}")
+    return lines
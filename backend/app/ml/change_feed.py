@@ -0,0 +1,69 @@
+"""
+In-process change feed.
+Collects the villages touched by each flush and, once the transaction commits,
+notifies subscribers with {kind: {village_id, ...}} (tanker ids for "tanker"). Rolled-back work is never
+published. Bulk query.update()/delete() calls bypass the ORM unit of work and
+are not seen here, so consumers should still rebuild periodically.
+"""
+import logging
+from typing import Callable, Dict, List, Set
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from app.models import Village, WaterRequest, Trip, LatestWSI, Tanker
+
+logger = logging.getLogger("jalmitra.change_feed")
+
+# Model -> change kind published to subscribers
+TRACKED = {
+    WaterRequest: "request",
+    Trip: "trip",
+    LatestWSI: "wsi",
+    Village: "village",
+    Tanker: "tanker",
+}
+PENDING_KEY = "changed_villages"
+
+Subscriber = Callable[[Dict[str, Set[int]]], None]
+_subscribers: List[Subscriber] = []
+
+
+def subscribe(callback: Subscriber):
+    """Register a callback invoked after every commit that touched tracked rows."""
+    if callback not in _subscribers:
+        _subscribers.append(callback)
+
+
+def unsubscribe(callback: Subscriber):
+    if callback in _subscribers:
+        _subscribers.remove(callback)
+
+
+@event.listens_for(Session, "after_flush")
+def _collect(session: Session, flush_context):
+    pending: Dict[str, Set[int]] = session.info.setdefault(PENDING_KEY, {})
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        kind = TRACKED.get(type(obj))
+        if kind is None:
+            continue
+        key = obj.id if kind in ("village", "tanker") else obj.village_id
+        if key is not None:
+            pending.setdefault(kind, set()).add(key)
+
+
+@event.listens_for(Session, "after_commit")
+def _publish(session: Session):
+    changes = session.info.pop(PENDING_KEY, None)
+    if not changes:
+        return
+    for callback in list(_subscribers):
+        try:
+            callback(changes)
+        except Exception as e:
+            logger.error(f"Change feed subscriber failed: {e}")
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard(session: Session):
+    session.info.pop(PENDING_KEY, None)
@@ -0,0 +1,137 @@
+"""
+Haversine distance matrices for the routing solvers.
+Matrices are built with NumPy broadcasting in row blocks (bounded temporaries,
+no per-pair Python loops) and cached by a hash of the coordinate set. A request
+that mostly overlaps a cached matrix is derived from it: surviving rows and
+columns are copied and only the rows / columns of added points are computed.
+"""
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional
+
+import numpy as np
+
+EARTH_RADIUS_KM = 6371
+BLOCK_ROWS = 1024
+MIN_REUSE_FRACTION = 0.5  # derive from a cached matrix only if it covers this share of the points
+
+
+def haversine_matrix(lats1, lngs1, lats2, lngs2, dtype=np.float64) -> np.ndarray:
+    """Pairwise great-circle distances in km, shape (len(lats1), len(lats2)), unrounded."""
+    lat1 = np.radians(np.asarray(lats1, dtype=float))
+    lng1 = np.radians(np.asarray(lngs1, dtype=float))
+    lat2 = np.radians(np.asarray(lats2, dtype=float))[None, :]
+    lng2 = np.radians(np.asarray(lngs2, dtype=float))[None, :]
+    cos2 = np.cos(lat2)
+    out = np.empty((len(lat1), lat2.shape[1]), dtype=dtype)
+    for lo in range(0, len(lat1), BLOCK_ROWS):
+        la1 = lat1[lo:lo + BLOCK_ROWS, None]
+        lo1 = lng1[lo:lo + BLOCK_ROWS, None]
+        a = np.sin((lat2 - la1) / 2) ** 2
+        b = np.sin((lng2 - lo1) / 2) ** 2
+        b *= np.cos(la1) * cos2
+        a += b
+        np.minimum(a, 1.0, out=a)
+        np.sqrt(a, out=a)
+        np.arcsin(a, out=a)
+        out[lo:lo + BLOCK_ROWS] = 2 * EARTH_RADIUS_KM * a
+    return out
+
+
+def haversine_pairs(lats1, lngs1, lats2, lngs2) -> np.ndarray:
+    """Element-wise great-circle distances in km between point i of each list, unrounded."""
+    lat1, lng1, lat2, lng2 = (np.radians(np.asarray(x, dtype=float)) for x in (lats1, lngs1, lats2, lngs2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lng2 - lng1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+
+def point_keys(lats, lngs) -> np.ndarray:
+    """One int64 per point from its coordinates quantised to 1e-6 degrees (~0.1 m)."""
+    qlat = np.rint((np.asarray(lats, dtype=float) + 90) * 1e6).astype(np.int64)
+    qlng = np.rint((np.asarray(lngs, dtype=float) + 180) * 1e6).astype(np.int64)
+    return qlat * 400_000_000 + qlng
+
+
+def coordinate_hash(keys: np.ndarray, dtype) -> str:
+    return hashlib.sha1(np.dtype(dtype).str.encode() + keys.tobytes()).hexdigest()
+
+
+class DistanceMatrixCache:
+    """LRU of square distance matrices keyed by coordinate-set hash, bounded by total bytes."""
+
+    def __init__(self, max_bytes: int = 512 * 2 ** 20):
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[str, Dict]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "derived": 0, "built": 0}
+
+    def get(self, lats, lngs, dtype=np.float32) -> np.ndarray:
+        """Read-only (n, n) matrix for the points in the given order."""
+        keys = point_keys(lats, lngs)
+        digest = coordinate_hash(keys, dtype)
+        with self._lock:
+            entry = self._entries.get(digest)
+            if entry is not None:
+                self._entries.move_to_end(digest)
+                self.stats["hits"] += 1
+                return entry["matrix"]
+            base = self._best_base(keys, dtype)
+
+        if base is not None:
+            matrix = self._derive(base, keys, lats, lngs, dtype)
+            self.stats["derived"] += 1
+        else:
+            matrix = haversine_matrix(lats, lngs, lats, lngs, dtype)
+            self.stats["built"] += 1
+        matrix.setflags(write=False)
+        self._store(digest, keys, matrix)
+        return matrix
+
+    def _best_base(self, keys: np.ndarray, dtype) -> Optional[Dict]:
+        """Cached matrix of the same dtype sharing the most points (if enough)."""
+        best, best_overlap = None, MIN_REUSE_FRACTION * len(keys)
+        for entry in self._entries.values():
+            if entry["matrix"].dtype != np.dtype(dtype):
+                continue
+            overlap = np.isin(keys, entry["sorted_keys"], assume_unique=False).sum()
+            if overlap >= best_overlap and overlap > 0:
+                best, best_overlap = entry, overlap
+        return best
+
+    @staticmethod
+    def _derive(base: Dict, keys: np.ndarray, lats, lngs, dtype) -> np.ndarray:
+        """Copy rows / columns of points in `base`; compute only the added points' rows."""
+        found = np.searchsorted(base["sorted_keys"], keys)
+        found = np.minimum(found, len(base["sorted_keys"]) - 1)
+        known = base["sorted_keys"][found] == keys
+        position = base["order"][found]
+
+        n = len(keys)
+        matrix = np.empty((n, n), dtype=dtype)
+        kept = np.flatnonzero(known)
+        matrix[np.ix_(kept, kept)] = base["matrix"][np.ix_(position[kept], position[kept])]
+
+        added = np.flatnonzero(~known)
+        if len(added):
+            lats = np.asarray(lats, dtype=float)
+            lngs = np.asarray(lngs, dtype=float)
+            rows = haversine_matrix(lats[added], lngs[added], lats, lngs, dtype)
+            matrix[added, :] = rows
+            matrix[:, added] = rows.T
+        return matrix
+
+    def _store(self, digest: str, keys: np.ndarray, matrix: np.ndarray):
+        order = np.argsort(keys, kind="stable")
+        with self._lock:
+            self._entries[digest] = {"matrix": matrix, "sorted_keys": keys[order], "order": order}
+            self._entries.move_to_end(digest)
+            while len(self._entries) > 1 and sum(e["matrix"].nbytes for e in self._entries.values()) > self.max_bytes:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+distance_cache = DistanceMatrixCache()
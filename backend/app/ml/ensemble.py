@@ -0,0 +1,126 @@
+"""
+Monte Carlo drought ensemble.
+Pure-NumPy kernels (no DB access) so shards can run in worker processes.
+
+Each sample is an alternative history for a village: the linear fit of its
+recent rainfall / groundwater series plus bootstrapped residuals of that fit.
+Re-fitting each alternative history gives a distribution of trends, which is
+pushed through the same WSI / demand projection as DroughtPredictor.
+"""
+import math
+import numpy as np
+from typing import Dict, List, Optional
+
+from app.ml.process_pool import get_pool
+
+# Severity thresholds and demand multipliers, matching WaterStressCalculator / DroughtPredictor
+SEVERITY_EDGES = np.array([20, 40, 60, 80])
+DEMAND_MULTIPLIERS = np.array([0.3, 0.5, 0.8, 1.2, 1.5])
+MIN_VILLAGES_PER_SHARD = 64
+SIMULATION_BLOCK = 32
+
+
+def trend_fit(values: np.ndarray, counts: np.ndarray):
+    """
+    Row-wise least-squares line through left-aligned padded series.
+    Returns (slope, fitted, weights) where slope = (weights * values).sum(axis=1).
+    Rows with < 2 points or zero variance get slope 0.
+    """
+    n, m = values.shape
+    x = np.arange(m, dtype=float)[None, :]
+    mask = x < counts[:, None]
+    safe_counts = np.maximum(counts, 1)[:, None]
+    x_mean = (x * mask).sum(axis=1, keepdims=True) / safe_counts
+    y_mean = (values * mask).sum(axis=1, keepdims=True) / safe_counts
+    dx = (x - x_mean) * mask
+    sxx = (dx ** 2).sum(axis=1, keepdims=True)
+
+    y_var = (((values - y_mean) * mask) ** 2).sum(axis=1, keepdims=True)
+    valid = (counts[:, None] >= 2) & (y_var > 0) & (sxx > 0)
+    weights = np.where(valid, dx / np.where(sxx > 0, sxx, 1), 0.0)
+    slope = (weights * values).sum(axis=1)
+    fitted = np.where(mask, y_mean + slope[:, None] * (x - x_mean), 0.0)
+    return slope, fitted, weights
+
+
+def _bootstrap_slopes(values: np.ndarray, counts: np.ndarray, samples: int, rng: np.random.Generator) -> np.ndarray:
+    """(villages, samples) slopes re-fitted on residual-bootstrapped histories."""
+    slope, fitted, weights = trend_fit(values, counts)
+    n, m = values.shape
+    if m == 0:
+        return np.zeros((n, samples))
+    mask = np.arange(m)[None, :] < counts[:, None]
+    residuals = np.where(mask, values - fitted, 0.0)
+    # Draw residual positions uniformly from each village's own observed points
+    draw = (rng.random((n, samples, m)) * np.maximum(counts, 1)[:, None, None]).astype(int)
+    resampled = residuals[np.arange(n)[:, None, None], draw]
+    return slope[:, None] + (resampled * weights[:, None, :]).sum(axis=2)
+
+
+def simulate_shard(
+    current_wsi: np.ndarray,
+    population: np.ndarray,
+    rainfall: np.ndarray,
+    rainfall_counts: np.ndarray,
+    groundwater: np.ndarray,
+    groundwater_counts: np.ndarray,
+    days_ahead: int,
+    samples: int,
+    seed,
+) -> Dict[str, np.ndarray]:
+    """Simulate one shard of villages; returns P10/P50/P90 arrays of shape (villages, 3)."""
+    rng = np.random.default_rng(seed)
+    months_ahead = days_ahead / 30
+    wsi_pct, demand_pct = [], []
+
+    # Blocks keep the (villages, samples, points) bootstrap tensor small
+    for lo in range(0, len(current_wsi), SIMULATION_BLOCK):
+        block = slice(lo, lo + SIMULATION_BLOCK)
+        rainfall_trend = _bootstrap_slopes(rainfall[block], rainfall_counts[block], samples, rng)
+        gw_trend = _bootstrap_slopes(groundwater[block], groundwater_counts[block], samples, rng)
+
+        rainfall_impact = rainfall_trend * months_ahead * 5  # negative trend = increasing stress
+        gw_impact = gw_trend * months_ahead * 3  # positive trend (deeper) = increasing stress
+        wsi = np.clip(current_wsi[block, None] - rainfall_impact + gw_impact, 0, 100)
+
+        severity_idx = np.searchsorted(SEVERITY_EDGES, wsi, side="right")
+        demand = np.floor(population[block, None] * 20 * DEMAND_MULTIPLIERS[severity_idx] * days_ahead)
+
+        wsi_pct.append(np.percentile(wsi, [10, 50, 90], axis=1).T)
+        demand_pct.append(np.percentile(demand, [10, 50, 90], axis=1).T)
+
+    if not wsi_pct:
+        return {"wsi": np.zeros((0, 3)), "demand": np.zeros((0, 3))}
+    return {"wsi": np.concatenate(wsi_pct), "demand": np.concatenate(demand_pct)}
+
+
+def run_ensemble(
+    inputs: Dict[str, np.ndarray],
+    days_ahead: int,
+    samples: int,
+    workers: int,
+    seed: Optional[int] = None,
+) -> Dict[str, np.ndarray]:
+    """Shard villages across a process pool (or run inline for small jobs / workers=1)."""
+    n = len(inputs["current_wsi"])
+    shards = max(1, min(workers, math.ceil(n / MIN_VILLAGES_PER_SHARD)))
+    bounds = np.linspace(0, n, shards + 1).astype(int)
+    seeds = np.random.SeedSequence(seed).spawn(shards)
+
+    def shard_args(k: int) -> List:
+        lo, hi = bounds[k], bounds[k + 1]
+        return [
+            inputs["current_wsi"][lo:hi], inputs["population"][lo:hi],
+            inputs["rainfall"][lo:hi], inputs["rainfall_counts"][lo:hi],
+            inputs["groundwater"][lo:hi], inputs["groundwater_counts"][lo:hi],
+            days_ahead, samples, seeds[k],
+        ]
+
+    if shards == 1:
+        parts = [simulate_shard(*shard_args(0))]
+    else:
+        pool = get_pool()
+        futures = [pool.submit(simulate_shard, *shard_args(k)) for k in range(shards)]
+        parts = [f.result() for f in futures]
+
+    return {key: np.concatenate([p[key] for p in parts]) for key in ("wsi", "demand")}
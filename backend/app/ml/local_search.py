@@ -0,0 +1,279 @@
+"""
+Local-search improvement for tanker routes.
+Takes routes from any constructor (greedy, CVRP) as node sequences over a
+precomputed distance matrix and applies 2-opt, Or-opt, inter-route relocate and
+exchange moves until no move improves or the time budget runs out. Each move
+type scores all of its candidates at once with NumPy delta evaluation and
+applies the best improving one.
+
+Routes start at depots[r] and end at ends[r] (the same node unless a tanker
+starts away from its depot). Constraints kept: tanker capacity (a route never gains load beyond its
+capacity), litres delivered per village (a village only moves to a tanker that
+can hand over at least as much), and the max route length (a route never grows
+past max(limit, its current length)).
+"""
+import time
+from typing import Dict, List, Optional
+
+import numpy as np
+
+EPSILON = 1e-9
+OR_OPT_SEGMENTS = (1, 2, 3)
+
+
+class RouteImprover:
+    """Mutable route state plus the four neighbourhoods."""
+
+    def __init__(
+        self,
+        routes: List[List[int]],
+        distance: np.ndarray,
+        depots: List[int],
+        demand: Optional[np.ndarray] = None,
+        capacities: Optional[List[int]] = None,
+        max_route_km: Optional[float] = None,
+        ends: Optional[List[int]] = None,
+    ):
+        self.routes = [list(r) for r in routes]
+        self.d = distance
+        self.depots = list(depots)
+        self.ends = list(ends) if ends is not None else self.depots
+        self.demand = demand
+        self.capacities = None if capacities is None or demand is None else np.asarray(capacities, dtype=float)
+        self.max_route_km = max_route_km if max_route_km is not None else np.inf
+        self.lengths = np.array([self._length(r) for r in range(len(self.routes))], dtype=float)
+        self.loads = np.array([self._load(r) for r in range(len(self.routes))], dtype=float)
+
+    # ─── Route bookkeeping ───
+
+    def path(self, r: int) -> np.ndarray:
+        return np.array([self.depots[r]] + self.routes[r] + [self.ends[r]], dtype=int)
+
+    def _length(self, r: int) -> float:
+        p = self.path(r)
+        return float(self.d[p[:-1], p[1:]].sum())
+
+    def delivered(self, nodes, r: int):
+        """Litres route r's tanker hands over at each node."""
+        if self.capacities is None:
+            return np.zeros(len(nodes)) if self.demand is None else self.demand[nodes]
+        return np.minimum(self.demand[nodes], self.capacities[r])
+
+    def _load(self, r: int) -> float:
+        return float(self.delivered(np.array(self.routes[r], dtype=int), r).sum()) if self.routes[r] else 0.0
+
+    def _refresh(self, *touched: int):
+        for r in touched:
+            self.lengths[r] = self._length(r)
+            self.loads[r] = self._load(r)
+
+    def total_km(self) -> float:
+        return float(self.lengths.sum())
+
+    # ─── Intra-route moves ───
+
+    def two_opt(self, r: int) -> bool:
+        """Reverse the segment p[i..j] that shortens route r the most."""
+        p = self.path(r)
+        m = len(p)
+        if m < 5:
+            return False
+        i = np.arange(1, m - 1)[:, None]
+        j = np.arange(1, m - 1)[None, :]
+        d = self.d
+        delta = d[p[i - 1], p[j]] + d[p[i], p[j + 1]] - d[p[i - 1], p[i]] - d[p[j], p[j + 1]]
+        delta = np.where(j > i, delta, np.inf)
+        best = np.unravel_index(np.argmin(delta), delta.shape)
+        if delta[best] >= -EPSILON:
+            return False
+        a, b = int(i[best[0], 0]), int(j[0, best[1]])
+        self.routes[r][a - 1:b] = self.routes[r][a - 1:b][::-1]
+        self._refresh(r)
+        return True
+
+    def or_opt(self, r: int) -> bool:
+        """Move a run of 1-3 consecutive stops (optionally reversed) elsewhere in route r."""
+        route = self.routes[r]
+        best = (-EPSILON, None)
+        d = self.d
+        for length in OR_OPT_SEGMENTS:
+            if len(route) <= length:
+                break
+            for start in range(len(route) - length + 1):
+                segment = route[start:start + length]
+                rest = route[:start] + route[start + length:]
+                prev = route[start - 1] if start else self.depots[r]
+                nxt = route[start + length] if start + length < len(route) else self.ends[r]
+                gain = d[prev, segment[0]] + d[segment[-1], nxt] - d[prev, nxt]
+                p = np.array([self.depots[r]] + rest + [self.ends[r]], dtype=int)
+                a, b = p[:-1], p[1:]
+                base = d[a, b]
+                forward = d[a, segment[0]] + d[segment[-1], b] - base - gain
+                backward = d[a, segment[-1]] + d[segment[0], b] - base - gain
+                for reverse, delta in ((False, forward), (True, backward)):
+                    k = int(np.argmin(delta))
+                    if delta[k] < best[0]:
+                        best = (delta[k], (rest, k, segment[::-1] if reverse else segment))
+        if best[1] is None:
+            return False
+        rest, k, segment = best[1]
+        self.routes[r] = rest[:k] + list(segment) + rest[k:]
+        self._refresh(r)
+        return True
+
+    # ─── Inter-route moves ───
+
+    def _edges(self):
+        """Every edge of every route: (from, to, route, insert position)."""
+        froms, tos, owner, position = [], [], [], []
+        for r in range(len(self.routes)):
+            p = self.path(r)
+            froms.append(p[:-1])
+            tos.append(p[1:])
+            owner.append(np.full(len(p) - 1, r))
+            position.append(np.arange(len(p) - 1))
+        return np.concatenate(froms), np.concatenate(tos), np.concatenate(owner), np.concatenate(position)
+
+    def relocate(self) -> bool:
+        """Move one stop to the cheapest feasible gap in another route."""
+        if self.capacities is None or len(self.routes) < 2:
+            return False
+        a, b, owner, position = self._edges()
+        base = self.d[a, b]
+        spare = self.capacities - self.loads
+        limit = np.maximum(self.max_route_km, self.lengths)
+        best = (-EPSILON, None)
+        for r, route in enumerate(self.routes):
+            p = self.path(r)
+            for k, node in enumerate(route):
+                gain = self.d[p[k], node] + self.d[node, p[k + 2]] - self.d[p[k], p[k + 2]]
+                insert = self.d[a, node] + self.d[node, b] - base
+                hands_over = self.delivered(np.array([node]), r)[0]
+                receives = np.minimum(self.demand[node], self.capacities[owner])
+                feasible = (
+                    (owner != r)
+                    & (receives >= hands_over)
+                    & (receives <= spare[owner] + EPSILON)
+                    & (self.lengths[owner] + insert <= limit[owner] + EPSILON)
+                )
+                delta = np.where(feasible, insert - gain, np.inf)
+                e = int(np.argmin(delta))
+                if delta[e] < best[0]:
+                    best = (delta[e], (r, k, int(owner[e]), int(position[e])))
+        if best[1] is None:
+            return False
+        r, k, target, pos = best[1]
+        node = self.routes[r].pop(k)
+        self.routes[target].insert(pos, node)
+        self._refresh(r, target)
+        return True
+
+    def exchange(self) -> bool:
+        """Swap two stops between routes when it shortens the pair."""
+        if len(self.routes) < 2:
+            return False
+        nodes, owner, prev, nxt = [], [], [], []
+        for r, route in enumerate(self.routes):
+            p = self.path(r)
+            nodes.append(p[1:-1])
+            prev.append(p[:-2])
+            nxt.append(p[2:])
+            owner.append(np.full(len(route), r))
+        nodes, owner, prev, nxt = (np.concatenate(x) if x else np.zeros(0, dtype=int) for x in (nodes, owner, prev, nxt))
+        if len(nodes) < 2:
+            return False
+        d = self.d
+        # Cost of putting every node v into every slot u (u's neighbours), minus what u costs there
+        swap_in = d[prev[:, None], nodes[None, :]] + d[nodes[None, :], nxt[:, None]]
+        current = (d[prev, nodes] + d[nodes, nxt])[:, None]
+        slot_delta = swap_in - current  # [slot u, node v]
+        delta = slot_delta + slot_delta.T
+        feasible = owner[:, None] != owner[None, :]
+
+        new_lengths_u = self.lengths[owner][:, None] + slot_delta
+        limit = np.maximum(self.max_route_km, self.lengths)
+        feasible &= new_lengths_u <= limit[owner][:, None] + EPSILON
+        feasible &= new_lengths_u.T <= limit[owner][None, :] + EPSILON
+        if self.capacities is not None:
+            cap = self.capacities
+            gives_u = np.minimum(self.demand[nodes], cap[owner])  # u as delivered by its own tanker
+            u_at_v = np.minimum(self.demand[nodes][:, None], cap[owner][None, :])  # u delivered by v's tanker
+            feasible &= u_at_v >= gives_u[:, None]
+            feasible &= u_at_v.T >= gives_u[None, :]
+            load_u = self.loads[owner][:, None] - gives_u[:, None] + u_at_v.T
+            feasible &= (load_u <= cap[owner][:, None] + EPSILON) | (load_u <= self.loads[owner][:, None] + EPSILON)
+            load_v = load_u.T
+            feasible &= (load_v <= cap[owner][None, :] + EPSILON) | (load_v <= self.loads[owner][None, :] + EPSILON)
+
+        delta = np.where(feasible, delta, np.inf)
+        # Adjacent nodes in the same route are excluded above (different routes only)
+        u, v = np.unravel_index(np.argmin(delta), delta.shape)
+        if delta[u, v] >= -EPSILON:
+            return False
+        ru, rv = int(owner[u]), int(owner[v])
+        iu = self.routes[ru].index(int(nodes[u]))
+        iv = self.routes[rv].index(int(nodes[v]))
+        self.routes[ru][iu], self.routes[rv][iv] = int(nodes[v]), int(nodes[u])
+        self._refresh(ru, rv)
+        return True
+
+
+def improve_routes(
+    routes: List[List[int]],
+    distance: np.ndarray,
+    depots: Optional[List[int]] = None,
+    demand: Optional[np.ndarray] = None,
+    capacities: Optional[List[int]] = None,
+    max_route_km: Optional[float] = None,
+    time_budget_ms: float = 200,
+    ends: Optional[List[int]] = None,
+) -> Dict:
+    """
+    Improve a copy of `routes` (lists of node indices, depots excluded).
+    Route r runs depots[r] -> stops -> ends[r] (ends default to depots).
+    Without capacities / demand only load-neutral moves (2-opt, Or-opt, exchange)
+    are used. Returns the improved routes, their lengths and what was saved.
+    """
+    started = time.perf_counter()
+    deadline = started + time_budget_ms / 1000
+    depots = depots if depots is not None else [0] * len(routes)
+    state = RouteImprover(routes, distance, depots, demand, capacities, max_route_km, ends)
+    initial = state.total_km()
+    moves = {"two_opt": 0, "or_opt": 0, "relocate": 0, "exchange": 0}
+
+    converged = False
+    while time.perf_counter() < deadline:
+        improved = False
+        for r in range(len(state.routes)):
+            while state.two_opt(r):
+                moves["two_opt"] += 1
+                improved = True
+            if state.or_opt(r):
+                moves["or_opt"] += 1
+                improved = True
+            if time.perf_counter() >= deadline:
+                break
+        if state.relocate():
+            moves["relocate"] += 1
+            improved = True
+        if state.exchange():
+            moves["exchange"] += 1
+            improved = True
+        if not improved:
+            converged = True
+            break
+
+    final = state.total_km()
+    return {
+        "routes": state.routes,
+        "lengths_km": state.lengths.tolist(),
+        "stats": {
+            "initial_km": round(initial, 2),
+            "final_km": round(final, 2),
+            "km_saved": round(initial - final, 2),
+            "moves": moves,
+            "converged": converged,
+            "time_budget_ms": time_budget_ms,
+            "wall_ms": round((time.perf_counter() - started) * 1000, 1),
+        },
+    }
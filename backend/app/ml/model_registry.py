@@ -0,0 +1,94 @@
+"""
+On-disk registry of fitted per-village models.
+One small .npz file per village under <root>/<version>/, plus a manifest of the
+data signature each model was fitted on (so refits can skip unchanged
+villages). Models are loaded lazily through an LRU of hot entries.
+"""
+import json
+import os
+import threading
+from collections import OrderedDict
+from typing import Dict, Iterable, Optional
+
+import numpy as np
+
+MANIFEST = "manifest.json"
+
+
+class ModelRegistry:
+    """Versioned per-village model files with an in-memory LRU."""
+
+    def __init__(self, root: str, version: str, cache_size: int = 2048):
+        self.root = root
+        self.version = version
+        self.cache_size = cache_size
+        self._cache: "OrderedDict[int, Optional[Dict[str, np.ndarray]]]" = OrderedDict()
+        self._manifest: Optional[Dict[str, list]] = None
+        self._lock = threading.Lock()
+
+    @property
+    def directory(self) -> str:
+        return os.path.join(self.root, self.version)
+
+    def _path(self, village_id: int) -> str:
+        return os.path.join(self.directory, f"village_{village_id}.npz")
+
+    # ─── Manifest ───
+
+    def manifest(self) -> Dict[str, list]:
+        if self._manifest is None:
+            try:
+                with open(os.path.join(self.directory, MANIFEST)) as f:
+                    self._manifest = json.load(f)
+            except (OSError, ValueError):
+                self._manifest = {}
+        return self._manifest
+
+    def signature(self, village_id: int) -> Optional[list]:
+        return self.manifest().get(str(village_id))
+
+    def _write_manifest(self):
+        path = os.path.join(self.directory, MANIFEST)
+        with open(path + ".tmp", "w") as f:
+            json.dump(self._manifest, f)
+        os.replace(path + ".tmp", path)
+
+    # ─── Models ───
+
+    def save_many(self, models: Dict[int, Dict[str, np.ndarray]], signatures: Dict[int, list]):
+        """Write models atomically, then record their data signatures."""
+        os.makedirs(self.directory, exist_ok=True)
+        manifest = self.manifest()
+        for village_id, params in models.items():
+            path = self._path(village_id)
+            with open(path + ".tmp", "wb") as f:
+                np.savez(f, **params)
+            os.replace(path + ".tmp", path)
+            manifest[str(village_id)] = signatures[village_id]
+            with self._lock:
+                self._cache.pop(village_id, None)
+        self._write_manifest()
+
+    def load(self, village_id: int) -> Optional[Dict[str, np.ndarray]]:
+        with self._lock:
+            if village_id in self._cache:
+                self._cache.move_to_end(village_id)
+                return self._cache[village_id]
+        try:
+            with np.load(self._path(village_id)) as data:
+                model = {key: data[key] for key in data.files}
+        except OSError:
+            model = None
+        with self._lock:
+            self._cache[village_id] = model
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return model
+
+    def load_many(self, village_ids: Iterable[int]) -> Dict[int, Dict[str, np.ndarray]]:
+        models = {}
+        for village_id in village_ids:
+            model = self.load(village_id)
+            if model is not None:
+                models[village_id] = model
+        return models
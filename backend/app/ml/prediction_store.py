@@ -0,0 +1,105 @@
+"""
+Materialized drought predictions.
+The scheduler computes predictions for the standard horizons after each WSI
+recompute and bulk-upserts them into MaterializedPrediction (one row per
+village, horizon and model version), a few hundred rows per statement to stay
+under the database's bound-parameter limit. Reads for those horizons are a
+single indexed query; other horizons are still computed live.
+"""
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from sqlalchemy.orm import Session
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from app.models import Village, MaterializedPrediction
+from app.ml.drought_predictor import drought_predictor, MODEL_VERSION
+
+STANDARD_HORIZONS = (30, 60, 90)
+UPSERT_BATCH_ROWS = 500  # x 11 columns stays under SQLite's default 32,766 bound parameters
+UPSERT_COLUMNS = (
+    "prediction_date", "target_date", "predicted_wsi", "predicted_severity",
+    "predicted_demand_liters", "predicted_tanker_trips", "confidence", "details",
+)
+
+
+def _upsert(db: Session, rows: List[Dict]):
+    dialect = db.get_bind().dialect.name
+    if dialect in ("postgresql", "sqlite"):
+        insert = pg_insert if dialect == "postgresql" else sqlite_insert
+        for start in range(0, len(rows), UPSERT_BATCH_ROWS):
+            stmt = insert(MaterializedPrediction).values(rows[start:start + UPSERT_BATCH_ROWS])
+            stmt = stmt.on_conflict_do_update(
+                index_elements=["village_id", "horizon_days", "model_version"],
+                set_={col: stmt.excluded[col] for col in UPSERT_COLUMNS},
+            )
+            db.execute(stmt)
+        return
+
+    # No native upsert: replace this version's rows for the horizons being written
+    horizons = {row["horizon_days"] for row in rows}
+    db.query(MaterializedPrediction).filter(
+        MaterializedPrediction.model_version == MODEL_VERSION,
+        MaterializedPrediction.horizon_days.in_(horizons),
+    ).delete(synchronize_session=False)
+    db.bulk_insert_mappings(MaterializedPrediction, rows)
+
+
+def materialize_predictions(db: Session, horizons=STANDARD_HORIZONS) -> int:
+    """Recompute and store predictions for every village at the given horizons."""
+    villages = db.query(Village).all()
+    if not villages:
+        return 0
+    now = datetime.utcnow()
+    rows = []
+    for horizon, predictions in drought_predictor.predict_horizons(db, villages, list(horizons)).items():
+        for pred in predictions:
+            rows.append({
+                "village_id": pred["village_id"],
+                "horizon_days": horizon,
+                "model_version": MODEL_VERSION,
+                "prediction_date": now,
+                "target_date": datetime.fromisoformat(pred["target_date"]),
+                "predicted_wsi": pred["predicted_wsi"],
+                "predicted_severity": pred["predicted_severity"],
+                "predicted_demand_liters": pred["predicted_demand_liters"],
+                "predicted_tanker_trips": pred["predicted_tanker_trips"],
+                "confidence": pred["confidence"],
+                "details": pred,
+            })
+    _upsert(db, rows)
+    db.commit()
+    return len(rows)
+
+
+def stored_predictions(db: Session, days_ahead: int) -> Optional[List[Dict]]:
+    """Materialized predictions for a standard horizon, or None if not (yet) stored."""
+    rows = db.query(MaterializedPrediction.details).filter(
+        MaterializedPrediction.horizon_days == days_ahead,
+        MaterializedPrediction.model_version == MODEL_VERSION,
+    ).all()
+    if not rows:
+        return None
+    predictions = [row[0] for row in rows]
+    predictions.sort(key=lambda x: x["predicted_wsi"], reverse=True)
+    return predictions
+
+
+def village_predictions(db: Session, village_id: int) -> List[MaterializedPrediction]:
+    """The current model's stored rows for one village, nearest horizon first."""
+    return db.query(MaterializedPrediction).filter(
+        MaterializedPrediction.village_id == village_id,
+        MaterializedPrediction.model_version == MODEL_VERSION,
+    ).order_by(MaterializedPrediction.target_date.asc()).all()
+
+
+def get_predictions(db: Session, days_ahead: int) -> List[Dict]:
+    """Stored rows for standard horizons (materializing on first use), live otherwise."""
+    if days_ahead not in STANDARD_HORIZONS:
+        return drought_predictor.predict_all_villages(db, days_ahead)
+    predictions = stored_predictions(db, days_ahead)
+    if predictions is None:
+        materialize_predictions(db)
+        predictions = stored_predictions(db, days_ahead) or []
+    return predictions
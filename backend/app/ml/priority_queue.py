@@ -0,0 +1,197 @@
+"""
+Event-driven allocation priorities.
+An indexed max-heap of village priority entries that is patched only for the
+villages the change feed reports (new requests, trip updates, WSI moves), so
+/api/allocation/priorities?limit=K reads the top K without sweeping the tables.
+A periodic full rebuild corrects anything the feed cannot see (days since
+supply ticking over, bulk updates, other worker processes).
+"""
+import heapq
+import threading
+from datetime import datetime
+from typing import Dict, List, Optional, Set, Tuple
+
+from sqlalchemy.orm import Session
+
+from app.ml import change_feed
+from app.ml.allocation_engine import allocation_engine
+
+REBUILD_INTERVAL_SECONDS = 15 * 60
+
+
+class IndexedPriorityHeap:
+    """Binary max-heap keyed by village id with O(log n) update/remove."""
+
+    def __init__(self):
+        self._heap: List[int] = []  # village ids in heap order
+        self._pos: Dict[int, int] = {}
+        self._keys: Dict[int, Tuple[float, int]] = {}
+        self._items: Dict[int, Dict] = {}
+
+    def __len__(self) -> int:
+        return len(self._heap)
+
+    def __contains__(self, key: int) -> bool:
+        return key in self._pos
+
+    @staticmethod
+    def _key(key: int, priority: float) -> Tuple[float, int]:
+        # Higher score first, then lower village id (same order as the full sweep)
+        return (-priority, key)
+
+    def _less(self, i: int, j: int) -> bool:
+        return self._keys[self._heap[i]] < self._keys[self._heap[j]]
+
+    def _swap(self, i: int, j: int):
+        heap = self._heap
+        heap[i], heap[j] = heap[j], heap[i]
+        self._pos[heap[i]] = i
+        self._pos[heap[j]] = j
+
+    def _sift_up(self, i: int):
+        while i > 0:
+            parent = (i - 1) // 2
+            if not self._less(i, parent):
+                break
+            self._swap(i, parent)
+            i = parent
+
+    def _sift_down(self, i: int):
+        n = len(self._heap)
+        while True:
+            smallest, left, right = i, 2 * i + 1, 2 * i + 2
+            if left < n and self._less(left, smallest):
+                smallest = left
+            if right < n and self._less(right, smallest):
+                smallest = right
+            if smallest == i:
+                return
+            self._swap(i, smallest)
+            i = smallest
+
+    def push(self, key: int, priority: float, item: Dict):
+        """Insert or update an entry."""
+        self._items[key] = item
+        self._keys[key] = self._key(key, priority)
+        if key in self._pos:
+            i = self._pos[key]
+            self._sift_up(i)
+            self._sift_down(self._pos[key])
+            return
+        self._heap.append(key)
+        self._pos[key] = len(self._heap) - 1
+        self._sift_up(len(self._heap) - 1)
+
+    def remove(self, key: int):
+        i = self._pos.pop(key, None)
+        if i is None:
+            return
+        last = self._heap.pop()
+        del self._keys[key], self._items[key]
+        if i < len(self._heap):
+            self._heap[i] = last
+            self._pos[last] = i
+            self._sift_up(i)
+            self._sift_down(self._pos[last])
+
+    def top(self, k: int) -> List[Dict]:
+        """The k best entries in order, in O(k log k) without disturbing the heap."""
+        result = []
+        if not self._heap or k <= 0:
+            return result
+        frontier = [(self._keys[self._heap[0]], 0)]
+        while frontier and len(result) < k:
+            _, i = heapq.heappop(frontier)
+            result.append(self._items[self._heap[i]])
+            for child in (2 * i + 1, 2 * i + 2):
+                if child < len(self._heap):
+                    heapq.heappush(frontier, (self._keys[self._heap[child]], child))
+        return result
+
+    def clear(self):
+        self._heap, self._pos, self._keys, self._items = [], {}, {}, {}
+
+
+class PriorityIndex:
+    """Allocation priorities kept current from the change feed."""
+
+    def __init__(self):
+        self._heap = IndexedPriorityHeap()
+        self._dirty: Set[int] = set()
+        self._built_at: Optional[datetime] = None
+        # Rebuilds in progress, and villages refreshed into the old heap meanwhile
+        self._rebuilding = 0
+        self._refreshed_during_rebuild: Set[int] = set()
+        self._lock = threading.Lock()
+        change_feed.subscribe(self._on_change)
+
+    def _on_change(self, changes: Dict[str, Set[int]]):
+        with self._lock:
+            for kind, village_ids in changes.items():
+                if kind != "tanker":
+                    self._dirty.update(village_ids)
+
+    def rebuild(self, db: Session) -> int:
+        """Recompute every village (scheduled drift guard)."""
+        with self._lock:
+            # Changes committed while scoring stay dirty and are applied on the next read
+            cleared, self._dirty = self._dirty, set()
+            self._rebuilding += 1
+        heap = None
+        try:
+            entries = allocation_engine.score_villages(db)
+            heap = IndexedPriorityHeap()
+            for entry in entries:
+                heap.push(entry["village_id"], entry["priority_score"], entry)
+        finally:
+            with self._lock:
+                if heap is not None:
+                    self._heap = heap
+                    self._built_at = datetime.utcnow()
+                else:
+                    # Scoring failed and the old heap stays: its dirty villages still need scoring
+                    self._dirty |= cleared
+                # A refresh that ran meanwhile scored newer data than this snapshot
+                # and went into the replaced heap: score those villages again
+                self._dirty |= self._refreshed_during_rebuild
+                self._rebuilding -= 1
+                if not self._rebuilding:
+                    self._refreshed_during_rebuild = set()
+        return len(entries)
+
+    def _refresh(self, db: Session):
+        with self._lock:
+            dirty, self._dirty = self._dirty, set()
+        if not dirty:
+            return
+        try:
+            entries = {e["village_id"]: e for e in allocation_engine.score_villages(db, list(dirty))}
+        except Exception:
+            with self._lock:
+                self._dirty |= dirty
+            raise
+        with self._lock:
+            if self._rebuilding:
+                self._refreshed_during_rebuild |= dirty
+            for village_id in dirty:
+                entry = entries.get(village_id)
+                if entry is None:
+                    self._heap.remove(village_id)  # deleted, or no WSI record yet
+                else:
+                    self._heap.push(village_id, entry["priority_score"], entry)
+
+    def top(self, db: Session, limit: int = 20) -> List[Dict]:
+        stale = (
+            self._built_at is None or
+            # The scheduler normally rebuilds first; this only covers a stalled scheduler
+            (datetime.utcnow() - self._built_at).total_seconds() > 2 * REBUILD_INTERVAL_SECONDS
+        )
+        if stale:
+            self.rebuild(db)
+        else:
+            self._refresh(db)
+        with self._lock:
+            return self._heap.top(limit)
+
+
+priority_index = PriorityIndex()
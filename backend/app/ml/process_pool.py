@@ -0,0 +1,35 @@
+"""
+Process pool shared by CPU-bound jobs: the drought ensemble, seasonal refits,
+backtests and route search. Sized once to WORKER_PROCESSES and never resized,
+since other callers may have work in flight; a caller's `workers` only bounds
+how many tasks it submits at a time.
+"""
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional
+
+from app.config import WORKER_PROCESSES
+
+_pool: Optional[ProcessPoolExecutor] = None
+_lock = threading.Lock()
+
+
+def pool_size() -> int:
+    """Worker processes in the shared pool (tasks beyond this queue)."""
+    return max(1, WORKER_PROCESSES)
+
+
+def get_pool() -> ProcessPoolExecutor:
+    global _pool
+    with _lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=pool_size())
+        return _pool
+
+
+def shutdown_pool():
+    global _pool
+    with _lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False)
+            _pool = None
@@ -0,0 +1,149 @@
+"""
+Cache of /routes/optimize answers.
+A plan is filed under a fingerprint of everything the solver sees (villages and
+demands, fleet with depots and start positions, solver options, time-window
+inputs) and is returned again while the plan is unedited. The request
+parameters are also bound to the fingerprint, so a repeat view skips
+prioritization, the fleet lookup, the solver and the road-geometry calls.
+
+Committed changes invalidate through the change feed: any event unbinds the
+request parameters (top villages or the nearest fleet may have moved), and a
+plan whose villages or tankers were touched is dropped. Plans left alone are
+found again by fingerprint. Entries also expire after a TTL, which covers the
+weather forecast, the VRPTW plan start and bulk updates the feed cannot see.
+"""
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Hashable, Iterable, Optional, Set
+
+from app.config import ROUTE_CACHE_SIZE, ROUTE_CACHE_TTL_S
+from app.ml import change_feed
+from app.ml.route_plans import route_plans
+
+
+def plan_fingerprint(villages: Iterable[Dict], fleet: Iterable[Dict], options: Dict) -> str:
+    """Hash of the solver inputs; stable under village / vehicle order."""
+    payload = {
+        "villages": sorted(
+            [
+                v["id"], round(v["lat"], 6), round(v["lng"], 6), int(v["demand"]), round(v.get("priority", 0), 2),
+                v.get("urgency"), v["deadline"].isoformat() if v.get("deadline") else None,
+            ]
+            for v in villages
+        ),
+        "fleet": sorted(
+            (
+                [
+                    vehicle.get("id"), vehicle.get("capacity"),
+                    round(vehicle["depot"]["lat"], 6), round(vehicle["depot"]["lng"], 6),
+                    round(vehicle["start"]["lat"], 6), round(vehicle["start"]["lng"], 6),
+                ]
+                for vehicle in fleet
+            ),
+            key=str,
+        ),
+        "options": options,
+    }
+    encoded = json.dumps(payload, sort_keys=True, default=str, separators=(",", ":"))
+    return hashlib.sha1(encoded.encode()).hexdigest()
+
+
+class RouteCache:
+    """Bounded LRU from fingerprint to plan id, plus request-parameter bindings."""
+
+    def __init__(self, max_entries: int = ROUTE_CACHE_SIZE, ttl_s: float = ROUTE_CACHE_TTL_S):
+        self.max_entries = max_entries
+        self.ttl_s = ttl_s
+        self._entries: "OrderedDict[str, Dict]" = OrderedDict()
+        self._requests: Dict[Hashable, str] = {}
+        self._lock = threading.Lock()
+        # Bumped by every change; a plan computed across a change is not cached
+        self.generation = 0
+        self.stats = {"hits": 0, "fingerprint_hits": 0, "misses": 0, "invalidated": 0}
+        change_feed.subscribe(self._on_change)
+
+    def _on_change(self, changes: Dict[str, Set[int]]):
+        villages = set().union(*(ids for kind, ids in changes.items() if kind != "tanker"))
+        tankers = changes.get("tanker", set())
+        with self._lock:
+            self.generation += 1
+            self._requests.clear()
+            stale = [
+                fingerprint for fingerprint, entry in self._entries.items()
+                if entry["villages"] & villages or entry["tankers"] & tankers
+            ]
+            for fingerprint in stale:
+                del self._entries[fingerprint]
+            self.stats["invalidated"] += len(stale)
+
+    def _resolve(self, fingerprint: Optional[str]) -> Optional[Dict]:
+        """The cached plan if still fresh and unedited; drops the entry otherwise."""
+        with self._lock:
+            entry = self._entries.get(fingerprint) if fingerprint else None
+            if entry is None:
+                return None
+            if time.monotonic() - entry["created"] <= self.ttl_s and route_plans.version(entry["plan_id"]) == 1:
+                self._entries.move_to_end(fingerprint)
+                plan_id = entry["plan_id"]
+            else:
+                del self._entries[fingerprint]
+                plan_id = None
+        return route_plans.get(plan_id) if plan_id else None
+
+    def lookup(self, request_key: Hashable) -> Optional[Dict]:
+        """Plan for request parameters seen since the last change, without recomputing inputs."""
+        with self._lock:
+            fingerprint = self._requests.get(request_key)
+        plan = self._resolve(fingerprint)
+        if plan is not None:
+            self.stats["hits"] += 1
+        return plan
+
+    def match(self, fingerprint: str, request_key: Hashable, generation: int) -> Optional[Dict]:
+        """Plan for identical solver inputs; binds the request parameters to it on a hit."""
+        plan = self._resolve(fingerprint)
+        if plan is None:
+            self.stats["misses"] += 1
+            return None
+        with self._lock:
+            if generation == self.generation:
+                self._requests[request_key] = fingerprint
+        self.stats["fingerprint_hits"] += 1
+        return plan
+
+    def store(
+        self,
+        fingerprint: str,
+        request_key: Hashable,
+        plan_id: str,
+        village_ids: Iterable[int],
+        tanker_ids: Iterable[int],
+        generation: int,
+    ):
+        with self._lock:
+            if generation != self.generation:
+                return
+            self._entries[fingerprint] = {
+                "plan_id": plan_id,
+                "villages": set(village_ids),
+                "tankers": set(tanker_ids),
+                "created": time.monotonic(),
+            }
+            self._entries.move_to_end(fingerprint)
+            self._requests[request_key] = fingerprint
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            live = set(self._entries)
+            self._requests = {k: f for k, f in self._requests.items() if f in live}
+
+    def clear(self):
+        with self._lock:
+            self.generation += 1
+            self._entries.clear()
+            self._requests.clear()
+
+
+route_cache = RouteCache()
@@ -0,0 +1,223 @@
+"""
+Start solutions for multi-start route search.
+Each construction builds one route per vehicle over a precomputed distance
+matrix (terminal nodes first, then villages) under the same constraints as the
+CVRP: a tanker delivers min(demand, capacity) per village within its capacity,
+and a route never exceeds the max route length. Villages no construction can
+place are returned as dropped.
+
+seed 0 gives each construction's classic deterministic form; other seeds
+randomize it (sweep start angle and direction, savings shape factor, nearest-
+neighbour choice among the closest candidates, insertion order) so repeated
+starts explore different regions.
+"""
+from typing import Dict, List, Optional
+
+import numpy as np
+
+EPSILON = 1e-9
+NEAREST_CANDIDATES = 3  # randomized nearest-neighbour picks among this many closest stops
+SAVINGS_SHAPE = (0.5, 1.5)  # range of the Clarke-Wright shape factor for seeded starts
+
+
+class _Plan:
+    """Routes under construction with their lengths and loads."""
+
+    def __init__(self, distance, starts, ends, demand, capacities, max_route_km):
+        self.d = distance
+        self.starts = list(starts)
+        self.ends = list(ends)
+        self.demand = demand
+        self.capacities = capacities
+        self.max_route_km = max_route_km
+        self.routes: List[List[int]] = [[] for _ in self.starts]
+        self.lengths = np.array([distance[s, e] for s, e in zip(self.starts, self.ends)], dtype=float)
+        self.loads = np.zeros(len(self.starts))
+
+    def path(self, k: int) -> np.ndarray:
+        return np.array([self.starts[k]] + self.routes[k] + [self.ends[k]], dtype=int)
+
+    def delivered(self, node: int, k: int) -> float:
+        return min(self.demand[node], self.capacities[k])
+
+    def fits(self, node: int, k: int, added_km: float) -> bool:
+        return (
+            self.loads[k] + self.delivered(node, k) <= self.capacities[k] + EPSILON
+            and self.lengths[k] + added_km <= self.max_route_km + EPSILON
+        )
+
+    def insert(self, node: int, k: int, position: int, added_km: float):
+        self.routes[k].insert(position, node)
+        self.lengths[k] += added_km
+        self.loads[k] += self.delivered(node, k)
+
+    def cheapest_insertion(self, order) -> List[int]:
+        """Put each node in the cheapest feasible gap of any route; returns those that fit nowhere."""
+        dropped = []
+        for node in order:
+            best = (np.inf, -1, -1)
+            for k in range(len(self.routes)):
+                if not self.fits(node, k, 0.0):
+                    continue
+                p = self.path(k)
+                added = self.d[p[:-1], node] + self.d[node, p[1:]] - self.d[p[:-1], p[1:]]
+                added = np.where(self.lengths[k] + added <= self.max_route_km + EPSILON, added, np.inf)
+                gap = int(np.argmin(added))
+                if added[gap] < best[0]:
+                    best = (added[gap], k, gap)
+            if best[1] < 0:
+                dropped.append(node)
+            else:
+                self.insert(node, best[1], best[2], best[0])
+        return dropped
+
+
+def _by_priority(nodes, priority) -> List[int]:
+    return sorted(nodes, key=lambda node: (-priority[node], node))
+
+
+def _nearest_neighbour(plan: _Plan, nodes, priority, rng) -> List[int]:
+    """Each tanker in turn drives to the nearest stop it can still take."""
+    unvisited = set(nodes)
+    vehicles = range(len(plan.routes)) if rng is None else rng.permutation(len(plan.routes))
+    for k in vehicles:
+        current, end = plan.starts[k], plan.ends[k]
+        while unvisited:
+            candidates = np.array(sorted(unvisited))
+            added = plan.d[current, candidates] + plan.d[candidates, end] - plan.d[current, end]
+            feasible = [
+                i for i in np.argsort(plan.d[current, candidates], kind="stable")
+                if plan.fits(int(candidates[i]), k, added[i])
+            ]
+            if not feasible:
+                break
+            i = feasible[0] if rng is None else feasible[rng.integers(min(NEAREST_CANDIDATES, len(feasible)))]
+            node = int(candidates[i])
+            plan.insert(node, k, len(plan.routes[k]), added[i])
+            unvisited.discard(node)
+            current = node
+    return plan.cheapest_insertion(_by_priority(unvisited, priority))
+
+
+def _sweep(plan: _Plan, nodes, priority, coords, rng) -> List[int]:
+    """Fill tankers one after another with stops in angular order around the depot."""
+    lats, lngs = coords
+    hub = plan.ends[0]
+    angle = np.arctan2(lats[nodes] - lats[hub], (lngs[nodes] - lngs[hub]) * np.cos(np.radians(lats[hub])))
+    if rng is not None:
+        angle = (angle - rng.uniform(0, 2 * np.pi)) % (2 * np.pi)
+        if rng.random() < 0.5:
+            angle = -angle
+    k, left = 0, []
+    for i in np.argsort(angle, kind="stable"):
+        node, placed = int(nodes[i]), False
+        while k < len(plan.routes) and not placed:
+            last = plan.routes[k][-1] if plan.routes[k] else plan.starts[k]
+            added = plan.d[last, node] + plan.d[node, plan.ends[k]] - plan.d[last, plan.ends[k]]
+            if plan.fits(node, k, added):
+                plan.insert(node, k, len(plan.routes[k]), added)
+                placed = True
+            elif plan.routes[k]:
+                k += 1  # this tanker is full; open the next one
+            else:
+                break  # too far or too large even for an empty tanker
+        if not placed:
+            left.append(node)
+    return plan.cheapest_insertion(_by_priority(left, priority))
+
+
+def _savings(plan: _Plan, nodes, priority, rng) -> List[int]:
+    """Clarke-Wright savings around the depot, then the merged tours go to tankers (largest load first)."""
+    d = plan.d
+    hub = plan.ends[0]
+    shape = 1.0 if rng is None else rng.uniform(*SAVINGS_SHAPE)
+    largest = float(np.max(plan.capacities))
+    tours = {int(node): [int(node)] for node in nodes}
+    owner = {int(node): int(node) for node in nodes}
+    load = {int(node): min(plan.demand[node], largest) for node in nodes}
+    length = {int(node): 2 * d[hub, node] for node in nodes}
+
+    a, b = np.triu_indices(len(nodes), k=1)
+    i, j = np.asarray(nodes)[a], np.asarray(nodes)[b]
+    saving = d[hub, i] + d[hub, j] - shape * d[i, j]
+    for e in np.argsort(-saving, kind="stable"):
+        if saving[e] <= 0:
+            break
+        u, v = int(i[e]), int(j[e])
+        ru, rv = owner[u], owner[v]
+        if ru == rv or load[ru] + load[rv] > largest + EPSILON:
+            continue
+        tu, tv = tours[ru], tours[rv]
+        if u not in (tu[0], tu[-1]) or v not in (tv[0], tv[-1]):
+            continue
+        merged_km = length[ru] + length[rv] - (d[hub, u] + d[hub, v] - d[u, v])
+        if merged_km > plan.max_route_km + EPSILON:
+            continue
+        tours[ru] = (tu if tu[-1] == u else tu[::-1]) + (tv if tv[0] == v else tv[::-1])
+        load[ru] += load.pop(rv)
+        length[ru] = merged_km
+        del tours[rv], length[rv]
+        for node in tv:
+            owner[node] = ru
+
+    left, free = [], set(range(len(plan.routes)))
+    for root in sorted(tours, key=lambda r: -load[r]):
+        tour, best = tours[root], None
+        for k in free:
+            k_load = sum(plan.delivered(node, k) for node in tour)
+            if k_load > plan.capacities[k] + EPSILON:
+                continue
+            p = np.array([plan.starts[k]] + tour + [plan.ends[k]], dtype=int)
+            km = float(d[p[:-1], p[1:]].sum())
+            if km <= plan.max_route_km + EPSILON and (best is None or (plan.capacities[k], km) < best[0]):
+                best = ((plan.capacities[k], km), k)
+        if best is None:
+            left.extend(tour)
+            continue
+        k = best[1]
+        free.discard(k)
+        plan.routes[k] = list(tour)
+        plan.lengths[k] = best[0][1]
+        plan.loads[k] = sum(plan.delivered(node, k) for node in tour)
+    return plan.cheapest_insertion(_by_priority(left, priority))
+
+
+CONSTRUCTIONS = ("savings", "sweep", "nearest_neighbour", "insertion")
+
+
+def construct_routes(
+    construction: str,
+    distance: np.ndarray,
+    num_terminals: int,
+    starts: List[int],
+    ends: List[int],
+    demand: np.ndarray,
+    capacities: Optional[List[float]],
+    max_route_km: float,
+    priority: np.ndarray,
+    coords: tuple,
+    seed: int = 0,
+) -> Dict:
+    """
+    One start solution. Nodes below num_terminals are depots / start points,
+    the rest villages; vehicle k runs starts[k] -> ends[k]. capacities None
+    means uncapacitated tankers. Returns {"routes": one node list per vehicle,
+    "dropped": village nodes left out}.
+    """
+    nodes = np.arange(num_terminals, len(demand))
+    caps = np.full(len(starts), np.inf) if capacities is None else np.asarray(capacities, dtype=float)
+    plan = _Plan(distance, starts, ends, demand, caps, max_route_km)
+    rng = np.random.default_rng(seed) if seed else None
+
+    if construction == "savings":
+        dropped = _savings(plan, nodes, priority, rng)
+    elif construction == "sweep":
+        dropped = _sweep(plan, nodes, priority, coords, rng)
+    elif construction == "nearest_neighbour":
+        dropped = _nearest_neighbour(plan, nodes, priority, rng)
+    elif construction == "insertion":
+        order = _by_priority(nodes.tolist(), priority) if rng is None else rng.permutation(nodes).tolist()
+        dropped = plan.cheapest_insertion(order)
+    else:
+        raise ValueError(f"Unknown construction: {construction}")
+    return {"routes": plan.routes, "dropped": dropped}
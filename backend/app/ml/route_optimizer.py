@@ -1,10 +1,35 @@
 """
 Route optimization for tanker dispatch.
 Uses Haversine distance for fast, reliable optimization.
+Capacitated VRP (OR-Tools) when available, with the greedy heuristic as fallback.
+Fleets spread over several depots are split into one subproblem per depot.
+With a time budget, a multi-start search runs diverse constructions (see
+route_construction) across the process pool and keeps the best.
+mode="vrptw" adds time windows: depot hours, weather-blocked days and delivery
+deadlines from request urgency (see time_windows).
 Road geometry is fetched separately by the routing service for map display.
 """
+import asyncio
 import math
-from typing import List, Dict
+import time
+from datetime import datetime
+import numpy as np
+from typing import Awaitable, Callable, List, Dict, Optional
+
+from app.config import ROUTE_SOLVER_TIME_LIMIT_S, ROUTE_IMPROVE_TIME_BUDGET_MS, WORKER_PROCESSES
+from app.ml.distance_matrix import distance_cache, haversine_matrix
+from app.ml.process_pool import get_pool, pool_size
+from app.ml.local_search import improve_routes
+from app.ml.route_construction import CONSTRUCTIONS, construct_routes
+from app.ml.time_windows import ServiceCalendar, SERVICE_MIN_PER_STOP, URGENCY_LATE_PENALTY
+
+try:
+    from ortools.constraint_solver import pywrapcp, routing_enums_pb2
+except ImportError:  # optional: greedy routing only
+    pywrapcp = None
+
+DEFAULT_TANKER_CAPACITY_LITERS = 10000
+RURAL_MIN_PER_KM = 2.5  # ~24 km/h avg rural speed
 
 
 def haversine_distance(lat1: float, lng1: float, lat2: float, lng2: float) -> float:
@@ -18,33 +43,44 @@ def haversine_distance(lat1: float, lng1: float, lat2: float, lng2: float) -> fl
     return round(R * c, 2)
 
 
+def _matrix(terminals: List[Dict], villages: List[Dict], dtype=np.float32) -> np.ndarray:
+    """Distances over terminal nodes (depots / start points) followed by the villages."""
+    return distance_cache.get(
+        [p["lat"] for p in terminals] + [v["lat"] for v in villages],
+        [p["lng"] for p in terminals] + [v["lng"] for v in villages],
+        dtype=dtype,
+    )
+
+
 def _greedy_vrp_optimizer(
     villages: List[Dict],
-    depot: Dict,
-    num_vehicles: int
+    terminals: List[Dict],
+    starts: List[int],
+    ends: List[int],
 ) -> Dict:
     """
     Robust Greedy VRP optimizer using Haversine distances.
     Guaranteed to work without external API or C-extension issues.
+    Vehicle k leaves terminal starts[k] and returns to terminal ends[k].
     """
     # Sort villages by priority
     sorted_villages = sorted(villages, key=lambda v: v.get("priority", 0), reverse=True)
+    num_vehicles = len(starts)
     
     routes = [{"vehicle_id": i, "stops": [], "total_distance_km": 0.0} for i in range(num_vehicles)]
-    
+    # Nodes 0..t-1 are the terminals, node t + i the i-th village in priority order
+    t = len(terminals)
+    distances = _matrix(terminals, sorted_villages, dtype=np.float64)
+    last_node = list(starts)
+
     # Assign villages to tankers in a priority-aware balanced way
     for i, village in enumerate(sorted_villages):
         v_idx = i % num_vehicles
-        
-        # Calculate distance from last stop (or depot)
-        prev_lat = depot["lat"]
-        prev_lng = depot["lng"]
-        if routes[v_idx]["stops"]:
-            prev_lat = routes[v_idx]["stops"][-1]["lat"]
-            prev_lng = routes[v_idx]["stops"][-1]["lng"]
-            
-        dist = haversine_distance(prev_lat, prev_lng, village["lat"], village["lng"])
-        
+
+        # Distance from last stop (or depot)
+        dist = round(float(distances[last_node[v_idx], t + i]), 2)
+        last_node[v_idx] = t + i
+
         routes[v_idx]["stops"].append({
             "village_id": village["id"],
             "village_name": village["name"],
@@ -66,11 +102,10 @@ def _greedy_vrp_optimizer(
             continue
             
         # Return to depot
-        last_v = r["stops"][-1]
-        back_dist = haversine_distance(last_v["lat"], last_v["lng"], depot["lat"], depot["lng"])
+        back_dist = round(float(distances[last_node[r["vehicle_id"]], ends[r["vehicle_id"]]]), 2)
         r["total_distance_km"] = round(r["total_distance_km"] + back_dist, 1)
         r["num_stops"] = len(r["stops"])
-        r["estimated_duration_min"] = round(r["total_distance_km"] * 2.5, 0) # ~24 km/h avg rural speed
+        r["estimated_duration_min"] = round(r["total_distance_km"] * RURAL_MIN_PER_KM, 0)
         
         total_km += r["total_distance_km"]
         total_served += r["num_stops"]
@@ -86,17 +121,775 @@ def _greedy_vrp_optimizer(
     }
 
 
+def _cvrp_optimizer(
+    villages: List[Dict],
+    terminals: List[Dict],
+    starts: List[int],
+    ends: List[int],
+    capacities: List[int],
+    max_distance_km: float,
+    time_limit_s: float,
+    schedule: Optional[Dict] = None,
+) -> Optional[Dict]:
+    """
+    Capacitated VRP with OR-Tools: one delivery per village, tanker capacities,
+    a maximum route length per tanker, and guided local search for `time_limit_s`.
+    Vehicle k runs from terminal starts[k] to terminal ends[k].
+    When not every village fits (capacity / distance), the solver drops the set
+    with the least total priority. Returns None if no solution was found in time.
+
+    With a schedule ({"calendar", "min_per_km", "service_min"}) this is a VRPTW:
+    every route leaves and returns within one of the calendar's open windows
+    (so every stop falls in it too), and arriving after a village's
+    "deadline" costs URGENCY_LATE_PENALTY per minute (by its "urgency").
+    """
+    started = time.perf_counter()
+    t = len(terminals)
+    distance_km = _matrix(terminals, villages)
+    distance_m = np.rint(distance_km * 1000).astype(np.int64)
+    max_route_m = int(max_distance_km * 1000)
+
+    # A village needing more than a tanker carries takes that tanker's full load
+    demand = np.array([0] * t + [int(v.get("demand", 0)) for v in villages], dtype=np.int64)
+    capacities = [int(c) for c in capacities]
+
+    manager = pywrapcp.RoutingIndexManager(len(demand), len(capacities), list(starts), list(ends))
+    routing = pywrapcp.RoutingModel(manager)
+
+    def distance_callback(from_index, to_index):
+        return int(distance_m[manager.IndexToNode(from_index), manager.IndexToNode(to_index)])
+
+    transit = routing.RegisterTransitCallback(distance_callback)
+    routing.SetArcCostEvaluatorOfAllVehicles(transit)
+    routing.AddDimension(transit, 0, max_route_m, True, "Distance")
+    # One load callback per tanker size (kept referenced: the solver does not own them).
+    # Registered as binary transits; per-vehicle unary transits break with disjunctions.
+    load_functions, load_callbacks = [], {}
+    for capacity in sorted(set(capacities)):
+        loads = np.minimum(demand, capacity)
+        load_functions.append(lambda from_index, _to, loads=loads: int(loads[manager.IndexToNode(from_index)]))
+        load_callbacks[capacity] = routing.RegisterTransitCallback(load_functions[-1])
+    routing.AddDimensionWithVehicleTransitAndCapacity(
+        [load_callbacks[c] for c in capacities], 0, capacities, True, "Capacity"
+    )
+
+    time_dimension = None
+    if schedule is not None:
+        calendar = schedule["calendar"]
+        service = np.array([0] * t + [schedule["service_min"]] * len(villages), dtype=np.int64)
+        time_min = np.rint(distance_km * schedule["min_per_km"]).astype(np.int64) + service[:, None]
+
+        def time_callback(from_index, to_index):
+            return int(time_min[manager.IndexToNode(from_index), manager.IndexToNode(to_index)])
+
+        time_transit = routing.RegisterTransitCallback(time_callback)
+        # Slack lets a tanker wait (for opening time or the next safe day)
+        routing.AddDimension(time_transit, calendar.horizon, calendar.horizon, False, "Time")
+        time_dimension = routing.GetDimensionOrDie("Time")
+        closed = calendar.closed_intervals()
+        indices = [manager.NodeToIndex(node) for node in range(t, len(demand))]
+        for vehicle in range(len(capacities)):
+            indices += [routing.Start(vehicle), routing.End(vehicle)]
+            time_dimension.SetSpanUpperBoundForVehicle(calendar.shift_minutes, vehicle)
+        for index in indices:
+            for lo, hi in closed:
+                time_dimension.CumulVar(index).RemoveInterval(lo, hi)
+        # Departure and return in the same window, so no route runs through a closed night.
+        # Cumuls only grow along a route, so every stop lands in that window too.
+        solver = routing.solver()
+        opens = [opens for opens, _ in calendar.windows]
+        closes = [closes for _, closes in calendar.windows]
+        for vehicle in range(len(capacities)):
+            window = solver.IntVar(0, len(calendar.windows) - 1, f"window_{vehicle}")
+            solver.Add(time_dimension.CumulVar(routing.Start(vehicle)) >= solver.Element(opens, window))
+            solver.Add(time_dimension.CumulVar(routing.End(vehicle)) <= solver.Element(closes, window))
+        for vehicle in range(len(capacities)):
+            routing.AddVariableMinimizedByFinalizer(time_dimension.CumulVar(routing.Start(vehicle)))
+            routing.AddVariableMinimizedByFinalizer(time_dimension.CumulVar(routing.End(vehicle)))
+
+    # Dropping a village costs more than any route could save, scaled by its priority
+    # (and, with deadlines, more than serving it as late as possible)
+    for node, village in enumerate(villages, start=t):
+        penalty = int(max_route_m * (1 + village.get("priority", 0)))
+        if time_dimension is not None and village.get("deadline") is not None:
+            late_penalty = URGENCY_LATE_PENALTY.get(village.get("urgency"), URGENCY_LATE_PENALTY["medium"])
+            deadline = max(0, calendar.minutes(village["deadline"]))
+            time_dimension.SetCumulVarSoftUpperBound(manager.NodeToIndex(node), deadline, late_penalty)
+            penalty += late_penalty * calendar.horizon
+        routing.AddDisjunction([manager.NodeToIndex(node)], penalty)
+
+    params = pywrapcp.DefaultRoutingSearchParameters()
+    params.first_solution_strategy = routing_enums_pb2.FirstSolutionStrategy.PATH_CHEAPEST_ARC
+    params.local_search_metaheuristic = routing_enums_pb2.LocalSearchMetaheuristic.GUIDED_LOCAL_SEARCH
+    params.time_limit.FromMilliseconds(max(1, int(time_limit_s * 1000)))
+
+    solution = routing.SolveWithParameters(params)
+    if solution is None:
+        return None
+
+    routes = []
+    served = set()
+    arrivals, timings = {}, {}  # VRPTW: minute of each arrival, (departure, return) per vehicle
+    for vehicle, capacity in enumerate(capacities):
+        index = routing.Start(vehicle)
+        stops, route_km, load, prev = [], 0.0, 0, starts[vehicle]
+        departure = solution.Min(time_dimension.CumulVar(index)) if time_dimension is not None else None
+        index = solution.Value(routing.NextVar(index))
+        while not routing.IsEnd(index):
+            node = manager.IndexToNode(index)
+            village = villages[node - t]
+            route_km += distance_km[prev, node]
+            delivered = int(min(demand[node], capacity))
+            load += delivered
+            if time_dimension is not None:
+                arrivals[village["id"]] = solution.Min(time_dimension.CumulVar(index))
+            stops.append({
+                "village_id": village["id"],
+                "village_name": village["name"],
+                "lat": village["lat"],
+                "lng": village["lng"],
+                "demand": village.get("demand", 0),
+                "delivered_liters": delivered,
+                "priority": village.get("priority", 0),
+                "sequence": len(stops) + 1,
+            })
+            served.add(node)
+            prev = node
+            index = solution.Value(routing.NextVar(index))
+        if not stops:
+            continue
+        route_km += distance_km[prev, ends[vehicle]]
+        routes.append({
+            "vehicle_id": vehicle,
+            "stops": stops,
+            "total_distance_km": round(float(route_km), 1),
+            "num_stops": len(stops),
+            "load_liters": load,
+            "capacity_liters": capacity,
+            "estimated_duration_min": round(float(route_km) * RURAL_MIN_PER_KM, 0),
+        })
+        if time_dimension is not None:
+            timings[vehicle] = (departure, solution.Min(time_dimension.CumulVar(index)))
+
+    dropped = [
+        {"village_id": v["id"], "village_name": v["name"], "priority": v.get("priority", 0)}
+        for node, v in enumerate(villages, start=t) if node not in served
+    ]
+    return {
+        "routes": routes,
+        "total_distance_km": round(sum(r["total_distance_km"] for r in routes), 1),
+        "num_vehicles_used": len(routes),
+        "num_villages_served": len(served),
+        "dropped_villages": dropped,
+        "status": "optimized",
+        "provider": "ortools_cvrp" if schedule is None else "ortools_vrptw",
+        "solver": {
+            "time_limit_s": time_limit_s,
+            "wall_s": round(time.perf_counter() - started, 3),
+            "objective": solution.ObjectiveValue(),
+        },
+        **({"arrivals": arrivals, "timings": timings} if schedule is not None else {}),
+    }
+
+
+def _improve_result(
+    result: Dict,
+    villages: List[Dict],
+    terminals: List[Dict],
+    starts: List[int],
+    ends: List[int],
+    capacities: Optional[List[int]],
+    max_distance_km: float,
+    time_budget_ms: float,
+) -> Dict:
+    """Run a constructor's routes through local search and rebuild the response."""
+    routes = result["routes"]
+    if not routes:
+        return result
+    t = len(terminals)
+    node_of = {v["id"]: i for i, v in enumerate(villages, start=t)}
+    distance = _matrix(terminals, villages, dtype=np.float64)
+    demand = np.array([0] * t + [v.get("demand", 0) for v in villages], dtype=float)
+    route_capacities = None
+    if capacities:
+        route_capacities = [r.get("capacity_liters", capacities[r["vehicle_id"]]) for r in routes]
+    improved = improve_routes(
+        [[node_of[s["village_id"]] for s in r["stops"]] for r in routes],
+        distance,
+        depots=[starts[r["vehicle_id"]] for r in routes],
+        demand=demand,
+        capacities=route_capacities,
+        max_route_km=max_distance_km,
+        time_budget_ms=time_budget_ms,
+        ends=[ends[r["vehicle_id"]] for r in routes],
+    )
+
+    stops_by_node = {node_of[s["village_id"]]: s for r in routes for s in r["stops"]}
+    final_routes = []
+    for k, (route, nodes) in enumerate(zip(routes, improved["routes"])):
+        if not nodes:
+            continue
+        stops = []
+        for sequence, node in enumerate(nodes, start=1):
+            stop = dict(stops_by_node[node], sequence=sequence)
+            if route_capacities is not None:
+                stop["delivered_liters"] = int(min(demand[node], route_capacities[k]))
+            stops.append(stop)
+        length = improved["lengths_km"][k]
+        route = dict(route, stops=stops, num_stops=len(stops))
+        route["total_distance_km"] = round(length, 1)
+        route["estimated_duration_min"] = round(length * RURAL_MIN_PER_KM, 0)
+        if route_capacities is not None:
+            route["load_liters"] = sum(s["delivered_liters"] for s in stops)
+        final_routes.append(route)
+
+    result.update({
+        "routes": final_routes,
+        "total_distance_km": round(sum(r["total_distance_km"] for r in final_routes), 1),
+        "num_vehicles_used": len(final_routes),
+        "improvement": improved["stats"],
+    })
+    return result
+
+
+def _schedule_routes(
+    result: Dict,
+    villages: List[Dict],
+    terminals: List[Dict],
+    starts: List[int],
+    ends: List[int],
+    schedule: Dict,
+) -> Dict:
+    """
+    Stamp departure, arrival and return times on every route. Solver routes keep
+    the solver's times; others (greedy fallback) leave at the first open minute
+    and wait out closed hours / blocked days before each leg.
+    """
+    calendar = schedule["calendar"]
+    arrivals = result.pop("arrivals", {})
+    timings = result.pop("timings", {})
+    t = len(terminals)
+    node_of = {v["id"]: i for i, v in enumerate(villages, start=t)}
+    village_of = {v["id"]: v for v in villages}
+    travel = _matrix(terminals, villages, dtype=np.float64) * schedule["min_per_km"]
+
+    def open_at(minute: float) -> int:
+        opened = calendar.next_open(int(math.ceil(minute)))
+        return opened if opened is not None else int(math.ceil(minute))
+
+    late_stops = 0
+    for route in result["routes"]:
+        vehicle = route["vehicle_id"]
+        simulate = vehicle not in timings
+        clock = departure = open_at(0) if simulate else timings[vehicle][0]
+        prev = starts[vehicle]
+        for stop in route["stops"]:
+            node = node_of[stop["village_id"]]
+            clock = open_at(clock + travel[prev, node]) if simulate else arrivals[stop["village_id"]]
+            stop["arrival_at"] = calendar.at(clock).isoformat()
+            deadline = village_of[stop["village_id"]].get("deadline")
+            if deadline is not None:
+                stop["urgency"] = village_of[stop["village_id"]].get("urgency")
+                stop["deadline_at"] = deadline.isoformat()
+                stop["late_min"] = max(0, clock - calendar.minutes(deadline))
+                late_stops += stop["late_min"] > 0
+            clock += schedule["service_min"]
+            prev = node
+        back = open_at(clock + travel[prev, ends[vehicle]]) if simulate else timings[vehicle][1]
+        route["departure_at"] = calendar.at(departure).isoformat()
+        route["return_at"] = calendar.at(back).isoformat()
+        route["estimated_duration_min"] = back - departure
+
+    result["schedule"] = {
+        **calendar.describe(),
+        "min_per_km": schedule["min_per_km"],
+        "service_min": schedule["service_min"],
+        "late_stops": late_stops,
+    }
+    return result
+
+
+def default_schedule(blocked_dates=(), min_per_km: float = RURAL_MIN_PER_KM) -> Dict:
+    """VRPTW settings for a plan starting now, with depot hours from config."""
+    return {
+        "calendar": ServiceCalendar(datetime.utcnow().replace(second=0, microsecond=0), blocked_dates=blocked_dates),
+        "min_per_km": min_per_km,
+        "service_min": SERVICE_MIN_PER_STOP,
+    }
+
+
+def _solve_subproblem(
+    villages: List[Dict],
+    terminals: List[Dict],
+    starts: List[int],
+    ends: List[int],
+    capacities: Optional[List[int]],
+    max_distance_km: float,
+    time_limit_s: float,
+    mode: str,
+    improve_budget_ms: float,
+    schedule: Optional[Dict] = None,
+) -> Dict:
+    """
+    Construct (CVRP / VRPTW, greedy fallback) and improve one fleet's routes.
+    Runs in worker processes.
+    """
+    if mode == "vrptw" and not schedule["calendar"].windows:
+        return {"routes": [], "total_distance_km": 0, "num_vehicles_used": 0, "num_villages_served": 0,
+                "status": "weather_blocked", "provider": "none", "schedule": schedule["calendar"].describe()}
+
+    result = None
+    if mode in ("cvrp", "vrptw"):
+        if pywrapcp is None:
+            fallback_reason = "ortools_unavailable"
+        else:
+            result = _cvrp_optimizer(
+                villages, terminals, starts, ends, capacities, max_distance_km, time_limit_s,
+                schedule if mode == "vrptw" else None,
+            )
+            fallback_reason = "solver_timeout"
+    if result is None:
+        result = _greedy_vrp_optimizer(villages, terminals, starts, ends)
+        if mode != "greedy":
+            result["fallback_reason"] = fallback_reason
+
+    if mode == "vrptw":
+        # Local search only knows distance; it would reorder stops against their deadlines
+        return _schedule_routes(result, villages, terminals, starts, ends, schedule)
+
+    # Every constructor's routes pass through the local-search stage before dispatch
+    return _improve_result(
+        result, villages, terminals, starts, ends, capacities or None, max_distance_km, improve_budget_ms
+    )
+
+
+# ─── Multi-start search ───
+
+def _construct_subproblem(
+    construction: str,
+    seed: int,
+    villages: List[Dict],
+    terminals: List[Dict],
+    starts: List[int],
+    ends: List[int],
+    capacities: Optional[List[int]],
+    max_distance_km: float,
+    improve_budget_ms: float,
+) -> Dict:
+    """
+    One multi-start run: a start construction, then local search.
+    Runs in worker processes.
+    """
+    t = len(terminals)
+    points = terminals + villages
+    distance = _matrix(terminals, villages, dtype=np.float64)
+    demand = np.array([0] * t + [v.get("demand", 0) for v in villages], dtype=float)
+    priority = np.array([0] * t + [v.get("priority", 0) for v in villages], dtype=float)
+    built = construct_routes(
+        construction, distance, t, starts, ends, demand, capacities or None, max_distance_km, priority,
+        (np.array([p["lat"] for p in points]), np.array([p["lng"] for p in points])), seed,
+    )
+
+    routes = []
+    for vehicle, nodes in enumerate(built["routes"]):
+        if not nodes:
+            continue
+        path = [starts[vehicle]] + nodes + [ends[vehicle]]
+        route_km = float(sum(distance[a, b] for a, b in zip(path[:-1], path[1:])))
+        stops = []
+        for node in nodes:
+            village = villages[node - t]
+            stop = {
+                "village_id": village["id"],
+                "village_name": village["name"],
+                "lat": village["lat"],
+                "lng": village["lng"],
+                "demand": village.get("demand", 0),
+                "priority": village.get("priority", 0),
+                "sequence": len(stops) + 1,
+            }
+            if capacities:
+                stop["delivered_liters"] = int(min(demand[node], capacities[vehicle]))
+            stops.append(stop)
+        route = {
+            "vehicle_id": vehicle,
+            "stops": stops,
+            "total_distance_km": round(route_km, 1),
+            "num_stops": len(stops),
+            "estimated_duration_min": round(route_km * RURAL_MIN_PER_KM, 0),
+        }
+        if capacities:
+            route["load_liters"] = sum(s["delivered_liters"] for s in stops)
+            route["capacity_liters"] = int(capacities[vehicle])
+        routes.append(route)
+
+    result = {
+        "routes": routes,
+        "total_distance_km": round(sum(r["total_distance_km"] for r in routes), 1),
+        "num_vehicles_used": len(routes),
+        "num_villages_served": sum(r["num_stops"] for r in routes),
+        "dropped_villages": [
+            {"village_id": villages[node - t]["id"], "village_name": villages[node - t]["name"],
+             "priority": villages[node - t].get("priority", 0)}
+            for node in built["dropped"]
+        ],
+        "status": "optimized",
+        "provider": "multi_start",
+    }
+    return _improve_result(
+        result, villages, terminals, starts, ends, capacities or None, max_distance_km, improve_budget_ms
+    )
+
+
+def _objective_km(result: Dict, max_distance_km: float, capacities: Optional[List[int]] = None) -> float:
+    """
+    Route km plus the CVRP's priority-scaled penalty for every dropped village.
+    Greedy ignores both limits, so stops on a route over max_distance_km count as
+    dropped, and so do the stops after a route's load passes its tanker capacity.
+    """
+    unserved = list(result.get("dropped_villages", []))
+    for route in result["routes"]:
+        if route["total_distance_km"] > max_distance_km + 0.1:
+            unserved += route["stops"]
+        elif capacities:
+            capacity = route.get("capacity_liters", capacities[route["vehicle_id"]])
+            load = np.cumsum([min(stop.get("demand", 0), capacity) for stop in route["stops"]])
+            unserved += [stop for stop, carried in zip(route["stops"], load) if carried > capacity]
+    return result.get("total_distance_km", 0) + sum(max_distance_km * (1 + v.get("priority", 0)) for v in unserved)
+
+
+def _start_plan():
+    """The mode's own solver first, each construction in classic form, then seeded restarts."""
+    yield "solver", 0
+    seed = 0
+    while True:
+        for construction in CONSTRUCTIONS:
+            yield construction, seed
+        seed += 1
+
+
+async def _multi_start_search(
+    villages: List[Dict],
+    terminals: List[Dict],
+    starts: List[int],
+    ends: List[int],
+    capacities: Optional[List[int]],
+    max_distance_km: float,
+    time_limit_s: float,
+    mode: str,
+    improve_budget_ms: float,
+    time_budget_ms: float,
+    workers: int,
+    on_incumbent: Optional[Callable[[Dict], Awaitable[None]]] = None,
+    label: Optional[Dict] = None,
+    use_pool: Optional[bool] = None,
+) -> Dict:
+    """
+    Anytime search: keep `workers` starts in flight (on the shared process pool,
+    or one thread for a single worker unless use_pool is set) until
+    time_budget_ms runs out, and keep the best result by _objective_km. Each
+    start's solver / local-search budget is capped by the time left, so the
+    search ends close to the budget. Every new incumbent is passed to
+    on_incumbent (tagged with `label`) as it is found.
+    """
+    started = time.perf_counter()
+    deadline = started + time_budget_ms / 1000
+    loop = asyncio.get_running_loop()
+    pool = get_pool() if (workers > 1 if use_pool is None else use_pool) else None
+    plan = _start_plan()
+
+    def submit(construction: str, seed: int):
+        remaining_ms = max(1.0, (deadline - time.perf_counter()) * 1000)
+        if construction == "solver":
+            # Half the budget at most, so a single worker still gets to the other starts
+            return loop.run_in_executor(
+                pool, _solve_subproblem, villages, terminals, starts, ends, capacities, max_distance_km,
+                min(time_limit_s, remaining_ms / 2000), mode, min(improve_budget_ms, remaining_ms / 2),
+            )
+        return loop.run_in_executor(
+            pool, _construct_subproblem, construction, seed, villages, terminals, starts, ends,
+            capacities, max_distance_km, min(improve_budget_ms, remaining_ms),
+        )
+
+    pending: Dict = {}
+    best, best_objective, incumbents, runs = None, math.inf, [], 0
+    while True:
+        while len(pending) < workers and (runs + len(pending) == 0 or time.perf_counter() < deadline):
+            construction, seed = next(plan)
+            pending[submit(construction, seed)] = (construction, seed)
+        if not pending:
+            break
+        done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+        for future in done:
+            construction, seed = pending.pop(future)
+            result = future.result()
+            runs += 1
+            objective = _objective_km(result, max_distance_km, capacities)
+            if objective >= best_objective - 1e-6:
+                continue
+            best, best_objective = result, objective
+            incumbent = {
+                "construction": construction,
+                "seed": seed,
+                "objective_km": round(objective, 1),
+                "total_distance_km": result.get("total_distance_km", 0),
+                "num_villages_served": result.get("num_villages_served", 0),
+                "elapsed_ms": round((time.perf_counter() - started) * 1000, 1),
+            }
+            incumbents.append(incumbent)
+            if on_incumbent is not None:
+                await on_incumbent({
+                    **(label or {}),
+                    **incumbent,
+                    "routes": [
+                        {
+                            "vehicle_id": r["vehicle_id"],
+                            "total_distance_km": r["total_distance_km"],
+                            "stops": [
+                                {"village_id": st["village_id"], "lat": st["lat"], "lng": st["lng"]}
+                                for st in r["stops"]
+                            ],
+                        }
+                        for r in result["routes"]
+                    ],
+                })
+
+    best["multi_start"] = {
+        "time_budget_ms": time_budget_ms,
+        "workers": workers,
+        "starts": runs,
+        "best": {"construction": incumbents[-1]["construction"], "seed": incumbents[-1]["seed"]},
+        "incumbents": incumbents,
+        "wall_ms": round((time.perf_counter() - started) * 1000, 1),
+    }
+    return best
+
+
 async def optimize_routes(
     depot: Dict,
     villages: List[Dict],
     num_vehicles: int = 3,
-    max_distance_km: float = 300
+    max_distance_km: float = 300,
+    capacities: Optional[List[int]] = None,
+    time_limit_s: float = ROUTE_SOLVER_TIME_LIMIT_S,
+    mode: str = "cvrp",
+    improve_budget_ms: float = ROUTE_IMPROVE_TIME_BUDGET_MS,
+    schedule: Optional[Dict] = None,
+    time_budget_ms: Optional[float] = None,
+    workers: Optional[int] = None,
+    on_incumbent: Optional[Callable[[Dict], Awaitable[None]]] = None,
 ) -> Dict:
     """
     Entry point for route optimization.
-    Uses robust internal logic for Nagpur Pilot.
+    mode="cvrp" solves a capacitated VRP (capacities default to one standard tanker
+    per vehicle) and falls back to the greedy heuristic if OR-Tools is unavailable
+    or finds no solution within the time limit; mode="greedy" skips the solver.
+    Either way the routes are then improved by local search (2-opt, Or-opt,
+    relocate, exchange) within improve_budget_ms.
+    mode="vrptw" also schedules the routes in time (schedule defaults to
+    default_schedule()): villages may carry "deadline" / "urgency", and every
+    stop gets an arrival time. Its routes skip local search.
+    time_budget_ms (cvrp / greedy) switches to a multi-start search over that
+    budget: the mode's own solution plus savings, sweep, nearest-neighbour and
+    insertion starts with seeded restarts, `workers` at a time (default
+    WORKER_PROCESSES), each improved by local search; the best is returned and
+    every improving incumbent is awaited through on_incumbent.
     """
     if not villages:
         return {"routes": [], "total_distance_km": 0, "status": "no_villages", "provider": "none"}
 
-    return _greedy_vrp_optimizer(villages, depot, num_vehicles)
+    capacities = list(capacities or [])[:num_vehicles]
+    if capacities or mode != "greedy":
+        capacities += [DEFAULT_TANKER_CAPACITY_LITERS] * (num_vehicles - len(capacities))
+    if mode == "vrptw" and schedule is None:
+        schedule = default_schedule()
+
+    if time_budget_ms and mode != "vrptw":
+        return await _multi_start_search(
+            villages, [depot], [0] * num_vehicles, [0] * num_vehicles, capacities, max_distance_km,
+            time_limit_s, mode, improve_budget_ms, time_budget_ms, max(1, workers or WORKER_PROCESSES),
+            on_incumbent,
+        )
+
+    # The solver blocks for up to time_limit_s; keep the event loop free
+    return await asyncio.to_thread(
+        _solve_subproblem, villages, [depot], [0] * num_vehicles, [0] * num_vehicles,
+        capacities, max_distance_km, time_limit_s, mode, improve_budget_ms, schedule,
+    )
+
+
+# ─── Multi-depot fleets ───
+
+def _location_key(point: Dict) -> tuple:
+    return round(point["lat"], 6), round(point["lng"], 6)
+
+
+def _cluster_villages(
+    villages: List[Dict], depots: List[Dict], max_distance_km: float
+) -> tuple:
+    """
+    Assign each village to the nearest depot it can be reached from and back
+    within max_distance_km whose fleet still has room for it, highest priority
+    first. When every in-range fleet is full the nearest in-range depot takes it
+    (its solver then decides what to drop). Returns (villages per depot, out of range).
+    """
+    clusters = [[] for _ in depots]
+    out_of_range = []
+    distance = haversine_matrix(
+        [v["lat"] for v in villages], [v["lng"] for v in villages],
+        [d["lat"] for d in depots], [d["lng"] for d in depots],
+    )
+    spare = np.array([sum(d["capacities"]) for d in depots], dtype=float)
+    largest = np.array([max(d["capacities"]) for d in depots], dtype=float)
+    order = sorted(range(len(villages)), key=lambda i: (-villages[i].get("priority", 0), villages[i]["id"]))
+    for i in order:
+        in_range = [k for k in np.argsort(distance[i], kind="stable") if 2 * distance[i, k] <= max_distance_km]
+        if not in_range:
+            out_of_range.append(villages[i])
+            continue
+        load = np.minimum(villages[i].get("demand", 0), largest)
+        chosen = next((k for k in in_range if spare[k] >= load[k]), in_range[0])
+        spare[chosen] -= load[chosen]
+        clusters[chosen].append(villages[i])
+    return clusters, out_of_range
+
+
+async def optimize_fleet_routes(
+    vehicles: List[Dict],
+    villages: List[Dict],
+    max_distance_km: float = 300,
+    time_limit_s: float = ROUTE_SOLVER_TIME_LIMIT_S,
+    mode: str = "cvrp",
+    improve_budget_ms: float = ROUTE_IMPROVE_TIME_BUDGET_MS,
+    workers: Optional[int] = None,
+    schedule: Optional[Dict] = None,
+    time_budget_ms: Optional[float] = None,
+    on_incumbent: Optional[Callable[[Dict], Awaitable[None]]] = None,
+) -> Dict:
+    """
+    Multi-depot routing for tankers with their own depots.
+    vehicles: [{"id", "capacity", "depot": {"lat", "lng"}, "start": {"lat", "lng"} (optional)}];
+    each tanker leaves `start` (its current position; defaults to the depot) and
+    ends at its depot. Villages are clustered to depots (see _cluster_villages)
+    and each depot's fleet is routed as an independent subproblem, in parallel
+    across a process pool. time_limit_s is the overall solver budget.
+    Modes, `schedule` and the multi-start time_budget_ms are as for
+    optimize_routes; depots then search concurrently, sharing the workers, and
+    incumbents are tagged with their depot_id.
+    """
+    if not villages or not vehicles:
+        return {"routes": [], "total_distance_km": 0, "status": "no_villages" if not villages else "no_vehicles",
+                "provider": "none"}
+
+    fleets: Dict[tuple, Dict] = {}
+    for index, vehicle in enumerate(vehicles):
+        depot = vehicle["depot"]
+        fleet = fleets.setdefault(_location_key(depot), {
+            "lat": depot["lat"], "lng": depot["lng"], "name": depot.get("name"),
+            "vehicles": [], "capacities": [],
+        })
+        fleet["vehicles"].append(index)
+        fleet["capacities"].append(int(vehicle.get("capacity") or DEFAULT_TANKER_CAPACITY_LITERS))
+    depots = list(fleets.values())
+    if mode == "vrptw" and schedule is None:
+        schedule = default_schedule()
+    clusters, out_of_range = _cluster_villages(villages, depots, max_distance_km)
+
+    jobs = []
+    for depot, cluster in zip(depots, clusters):
+        if not cluster:
+            continue
+        # Terminal 0 is the depot; tankers away from it start at their own terminal
+        terminals, starts = [{"lat": depot["lat"], "lng": depot["lng"]}], []
+        terminal_of = {_location_key(depot): 0}
+        for index in depot["vehicles"]:
+            start = vehicles[index].get("start") or depot
+            key = _location_key(start)
+            if key not in terminal_of:
+                terminal_of[key] = len(terminals)
+                terminals.append({"lat": start["lat"], "lng": start["lng"]})
+            starts.append(terminal_of[key])
+        jobs.append((depot, (cluster, terminals, starts, [0] * len(starts), depot["capacities"])))
+
+    workers = max(1, workers or WORKER_PROCESSES)
+    # Subproblems run in waves as wide as the pool allows, so each wave gets its share of the budget
+    parallel = min(workers, pool_size()) if workers > 1 and len(jobs) > 1 else 1
+    limit = time_limit_s / max(1, math.ceil(len(jobs) / parallel))
+    args = [(*job, max_distance_km, limit, mode, improve_budget_ms, schedule) for _, job in jobs]
+    if time_budget_ms and mode != "vrptw":
+        # Workers split as evenly as possible, at least one start in flight per depot
+        base, extra = divmod(workers, max(1, len(jobs)))
+        results = await asyncio.gather(*(
+            _multi_start_search(
+                *job, max_distance_km, limit, mode, improve_budget_ms, time_budget_ms,
+                max(1, base + (depot_id < extra)), on_incumbent, {"depot_id": depot_id},
+                use_pool=workers > 1,
+            )
+            for depot_id, (_, job) in enumerate(jobs)
+        ))
+    elif workers == 1 or len(jobs) <= 1:
+        results = [await asyncio.to_thread(_solve_subproblem, *a) for a in args]
+    else:
+        loop = asyncio.get_running_loop()
+        pool = get_pool()
+        # The pool is shared; `workers` bounds how many depots are on it at once
+        slots = asyncio.Semaphore(workers)
+
+        async def solve(a):
+            async with slots:
+                return await loop.run_in_executor(pool, _solve_subproblem, *a)
+
+        results = await asyncio.gather(*(solve(a) for a in args))
+
+    routes, dropped, summaries = [], [], []
+    for depot_id, ((depot, job), result) in enumerate(zip(jobs, results)):
+        location = {"lat": depot["lat"], "lng": depot["lng"], "name": depot["name"]}
+        for route in result["routes"]:
+            vehicle = vehicles[depot["vehicles"][route["vehicle_id"]]]
+            route.update({
+                "vehicle_id": depot["vehicles"][route["vehicle_id"]],
+                "tanker_id": vehicle.get("id"),
+                "depot_id": depot_id,
+                "depot": location,
+                "start": vehicle.get("start") or location,
+            })
+            routes.append(route)
+        dropped.extend(result.get("dropped_villages", []))
+        summaries.append({
+            "depot_id": depot_id,
+            **location,
+            "vehicles": len(depot["vehicles"]),
+            "villages_assigned": len(job[0]),
+            "status": result.get("status"),
+            "provider": result.get("provider"),
+            "total_distance_km": result.get("total_distance_km", 0),
+            **({"fallback_reason": result["fallback_reason"]} if "fallback_reason" in result else {}),
+            **({"improvement": result["improvement"]} if "improvement" in result else {}),
+            **({"multi_start": result["multi_start"]} if "multi_start" in result else {}),
+        })
+    dropped.extend(
+        {"village_id": v["id"], "village_name": v["name"], "priority": v.get("priority", 0), "reason": "out_of_range"}
+        for v in out_of_range
+    )
+
+    fleet_result = {
+        "routes": routes,
+        "depots": summaries,
+        "total_distance_km": round(sum(r["total_distance_km"] for r in routes), 1),
+        "num_vehicles_used": len(routes),
+        "num_villages_served": sum(r["num_stops"] for r in routes),
+        "dropped_villages": dropped,
+        "status": "optimized",
+        "provider": "multi_depot",
+        "solver": {"subproblems": len(jobs), "workers": min(workers, max(1, len(jobs))), "time_limit_s": limit},
+    }
+    if mode == "vrptw":
+        fleet_result["schedule"] = {
+            **schedule["calendar"].describe(),
+            "min_per_km": schedule["min_per_km"],
+            "service_min": schedule["service_min"],
+            "late_stops": sum(r.get("schedule", {}).get("late_stops", 0) for r in results),
+        }
+        if not schedule["calendar"].windows:
+            fleet_result["status"] = "weather_blocked"
+    return fleet_result
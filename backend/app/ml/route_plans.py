@@ -0,0 +1,315 @@
+"""
+Live route plans and incremental edits.
+Plans returned by /routes/optimize are kept here (bounded LRU) so an urgent
+request can be slotted into the routes already handed to drivers instead of
+re-solving from scratch: the stop goes to the cheapest feasible gap across all
+routes (tanker capacity, max route length and, for VRPTW plans, operating hours
+and deadlines), then only the touched route is repaired with 2-opt / Or-opt.
+Cancelled stops are removed the same way. Edits return just the changed routes.
+"""
+import copy
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from app.ml.distance_matrix import haversine_matrix, haversine_pairs
+from app.ml.local_search import improve_routes
+from app.ml.route_optimizer import RURAL_MIN_PER_KM
+from app.ml.time_windows import URGENCY_LATE_PENALTY
+
+MAX_PLANS = 64
+REPAIR_BUDGET_MS = 20
+EPSILON = 1e-9
+
+
+def _route_ends(route: Dict, result: Dict) -> Tuple[Dict, Dict]:
+    """Where the route's tanker leaves from and returns to."""
+    depot = route.get("depot", result.get("depot"))
+    return route.get("start", depot), depot
+
+
+def _path(route: Dict, result: Dict) -> Tuple[np.ndarray, np.ndarray]:
+    start, end = _route_ends(route, result)
+    points = [start] + route["stops"] + [end]
+    return np.array([p["lat"] for p in points]), np.array([p["lng"] for p in points])
+
+
+class RoutePlanStore:
+    """Optimizer results by plan id, with cheapest-insertion / removal edits."""
+
+    def __init__(self, max_plans: int = MAX_PLANS):
+        self.max_plans = max_plans
+        self._plans: "OrderedDict[str, Dict]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def save(
+        self,
+        result: Dict,
+        max_distance_km: float,
+        schedule: Optional[Dict] = None,
+        idle: Optional[List[Dict]] = None,
+    ) -> str:
+        """
+        Keep an optimizer result for later edits; returns its plan id. `idle` are
+        empty routes ({"vehicle_id", "capacity_liters", "depot", "start", ...}) for
+        tankers the plan left unused, so insertions can dispatch them.
+        """
+        plan_id = uuid.uuid4().hex[:12]
+        with self._lock:
+            self._plans[plan_id] = {
+                "result": result,
+                "idle": [dict(route, stops=[]) for route in idle or []],
+                "max_distance_km": max_distance_km,
+                "schedule": schedule,
+                "version": 1,
+            }
+            while len(self._plans) > self.max_plans:
+                self._plans.popitem(last=False)
+        return plan_id
+
+    def get(self, plan_id: str) -> Optional[Dict]:
+        with self._lock:
+            plan = self._plans.get(plan_id)
+            if plan is not None:
+                self._plans.move_to_end(plan_id)
+                return {**copy.deepcopy(plan["result"]), "plan_id": plan_id, "version": plan["version"]}
+        return None
+
+    def version(self, plan_id: str) -> Optional[int]:
+        """Edit count of a plan (1 as optimized), None once evicted."""
+        with self._lock:
+            plan = self._plans.get(plan_id)
+            return plan["version"] if plan is not None else None
+
+    # ─── Time windows (VRPTW plans) ───
+
+    @staticmethod
+    def _timeline(schedule: Dict, lats: np.ndarray, lngs: np.ndarray, departure: int) -> List[int]:
+        """Arrival minute at every path point after the start, waiting out closed hours."""
+        calendar = schedule["calendar"]
+        legs = haversine_pairs(lats[:-1], lngs[:-1], lats[1:], lngs[1:]) * schedule["min_per_km"]
+        clock, arrivals = departure, []
+        for k, leg in enumerate(legs):
+            if k:
+                clock += schedule["service_min"]
+            arrive = int(np.ceil(clock + leg))
+            opened = calendar.next_open(arrive)
+            clock = opened if opened is not None else arrive
+            arrivals.append(clock)
+        return arrivals
+
+    @staticmethod
+    def _lateness_km(schedule: Dict, stops: List[Dict], arrivals: List[int]) -> float:
+        """Deadline overrun priced like the solver does (metres per minute late), in km."""
+        calendar = schedule["calendar"]
+        cost = 0.0
+        for stop, arrival in zip(stops, arrivals):
+            if stop.get("deadline_at"):
+                late = arrival - calendar.minutes(datetime.fromisoformat(stop["deadline_at"]))
+                if late > 0:
+                    cost += late * URGENCY_LATE_PENALTY.get(stop.get("urgency"), URGENCY_LATE_PENALTY["medium"]) / 1000
+        return cost
+
+    @staticmethod
+    def _departures(schedule: Dict, route: Dict) -> List[int]:
+        """The route's departure minute; an idle tanker may leave at any window's opening."""
+        calendar = schedule["calendar"]
+        if route.get("departure_at"):
+            return [calendar.minutes(datetime.fromisoformat(route["departure_at"]))]
+        return [opens for opens, _ in calendar.windows]
+
+    # ─── Edits ───
+
+    def _insertion(self, plan: Dict, route: Dict, stop: Dict) -> Tuple[float, int, Optional[int]]:
+        """
+        (cost in km, gap index, departure minute for VRPTW plans) of the cheapest
+        feasible gap in one route, or (inf, -1, None). A VRPTW route must be back
+        before its departure window closes, as in the solver.
+        """
+        result, schedule = plan["result"], plan["schedule"]
+        capacity = route.get("capacity_liters")
+        if capacity is not None and route.get("load_liters", 0) + min(stop["demand"], capacity) > capacity:
+            return np.inf, -1, None
+        lats, lngs = _path(route, result)
+        legs = haversine_pairs(lats[:-1], lngs[:-1], lats[1:], lngs[1:])
+        to_new = haversine_matrix([stop["lat"]], [stop["lng"]], lats, lngs)[0]
+        cost = to_new[:-1] + to_new[1:] - legs
+        feasible = legs.sum() + cost <= plan["max_distance_km"] + EPSILON
+        departures = np.full(len(cost), -1)
+        if schedule is not None:
+            calendar = schedule["calendar"]
+            candidates = self._departures(schedule, route)
+            base = self._lateness_km(schedule, route["stops"], self._timeline(schedule, lats, lngs, candidates[0]))
+            for gap in np.flatnonzero(feasible):
+                stops = route["stops"][:gap] + [stop] + route["stops"][gap:]
+                gap_lats, gap_lngs = np.insert(lats, gap + 1, stop["lat"]), np.insert(lngs, gap + 1, stop["lng"])
+                for departure in candidates:
+                    arrivals = self._timeline(schedule, gap_lats, gap_lngs, departure)
+                    close = calendar.window_close(departure)
+                    # Arrivals only grow, so a return before close keeps every stop in the window
+                    if close is not None and arrivals[-1] <= close:
+                        departures[gap] = departure
+                        cost[gap] += self._lateness_km(schedule, stops, arrivals[:-1]) - base
+                        break
+                else:
+                    feasible[gap] = False
+        cost = np.where(feasible, cost, np.inf)
+        gap = int(np.argmin(cost))
+        departure = int(departures[gap]) if schedule is not None and feasible[gap] else None
+        return float(cost[gap]), gap, departure
+
+    def _repair(self, plan: Dict, route: Dict):
+        """2-opt / Or-opt on one route (distance plans only: VRPTW stop order carries deadlines)."""
+        if plan["schedule"] is not None or len(route["stops"]) < 2:
+            return
+        start, end = _route_ends(route, plan["result"])
+        points = [start, end] + route["stops"]
+        lats = [p["lat"] for p in points]
+        lngs = [p["lng"] for p in points]
+        improved = improve_routes(
+            [list(range(2, len(points)))],
+            haversine_matrix(lats, lngs, lats, lngs),
+            depots=[0],
+            max_route_km=plan["max_distance_km"],
+            time_budget_ms=REPAIR_BUDGET_MS,
+            ends=[1],
+        )
+        route["stops"] = [points[node] for node in improved["routes"][0]]
+
+    def _refresh(self, plan: Dict, route: Dict):
+        """Recompute a route's sequence, length, load, times and straight-line geometry."""
+        result, schedule = plan["result"], plan["schedule"]
+        for sequence, stop in enumerate(route["stops"], start=1):
+            stop["sequence"] = sequence
+        lats, lngs = _path(route, result)
+        km = float(haversine_pairs(lats[:-1], lngs[:-1], lats[1:], lngs[1:]).sum())
+        route["num_stops"] = len(route["stops"])
+        route["total_distance_km"] = round(km, 1)
+        if "load_liters" in route or "capacity_liters" in route:
+            route["load_liters"] = sum(s.get("delivered_liters", s.get("demand", 0)) for s in route["stops"])
+        if schedule is not None:
+            calendar = schedule["calendar"]
+            departure = self._departures(schedule, route)[0]
+            arrivals = self._timeline(schedule, lats, lngs, departure)
+            route["departure_at"] = calendar.at(departure).isoformat()
+            for stop, arrival in zip(route["stops"], arrivals):
+                stop["arrival_at"] = calendar.at(arrival).isoformat()
+                if stop.get("deadline_at"):
+                    stop["late_min"] = max(0, arrival - calendar.minutes(datetime.fromisoformat(stop["deadline_at"])))
+            route["return_at"] = calendar.at(arrivals[-1]).isoformat()
+            route["estimated_duration_min"] = arrivals[-1] - departure
+        else:
+            route["estimated_duration_min"] = round(km * RURAL_MIN_PER_KM, 0)
+        route["geometry_coords"] = [[lng, lat] for lat, lng in zip(lats.tolist(), lngs.tolist())]
+
+    def _totals(self, plan: Dict):
+        result = plan["result"]
+        result["total_distance_km"] = round(sum(r["total_distance_km"] for r in result["routes"]), 1)
+        result["num_vehicles_used"] = len(result["routes"])
+        result["num_villages_served"] = sum(r["num_stops"] for r in result["routes"])
+        plan["version"] += 1
+
+    def insert_stop(self, plan_id: str, village: Dict) -> Optional[Dict]:
+        """
+        Slot a village ({"id", "name", "lat", "lng", "demand", "priority", and for
+        VRPTW plans optional "deadline" / "urgency"}) into the cheapest feasible gap.
+        Returns None for an unknown plan.
+        """
+        started = time.perf_counter()
+        with self._lock:
+            plan = self._plans.get(plan_id)
+            if plan is None:
+                return None
+            self._plans.move_to_end(plan_id)
+            result = plan["result"]
+            if any(s["village_id"] == village["id"] for r in result["routes"] for s in r["stops"]):
+                return self._edit_response(plan_id, plan, "already_planned", [], started)
+
+            stop = {
+                "village_id": village["id"],
+                "village_name": village["name"],
+                "lat": village["lat"],
+                "lng": village["lng"],
+                "demand": village.get("demand", 0),
+                "priority": village.get("priority", 0),
+            }
+            if village.get("deadline") is not None:
+                stop["urgency"] = village.get("urgency")
+                stop["deadline_at"] = village["deadline"].isoformat()
+
+            best = (np.inf, None, -1, None)
+            for route in result["routes"] + plan["idle"]:
+                cost, gap, departure = self._insertion(plan, route, stop)
+                if cost < best[0]:
+                    best = (cost, route, gap, departure)
+            cost, route, gap, departure = best
+            if route is None:
+                return self._edit_response(plan_id, plan, "no_feasible_route", [], started)
+            if not route["stops"]:
+                plan["idle"].remove(route)
+                result["routes"].append(route)
+            if departure is not None:
+                route["departure_at"] = plan["schedule"]["calendar"].at(departure).isoformat()
+
+            if "capacity_liters" in route:
+                stop["delivered_liters"] = int(min(stop["demand"], route["capacity_liters"]))
+            route["stops"].insert(gap, stop)
+            self._repair(plan, route)
+            self._refresh(plan, route)
+            result["dropped_villages"] = [
+                d for d in result.get("dropped_villages", []) if d["village_id"] != village["id"]
+            ]
+            self._totals(plan)
+            response = self._edit_response(plan_id, plan, "inserted", [route], started)
+            # Added km, plus lateness priced in km for VRPTW plans
+            response["insertion_cost_km"] = round(cost, 2)
+            return response
+
+    def remove_stop(self, plan_id: str, village_id: int) -> Optional[Dict]:
+        """Take a village out of its route and repair that route. Returns None for an unknown plan."""
+        started = time.perf_counter()
+        with self._lock:
+            plan = self._plans.get(plan_id)
+            if plan is None:
+                return None
+            self._plans.move_to_end(plan_id)
+            result = plan["result"]
+            route = next((r for r in result["routes"] if any(s["village_id"] == village_id for s in r["stops"])), None)
+            if route is None:
+                return self._edit_response(plan_id, plan, "not_planned", [], started)
+
+            route["stops"] = [s for s in route["stops"] if s["village_id"] != village_id]
+            if route["stops"]:
+                self._repair(plan, route)
+                self._refresh(plan, route)
+            else:
+                # The tanker has nothing left to deliver; the client clears this route
+                result["routes"].remove(route)
+                route.update(num_stops=0, total_distance_km=0, load_liters=0)
+                # Free to leave in any window once dispatched again
+                route.pop("departure_at", None)
+                route.pop("return_at", None)
+                plan["idle"].append(route)
+            self._totals(plan)
+            return self._edit_response(plan_id, plan, "removed", [route], started)
+
+    @staticmethod
+    def _edit_response(plan_id: str, plan: Dict, status: str, changed: List[Dict], started: float) -> Dict:
+        result = plan["result"]
+        return {
+            "plan_id": plan_id,
+            "version": plan["version"],
+            "status": status,
+            "changed_routes": copy.deepcopy(changed),
+            "total_distance_km": result.get("total_distance_km", 0),
+            "num_villages_served": result.get("num_villages_served", 0),
+            "edit_ms": round((time.perf_counter() - started) * 1000, 3),
+        }
+
+
+route_plans = RoutePlanStore()
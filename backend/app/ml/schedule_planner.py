@@ -0,0 +1,259 @@
+"""
+Rolling multi-day tanker schedule.
+Plans how many tanker trips each village gets on each day of a 7-14 day
+horizon. Daily demand comes from the DroughtPredictor trend projection, and
+fleet capacity is available tankers × TRIPS_PER_TANKER_PER_DAY.
+
+Days are planned in order (rolling horizon): a day's trips are apportioned
+among villages by weight (D'Hondt, capped at each village's need), and the
+outcome (days since supply, outstanding request liters) rolls into the next
+day's weights. The planner caches per-village inputs and each day's result.
+When the change feed reports new requests, deliveries or WSI moves, only
+those villages' inputs are reloaded from the database. Apportionment itself
+is not per village: a day's trips are shared by all villages, so a day is
+re-apportioned in full whenever any village's weight or need on it changed,
+and its cached result is reused only when none did.
+"""
+import heapq
+import threading
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Set
+
+import numpy as np
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from app.models import Tanker, WaterRequest
+from app.ml import change_feed
+from app.ml.allocation_engine import allocation_engine
+from app.ml.drought_predictor import drought_predictor
+from app.ml.ensemble import SEVERITY_EDGES, DEMAND_MULTIPLIERS
+
+MIN_HORIZON_DAYS = 7
+MAX_HORIZON_DAYS = 14
+TRIPS_PER_TANKER_PER_DAY = 2
+AGING_PER_DAY = 0.15  # weight boost per day without supply
+REQUEST_BONUS = 25  # flat weight while a village has undelivered request liters
+DEFAULT_REQUEST_LITERS = 10000
+SEVERITY_SCORES = np.array([10, 30, 55, 80, 100])  # normal .. emergency, as AllocationEngine
+SEVERITY_NAMES = ["normal", "watch", "warning", "critical", "emergency"]
+
+
+def apportion(weights: np.ndarray, caps: np.ndarray, seats: int) -> np.ndarray:
+    """
+    D'Hondt apportionment of `seats` trips: village i's k-th trip has quotient
+    weights[i] / k, the highest quotients win, and no village exceeds caps[i].
+    Ties go to the lower index.
+    """
+    trips = np.zeros(len(weights), dtype=int)
+    heap = [(-w, i) for i, w in enumerate(weights) if caps[i] > 0 and w > 0]
+    heapq.heapify(heap)
+    while seats > 0 and heap:
+        _, i = heapq.heappop(heap)
+        trips[i] += 1
+        seats -= 1
+        if trips[i] < caps[i]:
+            heapq.heappush(heap, (-weights[i] / (trips[i] + 1), i))
+    return trips
+
+
+class SchedulePlanner:
+    """Rolling-horizon trip schedule, re-planned incrementally from the change feed."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._plan_lock = threading.Lock()
+        self._dirty: Set[int] = set()
+        self._inputs: Optional[Dict[str, np.ndarray]] = None
+        self._days: List[Dict] = []
+        self._plan_date = None
+        self._fleet = None
+        self.last_stats: Dict = {}
+        change_feed.subscribe(self._on_change)
+
+    def _on_change(self, changes: Dict[str, Set[int]]):
+        with self._lock:
+            if "village" in changes:
+                self._inputs = None  # villages added/removed: index positions shift
+            for kind in ("request", "trip", "wsi"):
+                self._dirty.update(changes.get(kind, ()))
+
+    # ─── Inputs ───
+
+    def _load_inputs(self, db: Session, village_ids: Optional[List[int]] = None) -> Dict[str, np.ndarray]:
+        """Per-village planning inputs for all villages (or a subset), in a fixed number of queries."""
+        rows = allocation_engine.ranking_rows(db, village_ids)
+        rows.sort(key=lambda row: row[0].id)
+        ids = [row[0].id for row in rows]
+        scored = allocation_engine.score_rows(rows) if rows else None
+        rainfall_trend, gw_trend = drought_predictor.trend_inputs(db, ids) if ids else (np.zeros(0), np.zeros(0))
+
+        request_liters = dict(
+            db.query(
+                WaterRequest.village_id,
+                func.sum(func.coalesce(WaterRequest.quantity_needed_liters, DEFAULT_REQUEST_LITERS)),
+            ).filter(
+                WaterRequest.status.in_(["pending", "approved"]),
+                WaterRequest.village_id.in_(ids),
+            ).group_by(WaterRequest.village_id).all()
+        ) if ids else {}
+
+        return {
+            "ids": np.array(ids, dtype=int),
+            "names": [row[0].name for row in rows],
+            "districts": [row[0].district for row in rows],
+            "population": np.array([row[0].population for row in rows], dtype=float),
+            "current_wsi": np.array([row[1].wsi_score for row in rows], dtype=float),
+            "rainfall_trend": rainfall_trend,
+            "gw_trend": gw_trend,
+            "days_since_supply": scored["days"] if scored else np.zeros(0, dtype=int),
+            "request_liters": np.array([request_liters.get(vid, 0) for vid in ids], dtype=float),
+        }
+
+    def _merge_inputs(self, fresh: Dict[str, np.ndarray], village_ids: Set[int]):
+        """Overwrite the cached inputs of `village_ids` with a partial reload."""
+        inputs = self._inputs
+        position = {vid: i for i, vid in enumerate(inputs["ids"])}
+        if any(vid not in position for vid in fresh["ids"]) or len(fresh["ids"]) != len(
+            [vid for vid in village_ids if vid in position]
+        ):
+            # A village gained its first WSI record or lost it; positions change
+            self._inputs = None
+            return
+        for j, vid in enumerate(fresh["ids"]):
+            i = position[vid]
+            for key, values in fresh.items():
+                if key != "ids":
+                    inputs[key][i] = values[j]
+
+    def _fleet_capacity(self, db: Session):
+        count, total = db.query(func.count(Tanker.id), func.sum(Tanker.capacity_liters)).filter(
+            Tanker.status != "maintenance"
+        ).one()
+        trip_liters = (total / count) if count else 0
+        return count * TRIPS_PER_TANKER_PER_DAY, float(trip_liters)
+
+    # ─── Planning ───
+
+    def _plan_days(self, horizon_days: int, trip_slots: int, trip_liters: float) -> int:
+        """Roll through the horizon, re-apportioning each day on which any village's weight or need changed."""
+        inputs = self._inputs
+        days_since = inputs["days_since_supply"].astype(int).copy()
+        outstanding = inputs["request_liters"].copy()
+        recomputed = 0
+
+        for d in range(horizon_days):
+            wsi = drought_predictor.project_wsi(inputs["current_wsi"], inputs["rainfall_trend"], inputs["gw_trend"], d)
+            severity_idx = np.searchsorted(SEVERITY_EDGES, wsi, side="right")
+            demand = inputs["population"] * 20 * DEMAND_MULTIPLIERS[severity_idx]
+            need = np.ceil((demand + outstanding) / trip_liters).astype(int) if trip_liters else np.zeros(len(wsi), dtype=int)
+            weight = SEVERITY_SCORES[severity_idx] * (1 + AGING_PER_DAY * days_since) + REQUEST_BONUS * (outstanding > 0)
+
+            cached = self._days[d] if d < len(self._days) else None
+            if (
+                cached is not None and cached["trip_slots"] == trip_slots and
+                np.array_equal(cached["weight"], weight) and np.array_equal(cached["need"], need)
+            ):
+                trips = cached["trips"]
+            else:
+                trips = apportion(weight, need, trip_slots)
+                recomputed += 1
+            day = {
+                "trip_slots": trip_slots,
+                "weight": weight,
+                "need": need,
+                "trips": trips,
+                "wsi": wsi,
+                "severity_idx": severity_idx,
+                "demand": demand,
+            }
+            if cached is None:
+                self._days.append(day)
+            else:
+                self._days[d] = day
+
+            # Requests are served first from the day's deliveries; the rest rolls forward
+            outstanding = np.maximum(0, outstanding - trips * trip_liters)
+            days_since = np.where(trips > 0, 0, days_since + 1)
+
+        del self._days[horizon_days:]
+        return recomputed
+
+    def plan(self, db: Session, horizon_days: int = MIN_HORIZON_DAYS) -> Dict:
+        with self._plan_lock:
+            return self._plan(db, horizon_days)
+
+    def _plan(self, db: Session, horizon_days: int) -> Dict:
+        horizon_days = max(MIN_HORIZON_DAYS, min(MAX_HORIZON_DAYS, horizon_days))
+        today = datetime.utcnow().date()
+        fleet = self._fleet_capacity(db)
+
+        with self._lock:
+            dirty, self._dirty = self._dirty, set()
+            full = self._inputs is None or self._plan_date != today
+        try:
+            if full:
+                self._inputs = self._load_inputs(db)
+                self._days = []
+                reloaded = len(self._inputs["ids"])
+            elif dirty:
+                self._merge_inputs(self._load_inputs(db, list(dirty)), dirty)
+                if self._inputs is None:
+                    self._inputs = self._load_inputs(db)
+                    self._days = []
+                reloaded = len(dirty)
+            else:
+                reloaded = 0
+        except Exception:
+            with self._lock:
+                self._dirty |= dirty
+            raise
+
+        self._plan_date = today
+        self._fleet = fleet
+        recomputed = self._plan_days(horizon_days, *fleet)
+        self.last_stats = {
+            "full_reload": full,
+            "villages_reloaded": reloaded,
+            "days_recomputed": recomputed,
+        }
+        return self._serialize(today)
+
+    def _serialize(self, today) -> Dict:
+        inputs = self._inputs
+        trip_slots, trip_liters = self._fleet
+        days = []
+        for d, day in enumerate(self._days):
+            served = np.flatnonzero(day["trips"])
+            served = served[np.lexsort((inputs["ids"][served], -day["trips"][served]))]
+            days.append({
+                "date": (today + timedelta(days=d)).isoformat(),
+                "trips_planned": int(day["trips"].sum()),
+                "trip_slots": trip_slots,
+                "liters_planned": int(day["trips"].sum() * trip_liters),
+                "demand_liters": int(day["demand"].sum()),
+                "villages": [
+                    {
+                        "village_id": int(inputs["ids"][i]),
+                        "village_name": inputs["names"][i],
+                        "district": inputs["districts"][i],
+                        "trips": int(day["trips"][i]),
+                        "liters": int(day["trips"][i] * trip_liters),
+                        "demand_liters": int(day["demand"][i]),
+                        "predicted_wsi": round(float(day["wsi"][i]), 1),
+                        "predicted_severity": SEVERITY_NAMES[day["severity_idx"][i]],
+                    }
+                    for i in served
+                ],
+            })
+        return {
+            "generated_at": datetime.utcnow().isoformat(),
+            "horizon_days": len(days),
+            "trips_per_tanker_per_day": TRIPS_PER_TANKER_PER_DAY,
+            "trip_liters": round(trip_liters),
+            "days": days,
+            "replan": self.last_stats,
+        }
+
+
+schedule_planner = SchedulePlanner()
@@ -0,0 +1,130 @@
+"""
+Additive Holt-Winters for monthly village series.
+Pure-NumPy kernels (no DB access) so shards can be fitted in worker processes.
+
+Series are fitted for many villages at once and for a whole grid of smoothing
+parameters at once. The recursion runs over time only; villages x parameter
+combinations are array axes. Each village keeps the combination with the
+lowest one-step-ahead squared error. Villages with fewer than two full seasons
+fall back to Holt's linear method (no seasonal terms).
+"""
+import itertools
+import math
+from typing import Dict
+
+import numpy as np
+
+SEASON_LENGTH = 12
+ALPHAS = (0.1, 0.3, 0.5, 0.7, 0.9)
+BETAS = (0.01, 0.05, 0.1, 0.2)
+GAMMAS = (0.05, 0.1, 0.3, 0.5)
+MIN_VILLAGES_PER_SHARD = 64
+
+_GRID = np.array(list(itertools.product(ALPHAS, BETAS, GAMMAS)))  # (G, 3)
+
+
+def _right_align(values: np.ndarray, counts: np.ndarray) -> np.ndarray:
+    """Left-aligned padded rows (oldest first) -> right-aligned, so every series ends at column -1."""
+    n, t = values.shape
+    shift = t - counts
+    src = np.arange(t)[None, :] - shift[:, None]
+    return np.where(src >= 0, np.take_along_axis(values, np.maximum(src, 0), axis=1), 0.0)
+
+
+def fit_holt_winters(values: np.ndarray, counts: np.ndarray, last_months: np.ndarray) -> Dict[str, np.ndarray]:
+    """
+    Fit one additive Holt-Winters model per row.
+    values: (villages, T) left-aligned monthly series, oldest first; counts: points per row;
+    last_months: calendar month (1-12) of each row's newest point.
+    Returns level/trend at the newest point, seasonal terms by calendar month (villages, 12),
+    chosen alpha/beta/gamma, in-sample RMSE and a seasonal flag.
+    """
+    n, t = values.shape
+    m = SEASON_LENGTH
+    g = len(_GRID)
+    y = _right_align(values, counts)
+    start = t - counts
+    seasonal = counts >= 2 * m
+    rows = np.arange(n)
+
+    # Initial state: first two seasons (seasonal) or first point and mean slope (linear)
+    first = start[:, None] + np.arange(m)[None, :]
+    first_season = y[rows[:, None], np.minimum(first, t - 1)]
+    second_season = y[rows[:, None], np.minimum(first + m, t - 1)]
+    linear_slope = np.where(
+        counts > 1, (y[:, -1] - y[rows, np.minimum(start, t - 1)]) / np.maximum(counts - 1, 1), 0.0
+    )
+    level0 = np.where(seasonal, first_season.mean(axis=1), y[rows, np.minimum(start, t - 1)])
+    trend0 = np.where(seasonal, (second_season.mean(axis=1) - first_season.mean(axis=1)) / m, linear_slope)
+    season0 = np.where(seasonal[:, None], first_season - level0[:, None], 0.0)
+
+    alpha, beta, gamma = (_GRID[:, k][None, :] for k in range(3))
+    gamma = np.where(seasonal[:, None], gamma, 0.0)
+    level = np.repeat(level0[:, None], g, axis=1)
+    trend = np.repeat(trend0[:, None], g, axis=1)
+    season = np.repeat(season0[:, None, :], g, axis=1)  # (n, G, m), indexed by position mod m
+    sse = np.zeros((n, g))
+    first_step = start + np.where(seasonal, m, 1)
+
+    for step in range(t):
+        active = (step >= first_step)[:, None]
+        if not active.any():
+            continue
+        pos = (step - start) % m
+        s = season[rows, :, pos]
+        obs = y[:, step][:, None]
+        err = obs - (level + trend + s)
+        new_level = alpha * (obs - s) + (1 - alpha) * (level + trend)
+        new_trend = beta * (new_level - level) + (1 - beta) * trend
+        new_s = gamma * (obs - new_level) + (1 - gamma) * s
+        sse = np.where(active, sse + err ** 2, sse)
+        level = np.where(active, new_level, level)
+        trend = np.where(active, new_trend, trend)
+        season[rows, :, pos] = np.where(active, new_s, s)
+
+    best = np.argmin(sse, axis=1)
+    steps = np.maximum(t - first_step, 1)
+    # Seasonal position p holds the month of series index start + p
+    positions = np.arange(m)[None, :]
+    months = (last_months[:, None] - 1 - (t - 1 - (start[:, None] + positions))) % 12
+    by_month = np.zeros((n, 12))
+    by_month[rows[:, None], months] = season[rows, best]
+    return {
+        "level": level[rows, best],
+        "trend": trend[rows, best],
+        "seasonal": by_month,
+        "alpha": _GRID[best, 0],
+        "beta": _GRID[best, 1],
+        "gamma": np.where(seasonal, _GRID[best, 2], 0.0),
+        "rmse": np.sqrt(sse[rows, best] / steps),
+        "is_seasonal": seasonal,
+    }
+
+
+def forecast(level: float, trend: float, seasonal: np.ndarray, last_month: int, steps_ahead: int) -> float:
+    """Value `steps_ahead` months after the newest observation (month 1-12)."""
+    month = (last_month - 1 + steps_ahead) % 12
+    return float(level + steps_ahead * trend + seasonal[month])
+
+
+def fit_shards(
+    values: np.ndarray,
+    counts: np.ndarray,
+    last_months: np.ndarray,
+    workers: int,
+    pool_factory=None,
+) -> Dict[str, np.ndarray]:
+    """Fit in parallel across a process pool (or inline for small jobs / workers=1)."""
+    n = len(values)
+    shards = max(1, min(workers, math.ceil(n / MIN_VILLAGES_PER_SHARD)))
+    if shards == 1 or pool_factory is None:
+        return fit_holt_winters(values, counts, last_months)
+
+    bounds = np.linspace(0, n, shards + 1).astype(int)
+    pool = pool_factory()
+    futures = [
+        pool.submit(fit_holt_winters, values[lo:hi], counts[lo:hi], last_months[lo:hi])
+        for lo, hi in zip(bounds[:-1], bounds[1:])
+    ]
+    parts = [f.result() for f in futures]
+    return {key: np.concatenate([p[key] for p in parts]) for key in parts[0]}
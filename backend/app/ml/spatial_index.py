@@ -0,0 +1,354 @@
+"""
+In-memory spatial index over villages, available tankers and depots.
+Points live in a uniform lat/lng grid (CELL_DEG cells). Nearest-neighbour
+queries scan rings of cells outwards from the query point and stop once no
+unscanned cell can hold anything closer than the current k-th hit, so a lookup
+touches a handful of cells whatever the fleet size.
+
+The index is built lazily from the database and kept current through the
+change feed: committed Village / Tanker writes mark ids dirty and only those
+rows are re-read on the next query. Bulk updates (allocation claims) are
+reported explicitly via mark_tankers(); the scheduler rebuilds it periodically.
+"""
+import heapq
+import math
+import threading
+from collections import defaultdict
+from typing import Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+from sqlalchemy.orm import Session
+
+from app.models import Village, Tanker
+from app.ml import change_feed
+
+EARTH_RADIUS_KM = 6371
+KM_PER_DEG = math.pi * EARTH_RADIUS_KM / 180
+CELL_DEG = 0.1  # ~11 km cells
+
+Cell = Tuple[int, int]
+
+
+def _haversine_km(lat1: float, lng1: float, lat2: float, lng2: float) -> float:
+    """Unrounded great-circle distance in km."""
+    p1, p2 = math.radians(lat1), math.radians(lat2)
+    a = math.sin((p2 - p1) / 2) ** 2 + math.cos(p1) * math.cos(p2) * math.sin(math.radians(lng2 - lng1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+class GridIndex:
+    """Keyed points in a lat/lng grid with k-nearest and radius queries."""
+
+    def __init__(self, cell_deg: float = CELL_DEG):
+        self.cell_deg = cell_deg
+        self._cells: Dict[Cell, Set[int]] = defaultdict(set)
+        self._points: Dict[int, Tuple[float, float, Cell]] = {}
+        self.payload: Dict[int, Dict] = {}
+        self._bounds: Optional[Tuple[int, int, int, int]] = None
+
+    def __len__(self) -> int:
+        return len(self._points)
+
+    def __contains__(self, key: int) -> bool:
+        return key in self._points
+
+    def _cell(self, lat: float, lng: float) -> Cell:
+        return math.floor(lat / self.cell_deg), math.floor(lng / self.cell_deg)
+
+    def upsert(self, key: int, lat: Optional[float], lng: Optional[float], payload: Optional[Dict] = None):
+        """Insert or move a point; a missing coordinate removes it."""
+        if lat is None or lng is None:
+            self.remove(key)
+            return
+        cell = self._cell(lat, lng)
+        old = self._points.get(key)
+        if old is not None and old[2] != cell:
+            self._discard(key, old[2])
+        self._cells[cell].add(key)
+        self._points[key] = (lat, lng, cell)
+        self.payload[key] = payload or {}
+        if self._bounds is not None:
+            i0, i1, j0, j1 = self._bounds
+            self._bounds = (min(i0, cell[0]), max(i1, cell[0]), min(j0, cell[1]), max(j1, cell[1]))
+        else:
+            self._bounds = (cell[0], cell[0], cell[1], cell[1])
+
+    def remove(self, key: int):
+        old = self._points.pop(key, None)
+        self.payload.pop(key, None)
+        if old is not None:
+            self._discard(key, old[2])
+
+    def _discard(self, key: int, cell: Cell):
+        members = self._cells.get(cell)
+        if members is not None:
+            members.discard(key)
+            if not members:
+                del self._cells[cell]
+
+    def position(self, key: int) -> Optional[Tuple[float, float]]:
+        point = self._points.get(key)
+        return None if point is None else point[:2]
+
+    def _ring(self, center: Cell, r: int) -> Iterable[Cell]:
+        ci, cj = center
+        if r == 0:
+            yield center
+            return
+        for dj in range(-r, r + 1):
+            yield ci - r, cj + dj
+            yield ci + r, cj + dj
+        for di in range(-r + 1, r):
+            yield ci + di, cj - r
+            yield ci + di, cj + r
+
+    def _ring_bound_km(self, lat: float, lng: float, center: Cell, r: int) -> float:
+        """Lower bound on the distance from the query point to any cell outside rings 0..r."""
+        ci, cj = center
+        lat_edges = (lat - (ci - r) * self.cell_deg, (ci + r + 1) * self.cell_deg - lat)
+        lng_edges = (lng - (cj - r) * self.cell_deg, (cj + r + 1) * self.cell_deg - lng)
+        # A degree of longitude is shortest at the block's latitude farthest from the equator
+        far_lat = min(89.9, max(abs((ci - r) * self.cell_deg), abs((ci + r + 1) * self.cell_deg)))
+        return min(
+            min(lat_edges) * KM_PER_DEG,
+            min(lng_edges) * KM_PER_DEG * math.cos(math.radians(far_lat)),
+        )
+
+    def _max_ring(self, center: Cell) -> int:
+        if self._bounds is None:
+            return -1
+        i0, i1, j0, j1 = self._bounds
+        ci, cj = center
+        return max(ci - i0, i1 - ci, cj - j0, j1 - cj, 0)
+
+    def nearest(
+        self,
+        lat: float,
+        lng: float,
+        k: int = 1,
+        max_km: Optional[float] = None,
+        predicate: Optional[Callable[[int], bool]] = None,
+    ) -> List[Tuple[int, float]]:
+        """Up to k (key, distance_km) pairs, closest first, optionally within max_km / matching predicate."""
+        if k <= 0 or not self._points:
+            return []
+        center = self._cell(lat, lng)
+        last_ring = self._max_ring(center)
+        best: List[Tuple[float, int]] = []  # max-heap of (-distance, -key)
+        r = 0
+        while r <= last_ring:
+            for cell in self._ring(center, r):
+                for key in self._cells.get(cell, ()):
+                    if predicate is not None and not predicate(key):
+                        continue
+                    plat, plng, _ = self._points[key]
+                    dist = _haversine_km(lat, lng, plat, plng)
+                    if max_km is not None and dist > max_km:
+                        continue
+                    item = (-dist, -key)
+                    if len(best) < k:
+                        heapq.heappush(best, item)
+                    elif item > best[0]:
+                        heapq.heapreplace(best, item)
+            bound = self._ring_bound_km(lat, lng, center, r)
+            if len(best) == k and -best[0][0] <= bound:
+                break
+            if max_km is not None and bound > max_km:
+                break
+            r += 1
+        return [(-key, -neg) for neg, key in sorted(best, reverse=True)]
+
+    def within(
+        self,
+        lat: float,
+        lng: float,
+        radius_km: float,
+        predicate: Optional[Callable[[int], bool]] = None,
+    ) -> List[Tuple[int, float]]:
+        """Every (key, distance_km) within radius_km, closest first."""
+        if not self._points:
+            return []
+        center = self._cell(lat, lng)
+        last_ring = self._max_ring(center)
+        hits = []
+        r = 0
+        while r <= last_ring:
+            for cell in self._ring(center, r):
+                for key in self._cells.get(cell, ()):
+                    if predicate is not None and not predicate(key):
+                        continue
+                    plat, plng, _ = self._points[key]
+                    dist = _haversine_km(lat, lng, plat, plng)
+                    if dist <= radius_km:
+                        hits.append((key, dist))
+            if self._ring_bound_km(lat, lng, center, r) > radius_km:
+                break
+            r += 1
+        hits.sort(key=lambda h: (h[1], h[0]))
+        return hits
+
+
+class SpatialIndex:
+    """Villages, available tankers and depots, kept in sync with the database."""
+
+    def __init__(self, cell_deg: float = CELL_DEG):
+        self.cell_deg = cell_deg
+        self.villages = GridIndex(cell_deg)
+        self.tankers = GridIndex(cell_deg)  # available tankers only, at current position (else depot)
+        self.depots = GridIndex(cell_deg)
+        self._depot_ids: Dict[Tuple[float, float], int] = {}
+        self._built = False
+        self._dirty_villages: Set[int] = set()
+        self._dirty_tankers: Set[int] = set()
+        self._lock = threading.Lock()
+        change_feed.subscribe(self._on_change)
+
+    def _on_change(self, changes: Dict[str, Set[int]]):
+        with self._lock:
+            self._dirty_villages.update(changes.get("village", ()))
+            self._dirty_tankers.update(changes.get("tanker", ()))
+
+    def mark_tankers(self, tanker_ids: Iterable[int]):
+        """Re-read these tankers on the next query (for writes that bypass the ORM)."""
+        with self._lock:
+            self._dirty_tankers.update(tanker_ids)
+
+    # ─── Loading ───
+
+    @staticmethod
+    def _put_village(villages: GridIndex, village: Village):
+        villages.upsert(
+            village.id, village.latitude, village.longitude,
+            {"id": village.id, "name": village.name, "district": village.district},
+        )
+
+    @staticmethod
+    def _put_tanker(tankers: GridIndex, tanker: Tanker):
+        if tanker.status != "available":
+            tankers.remove(tanker.id)
+            return
+        lat = tanker.current_latitude if tanker.current_latitude is not None else tanker.depot_latitude
+        lng = tanker.current_longitude if tanker.current_longitude is not None else tanker.depot_longitude
+        tankers.upsert(tanker.id, lat, lng, {
+            "id": tanker.id,
+            "registration": tanker.registration_number,
+            "capacity": tanker.capacity_liters,
+            "driver": tanker.driver_name,
+            "driver_phone": tanker.driver_phone,
+            "district": tanker.district,
+            "depot_lat": tanker.depot_latitude,
+            "depot_lng": tanker.depot_longitude,
+        })
+
+    @staticmethod
+    def _put_depot(depots: GridIndex, depot_ids: Dict[Tuple[float, float], int], tanker: Tanker):
+        """Depots are the distinct tanker depot locations."""
+        if tanker.depot_latitude is None or tanker.depot_longitude is None:
+            return
+        location = (tanker.depot_latitude, tanker.depot_longitude)
+        depot_id = depot_ids.get(location)
+        if depot_id is None:
+            depot_id = depot_ids[location] = len(depot_ids) + 1
+            depots.upsert(depot_id, *location, {"id": depot_id, "district": tanker.district, "tanker_ids": []})
+        tanker_ids = depots.payload[depot_id]["tanker_ids"]
+        if tanker.id not in tanker_ids:
+            tanker_ids.append(tanker.id)
+
+    def rebuild(self, db: Session) -> int:
+        """Reload every village and tanker (scheduled drift guard). Returns the points indexed."""
+        with self._lock:
+            # Changes committed while loading stay dirty and are applied on the next read
+            self._dirty_villages.clear()
+            self._dirty_tankers.clear()
+        villages, tankers, depots = (GridIndex(self.cell_deg) for _ in range(3))
+        depot_ids: Dict[Tuple[float, float], int] = {}
+        for village in db.query(Village).all():
+            self._put_village(villages, village)
+        for tanker in db.query(Tanker).order_by(Tanker.id).all():
+            self._put_tanker(tankers, tanker)
+            self._put_depot(depots, depot_ids, tanker)
+        with self._lock:
+            self.villages, self.tankers, self.depots = villages, tankers, depots
+            self._depot_ids = depot_ids
+            self._built = True
+            return len(villages) + len(tankers) + len(depots)
+
+    def _refresh(self, db: Session):
+        if not self._built:
+            self.rebuild(db)
+            return
+        with self._lock:
+            village_ids, self._dirty_villages = self._dirty_villages, set()
+            tanker_ids, self._dirty_tankers = self._dirty_tankers, set()
+        if not village_ids and not tanker_ids:
+            return
+        try:
+            found_villages = db.query(Village).filter(Village.id.in_(village_ids)).all() if village_ids else []
+            found_tankers = db.query(Tanker).filter(Tanker.id.in_(tanker_ids)).all() if tanker_ids else []
+        except Exception:
+            with self._lock:
+                self._dirty_villages |= village_ids
+                self._dirty_tankers |= tanker_ids
+            raise
+        with self._lock:
+            for village in found_villages:
+                self._put_village(self.villages, village)
+            for village_id in village_ids - {v.id for v in found_villages}:
+                self.villages.remove(village_id)
+            for tanker in found_tankers:
+                self._put_tanker(self.tankers, tanker)
+                self._put_depot(self.depots, self._depot_ids, tanker)
+            for tanker_id in tanker_ids - {t.id for t in found_tankers}:
+                self.tankers.remove(tanker_id)
+
+    # ─── Queries ───
+
+    @staticmethod
+    def _district_filter(grid: GridIndex, district: Optional[str]) -> Optional[Callable[[int], bool]]:
+        if not district:
+            return None
+        return lambda key: grid.payload[key].get("district") == district
+
+    def nearest_tankers(
+        self,
+        db: Session,
+        lat: float,
+        lng: float,
+        k: int = 1,
+        max_km: Optional[float] = None,
+        district: Optional[str] = None,
+    ) -> List[Dict]:
+        """Closest available tankers to a point."""
+        self._refresh(db)
+        with self._lock:
+            hits = self.tankers.nearest(lat, lng, k, max_km, self._district_filter(self.tankers, district))
+            return [self._hit(self.tankers, key, dist) for key, dist in hits]
+
+    def villages_within(
+        self, db: Session, lat: float, lng: float, radius_km: float, district: Optional[str] = None
+    ) -> List[Dict]:
+        """Villages within radius_km of a point, closest first."""
+        self._refresh(db)
+        with self._lock:
+            hits = self.villages.within(lat, lng, radius_km, self._district_filter(self.villages, district))
+            return [self._hit(self.villages, key, dist) for key, dist in hits]
+
+    def nearest_depot(
+        self, db: Session, lat: float, lng: float, district: Optional[str] = None
+    ) -> Optional[Dict]:
+        self._refresh(db)
+        with self._lock:
+            hits = self.depots.nearest(lat, lng, 1, predicate=self._district_filter(self.depots, district))
+            return self._hit(self.depots, *hits[0]) if hits else None
+
+    def village_position(self, db: Session, village_id: int) -> Optional[Tuple[float, float]]:
+        self._refresh(db)
+        with self._lock:
+            return self.villages.position(village_id)
+
+    @staticmethod
+    def _hit(grid: GridIndex, key: int, dist: float) -> Dict:
+        lat, lng = grid.position(key)
+        return {**grid.payload[key], "lat": lat, "lng": lng, "distance_km": round(dist, 3)}
+
+
+spatial_index = SpatialIndex()
@@ -0,0 +1,140 @@
+"""
+Time windows for tanker routing (VRPTW).
+A ServiceCalendar lists the minutes, counted from the plan start, in which
+tankers may be on the road: depot operating hours on every day that the
+weather forecast does not block. Villages get delivery deadlines from the
+urgency of their open water requests; travel times are calibrated from the
+recorded durations of past trips.
+"""
+from datetime import date, datetime, time as dtime, timedelta
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from app.config import DEPOT_OPEN_HOUR, DEPOT_CLOSE_HOUR, DEPOT_UTC_OFFSET_MIN
+from app.models import Trip, WaterRequest
+
+# Hours from a request being raised to its delivery deadline
+URGENCY_DEADLINE_HOURS = {"critical": 12, "high": 24, "medium": 72, "low": 168}
+# Solver cost per minute late, in route metres (critical lateness outweighs long detours)
+URGENCY_LATE_PENALTY = {"critical": 5000, "high": 1000, "medium": 200, "low": 50}
+SERVICE_MIN_PER_STOP = 30  # unloading at the village tank
+PLAN_HORIZON_DAYS = 3
+MIN_PER_KM_BOUNDS = (1.0, 6.0)
+
+
+class ServiceCalendar:
+    """
+    Open road windows in minutes from `start` (UTC): depot hours minus blocked days.
+    Hours and blocked dates are local to the depot (utc_offset_min ahead of UTC).
+    """
+
+    def __init__(
+        self,
+        start: datetime,
+        days: int = PLAN_HORIZON_DAYS,
+        open_hour: int = DEPOT_OPEN_HOUR,
+        close_hour: int = DEPOT_CLOSE_HOUR,
+        blocked_dates: Iterable[date] = (),
+        utc_offset_min: int = DEPOT_UTC_OFFSET_MIN,
+    ):
+        self.start = start
+        self.utc_offset = timedelta(minutes=utc_offset_min)
+        self.days = days
+        self.open_hour = open_hour
+        self.close_hour = close_hour
+        self.blocked_dates = sorted(set(blocked_dates))
+        self.horizon = days * 24 * 60
+        self.windows: List[Tuple[int, int]] = []
+        for k in range(days + 1):
+            day = (start + self.utc_offset).date() + timedelta(days=k)
+            if day in self.blocked_dates:
+                continue
+            opens = max(0, self.minutes(datetime.combine(day, dtime(open_hour)) - self.utc_offset))
+            closes = min(self.horizon, self.minutes(datetime.combine(day, dtime(close_hour)) - self.utc_offset))
+            if closes > opens:
+                self.windows.append((opens, closes))
+
+    @property
+    def shift_minutes(self) -> int:
+        """Longest a single route may take (one operating day)."""
+        return (self.close_hour - self.open_hour) * 60
+
+    def minutes(self, moment: datetime) -> int:
+        return int((moment - self.start).total_seconds() // 60)
+
+    def at(self, minute: int) -> datetime:
+        return self.start + timedelta(minutes=minute)
+
+    def next_open(self, minute: int) -> Optional[int]:
+        """Earliest open minute at or after `minute` (None past the last window)."""
+        for opens, closes in self.windows:
+            if minute < closes:
+                return max(minute, opens)
+        return None
+
+    def window_close(self, minute: int) -> Optional[int]:
+        """Closing minute of the open window containing `minute` (None in closed time)."""
+        for opens, closes in self.windows:
+            if opens <= minute <= closes:
+                return closes
+        return None
+
+    def closed_intervals(self) -> List[Tuple[int, int]]:
+        """Inclusive [from, to] minute ranges in the horizon when no tanker may be on the road."""
+        closed, cursor = [], 0
+        for opens, closes in self.windows:
+            if opens > cursor:
+                closed.append((cursor, opens - 1))
+            cursor = closes + 1
+        if cursor <= self.horizon:
+            closed.append((cursor, self.horizon))
+        return closed
+
+    def describe(self) -> Dict:
+        return {
+            "start_at": self.start.isoformat(),
+            "days": self.days,
+            "open_hour": self.open_hour,
+            "close_hour": self.close_hour,
+            "blocked_dates": [d.isoformat() for d in self.blocked_dates],
+            "open_windows": [[self.at(a).isoformat(), self.at(b).isoformat()] for a, b in self.windows],
+        }
+
+
+def blocked_dates(forecast: Dict) -> List[date]:
+    """Forecast days that are not tanker-safe (from a WeatherAPI district forecast)."""
+    safe = set(forecast.get("tanker_safe_days", []))
+    return [
+        date.fromisoformat(day["date"])
+        for day in forecast.get("forecast_days", [])
+        if day["date"] not in safe
+    ]
+
+
+def minutes_per_km(db: Session, default: float) -> float:
+    """Average driving minutes per km over trips with a recorded route duration."""
+    distance, duration = db.query(
+        func.sum(Trip.route_distance_km), func.sum(Trip.route_duration_min)
+    ).filter(Trip.route_distance_km > 0, Trip.route_duration_min > 0).one()
+    if not distance or not duration:
+        return default
+    low, high = MIN_PER_KM_BOUNDS
+    return round(min(max(duration / distance, low), high), 3)
+
+
+def village_deadlines(db: Session, village_ids: List[int]) -> Dict[int, Dict]:
+    """Most pressing open request per village: {village_id: {"urgency", "deadline"}}."""
+    rows = db.query(WaterRequest.village_id, WaterRequest.urgency, WaterRequest.created_at).filter(
+        WaterRequest.village_id.in_(village_ids),
+        WaterRequest.status.in_(["pending", "approved"]),
+    ).all()
+    deadlines: Dict[int, Dict] = {}
+    for village_id, urgency, created_at in rows:
+        urgency = urgency if urgency in URGENCY_DEADLINE_HOURS else "medium"
+        deadline = (created_at or datetime.utcnow()) + timedelta(hours=URGENCY_DEADLINE_HOURS[urgency])
+        current = deadlines.get(village_id)
+        if current is None or deadline < current["deadline"]:
+            deadlines[village_id] = {"urgency": urgency, "deadline": deadline}
+    return deadlines
@@ -0,0 +1,278 @@
+"""
+Incrementally maintained WSI component aggregates.
+Keeps one row per village with rolling rainfall sums, the last 12 groundwater
+readings and the trailing trip count, so WSI reads never rescan history.
+
+Inserts of RainfallData / GroundwaterData / Trip update the row in the same
+flush; deletes and edits of those rows (including a moved village_id) make the
+flush recompute the affected villages from raw history once the statements have
+run. expire_aggregates() (scheduled hourly) subtracts data that has fallen out
+of the trailing windows. Bulk query().delete() / update() bypass the flush, so
+callers doing bulk work (data imports) run rebuild_aggregates() afterwards, and
+a daily rebuild repairs anything else. Rows are only ever created by a rebuild
+from raw history, so a village without one is simply read the slow way until
+backfilled.
+"""
+from typing import Dict, List, Optional, Set
+from datetime import datetime, timedelta
+from sqlalchemy import event, func, inspect
+from sqlalchemy.orm import Session
+from app.models import Village, RainfallData, GroundwaterData, Trip, WSIComponentAggregate
+
+RAINFALL_WINDOW_DAYS = 6 * 30
+GROUNDWATER_READINGS = 12
+TRIP_WINDOW_DAYS = 90
+STALE_KEY = "stale_wsi_aggregates"
+
+# Columns whose edits change an aggregate
+AGGREGATED_COLUMNS = {
+    RainfallData: ("village_id", "date", "rainfall_mm", "normal_rainfall_mm"),
+    GroundwaterData: ("village_id", "date", "level_meters"),
+    Trip: ("village_id", "created_at"),
+}
+
+
+def _reset_aggregate(agg: WSIComponentAggregate, now: datetime) -> WSIComponentAggregate:
+    agg.rainfall_window_start = now - timedelta(days=RAINFALL_WINDOW_DAYS)
+    agg.rainfall_actual_sum = 0.0
+    agg.rainfall_normal_sum = 0.0
+    agg.rainfall_count = 0
+    _set_groundwater_window(agg, [])
+    agg.trip_window_start = now - timedelta(days=TRIP_WINDOW_DAYS)
+    agg.trip_count = 0
+    agg.updated_at = now
+    return agg
+
+
+def _add_rainfall(agg: WSIComponentAggregate, record: RainfallData):
+    if record.date < agg.rainfall_window_start:
+        return
+    agg.rainfall_actual_sum = (agg.rainfall_actual_sum or 0) + record.rainfall_mm
+    agg.rainfall_normal_sum = (agg.rainfall_normal_sum or 0) + (record.normal_rainfall_mm or 0)
+    agg.rainfall_count = (agg.rainfall_count or 0) + 1
+
+
+def _add_groundwater(agg: WSIComponentAggregate, record: GroundwaterData):
+    window = list(agg.groundwater_window or [])
+    window.append([record.date.isoformat(), record.level_meters])
+    window.sort(key=lambda r: r[0], reverse=True)
+    _set_groundwater_window(agg, window[:GROUNDWATER_READINGS])
+
+
+def _set_groundwater_window(agg: WSIComponentAggregate, window: List[List]):
+    # Reassign (not mutate) so the JSON column is flagged dirty
+    agg.groundwater_window = window
+    agg.groundwater_newest = window[0][1] if window else None
+    agg.groundwater_oldest = window[-1][1] if window else None
+
+
+def _add_trip(agg: WSIComponentAggregate, trip: Trip, now: datetime):
+    created_at = trip.created_at or now  # column default is applied at INSERT
+    if created_at >= agg.trip_window_start:
+        agg.trip_count = (agg.trip_count or 0) + 1
+
+
+def _mark_stale(session: Session):
+    """Villages whose aggregates deleted / edited rows invalidate (old and new village_id)."""
+    stale: Set[int] = session.info.setdefault(STALE_KEY, set())
+    for obj in session.deleted:
+        if type(obj) in AGGREGATED_COLUMNS and obj.village_id is not None:
+            stale.add(obj.village_id)
+    for obj in session.dirty:
+        columns = AGGREGATED_COLUMNS.get(type(obj))
+        if columns is None:
+            continue
+        attrs = inspect(obj).attrs
+        if any(attrs[column].history.has_changes() for column in columns):
+            stale.update(v for v in (obj.village_id, *attrs.village_id.history.deleted) if v is not None)
+
+
+@event.listens_for(Session, "before_flush")
+def _apply_inserts(session: Session, flush_context, instances):
+    """Fold newly added time-series rows into their village aggregate."""
+    _mark_stale(session)
+    new_rows = [
+        obj for obj in session.new
+        if isinstance(obj, (RainfallData, GroundwaterData, Trip)) and obj.village_id is not None
+    ]
+    if not new_rows:
+        return
+
+    now = datetime.utcnow()
+    aggregates: Dict[int, Optional[WSIComponentAggregate]] = {}
+    with session.no_autoflush:
+        for obj in new_rows:
+            if obj.village_id not in aggregates:
+                aggregates[obj.village_id] = session.get(WSIComponentAggregate, obj.village_id)
+            agg = aggregates[obj.village_id]
+            if agg is None:
+                continue  # not backfilled yet; ensure_aggregates() will pick this row up
+
+            if isinstance(obj, RainfallData):
+                _add_rainfall(agg, obj)
+            elif isinstance(obj, GroundwaterData):
+                _add_groundwater(agg, obj)
+            else:
+                _add_trip(agg, obj, now)
+            agg.updated_at = now
+
+
+@event.listens_for(Session, "after_flush_postexec")
+def _recompute_stale(session: Session, flush_context):
+    """Recompute villages marked by _mark_stale now that the deletes / edits are in the database."""
+    stale = session.info.pop(STALE_KEY, None)
+    if stale:
+        with session.no_autoflush:
+            # The touched aggregates are flushed by the next flush (commit flushes until clean)
+            _recompute(session, sorted(stale), missing_ok=False)
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_stale(session: Session):
+    session.info.pop(STALE_KEY, None)
+
+
+def expire_aggregates(db: Session, now: Optional[datetime] = None) -> int:
+    """Subtract rainfall and trips that have slid out of the trailing windows."""
+    ensure_aggregates(db)
+    now = now or datetime.utcnow()
+    rainfall_start = now - timedelta(days=RAINFALL_WINDOW_DAYS)
+    trip_start = now - timedelta(days=TRIP_WINDOW_DAYS)
+
+    expired_rainfall = {
+        row[0]: row[1:] for row in db.query(
+            RainfallData.village_id,
+            func.sum(RainfallData.rainfall_mm),
+            func.sum(RainfallData.normal_rainfall_mm),
+            func.count(RainfallData.id),
+        ).join(
+            WSIComponentAggregate, WSIComponentAggregate.village_id == RainfallData.village_id
+        ).filter(
+            RainfallData.date >= WSIComponentAggregate.rainfall_window_start,
+            RainfallData.date < rainfall_start,
+        ).group_by(RainfallData.village_id).all()
+    }
+    expired_trips = dict(
+        db.query(Trip.village_id, func.count(Trip.id)).join(
+            WSIComponentAggregate, WSIComponentAggregate.village_id == Trip.village_id
+        ).filter(
+            Trip.created_at >= WSIComponentAggregate.trip_window_start,
+            Trip.created_at < trip_start,
+        ).group_by(Trip.village_id).all()
+    )
+
+    for agg in db.query(WSIComponentAggregate).filter(
+        (WSIComponentAggregate.rainfall_window_start < rainfall_start) |
+        (WSIComponentAggregate.trip_window_start < trip_start)
+    ).all():
+        if agg.village_id in expired_rainfall:
+            actual, normal, count = expired_rainfall[agg.village_id]
+            agg.rainfall_count -= count
+            if agg.rainfall_count <= 0:
+                # Reset instead of subtracting so float drift can't leave a phantom baseline
+                agg.rainfall_count = 0
+                agg.rainfall_actual_sum = 0.0
+                agg.rainfall_normal_sum = 0.0
+            else:
+                agg.rainfall_actual_sum -= actual or 0
+                agg.rainfall_normal_sum -= normal or 0
+        agg.trip_count = max(0, agg.trip_count - expired_trips.get(agg.village_id, 0))
+        agg.rainfall_window_start = max(agg.rainfall_window_start, rainfall_start)
+        agg.trip_window_start = max(agg.trip_window_start, trip_start)
+        agg.updated_at = now
+
+    db.commit()
+    return len(expired_rainfall) + len(expired_trips)
+
+
+def rebuild_aggregates(db: Session, village_ids: Optional[List[int]] = None) -> int:
+    """Recompute aggregates from raw history (backfill / repair)."""
+    count = _recompute(db, village_ids)
+    db.commit()
+    return count
+
+
+def _recompute(db: Session, village_ids: Optional[List[int]] = None, missing_ok: bool = True) -> int:
+    """
+    Reset and refill aggregates from raw history without committing.
+    missing_ok=False only refreshes villages that already have a row.
+    """
+    now = datetime.utcnow()
+    village_query = db.query(Village.id)
+    if village_ids is not None:
+        village_query = village_query.filter(Village.id.in_(village_ids))
+    ids = [row[0] for row in village_query.all()]
+    if not ids:
+        return 0
+
+    existing_query = db.query(WSIComponentAggregate)
+    if village_ids is not None:
+        existing_query = existing_query.filter(WSIComponentAggregate.village_id.in_(ids))
+    existing = {agg.village_id: agg for agg in existing_query.all()}
+    if not missing_ok:
+        ids = [vid for vid in ids if vid in existing]
+        if not ids:
+            return 0
+    aggregates = {}
+    for vid in ids:
+        agg = existing.get(vid)
+        if agg is None:
+            agg = WSIComponentAggregate(village_id=vid)
+            db.add(agg)
+        aggregates[vid] = _reset_aggregate(agg, now)
+    rainfall_start = now - timedelta(days=RAINFALL_WINDOW_DAYS)
+    trip_start = now - timedelta(days=TRIP_WINDOW_DAYS)
+
+    rainfall_query = db.query(
+        RainfallData.village_id,
+        func.sum(RainfallData.rainfall_mm),
+        func.sum(RainfallData.normal_rainfall_mm),
+        func.count(RainfallData.id),
+    ).filter(RainfallData.date >= rainfall_start)
+    trip_query = db.query(Trip.village_id, func.count(Trip.id)).filter(Trip.created_at >= trip_start)
+    groundwater_query = db.query(
+        GroundwaterData.village_id.label("village_id"),
+        GroundwaterData.date.label("date"),
+        GroundwaterData.level_meters.label("level"),
+        func.row_number().over(
+            partition_by=GroundwaterData.village_id,
+            order_by=GroundwaterData.date.desc(),
+        ).label("rn"),
+    )
+    if village_ids is not None:
+        rainfall_query = rainfall_query.filter(RainfallData.village_id.in_(ids))
+        trip_query = trip_query.filter(Trip.village_id.in_(ids))
+        groundwater_query = groundwater_query.filter(GroundwaterData.village_id.in_(ids))
+
+    for village_id, actual, normal, count in rainfall_query.group_by(RainfallData.village_id).all():
+        if village_id in aggregates:
+            agg = aggregates[village_id]
+            agg.rainfall_actual_sum, agg.rainfall_normal_sum, agg.rainfall_count = actual or 0, normal or 0, count
+
+    ranked = groundwater_query.subquery()
+    windows: Dict[int, List[List]] = {}
+    for village_id, date, level in db.query(
+        ranked.c.village_id, ranked.c.date, ranked.c.level
+    ).filter(ranked.c.rn <= GROUNDWATER_READINGS).order_by(ranked.c.village_id, ranked.c.rn).all():
+        windows.setdefault(village_id, []).append([date.isoformat(), level])
+    for village_id, window in windows.items():
+        if village_id in aggregates:
+            _set_groundwater_window(aggregates[village_id], window)
+
+    for village_id, count in trip_query.group_by(Trip.village_id).all():
+        if village_id in aggregates:
+            aggregates[village_id].trip_count = count
+
+    return len(aggregates)
+
+
+def ensure_aggregates(db: Session) -> int:
+    """Backfill aggregates for villages that don't have one yet (e.g. pre-existing databases)."""
+    missing = [
+        row[0] for row in db.query(Village.id).outerjoin(
+            WSIComponentAggregate, WSIComponentAggregate.village_id == Village.id
+        ).filter(WSIComponentAggregate.village_id.is_(None)).all()
+    ]
+    if not missing:
+        return 0
+    return rebuild_aggregates(db, missing)
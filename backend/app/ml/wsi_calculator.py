@@ -4,11 +4,22 @@ Multi-factor WSI using rainfall deviation, groundwater decline,
 population density, and historical demand.
 """
 import math
+import numpy as np
 from typing import Dict, List, Optional
 from datetime import datetime, timedelta
 from sqlalchemy.orm import Session
-from sqlalchemy import func
-from app.models import Village, RainfallData, GroundwaterData, WaterStressRecord, Trip
+from sqlalchemy import func, case
+from app.models import Village, RainfallData, GroundwaterData, WaterStressRecord, Trip, WSIComponentAggregate
+from app.ml.wsi_aggregates import RAINFALL_WINDOW_DAYS, GROUNDWATER_READINGS, TRIP_WINDOW_DAYS
+
+
+# Python's round() (correctly rounded decimal) rather than np.round (scale-and-rint),
+# so batch scores are bit-identical to the per-village path.
+_round1 = np.frompyfunc(lambda x: round(x, 1), 1, 1)
+
+
+def round1(values: np.ndarray) -> np.ndarray:
+    return _round1(values).astype(float)
 
 
 class WaterStressCalculator:
@@ -28,6 +39,18 @@ class WaterStressCalculator:
         "critical": (60, 80),
         "emergency": (80, 100),
     }
+    SEVERITY_LEVELS = tuple(SEVERITY_THRESHOLDS)
+    SEVERITY_EDGES = np.array([lo for lo, _ in list(SEVERITY_THRESHOLDS.values())[1:]])
+
+    @classmethod
+    def severity_index(cls, wsi_scores) -> np.ndarray:
+        """Vectorized severity level (0 = normal ... 4 = emergency), same bands as get_severity."""
+        return np.searchsorted(cls.SEVERITY_EDGES, wsi_scores, side="right")
+
+    @classmethod
+    def severity_labels(cls, wsi_scores) -> np.ndarray:
+        """Vectorized get_severity."""
+        return np.array(cls.SEVERITY_LEVELS)[cls.severity_index(wsi_scores)]
 
     @staticmethod
     def get_severity(wsi_score: float) -> str:
@@ -110,12 +133,33 @@ class WaterStressCalculator:
         score = min(100, (trip_count / 10) * 100)
         return round(score, 1)
 
+    def _aggregate_scores(self, agg: WSIComponentAggregate):
+        """Rainfall, groundwater and demand scores from a village's maintained aggregate row."""
+        if not agg.rainfall_count or not agg.rainfall_normal_sum:
+            rainfall_score = 50.0
+        else:
+            deviation_pct = ((agg.rainfall_normal_sum - agg.rainfall_actual_sum) / agg.rainfall_normal_sum) * 100
+            rainfall_score = round(min(100, max(0, deviation_pct * (100 / 60))), 1)
+
+        if len(agg.groundwater_window or []) < 2:
+            groundwater_score = 50.0
+        else:
+            decline = agg.groundwater_newest - agg.groundwater_oldest
+            groundwater_score = round(min(100, max(0, (decline / 10) * 100)), 1)
+
+        demand_score = round(min(100, ((agg.trip_count or 0) / 10) * 100), 1)
+        return rainfall_score, groundwater_score, demand_score
+
     def calculate_wsi(self, db: Session, village: Village) -> Dict:
         """Calculate comprehensive Water Stress Index for a village."""
-        rainfall_score = self.calculate_rainfall_component(db, village.id)
-        groundwater_score = self.calculate_groundwater_component(db, village.id)
+        agg = db.get(WSIComponentAggregate, village.id)
+        if agg is not None:
+            rainfall_score, groundwater_score, demand_score = self._aggregate_scores(agg)
+        else:
+            rainfall_score = self.calculate_rainfall_component(db, village.id)
+            groundwater_score = self.calculate_groundwater_component(db, village.id)
+            demand_score = self.calculate_demand_component(db, village.id)
         population_score = self.calculate_population_component(village)
-        demand_score = self.calculate_demand_component(db, village.id)
 
         wsi = (
             rainfall_score * self.WEIGHTS["rainfall"] +
@@ -140,12 +184,150 @@ class WaterStressCalculator:
             },
         }
 
-    def simulate_wsi(self, db: Session, village: Village, rainfall_change_pct: float) -> Dict:
+    def calculate_wsi_batch(self, db: Session, village_ids: Optional[List[int]] = None) -> Dict[int, Dict]:
+        """
+        Calculate WSI for many villages at once, keyed by village id.
+        Reads the maintained component aggregates (one row per village); villages
+        without one fall back to a grouped query per component. Scores are
+        identical to calculate_wsi().
+        """
+        village_query = db.query(Village.id, Village.name, Village.population)
+        if village_ids is not None:
+            village_query = village_query.filter(Village.id.in_(village_ids))
+        villages = village_query.order_by(Village.id).all()
+        if not villages:
+            return {}
+
+        index = {v.id: i for i, v in enumerate(villages)}
+        n = len(villages)
+        raw = {key: np.zeros(n) for key in (
+            "rain_actual", "rain_normal", "rain_count", "gw_recent", "gw_oldest", "gw_count", "trips",
+        )}
+
+        agg_query = db.query(WSIComponentAggregate)
+        if village_ids is not None:
+            agg_query = agg_query.filter(WSIComponentAggregate.village_id.in_(village_ids))
+        covered = np.zeros(n, dtype=bool)
+        for agg in agg_query.all():
+            i = index.get(agg.village_id)
+            if i is None:
+                continue
+            covered[i] = True
+            raw["rain_actual"][i] = agg.rainfall_actual_sum or 0
+            raw["rain_normal"][i] = agg.rainfall_normal_sum or 0
+            raw["rain_count"][i] = agg.rainfall_count or 0
+            raw["gw_count"][i] = len(agg.groundwater_window or [])
+            if raw["gw_count"][i]:
+                raw["gw_recent"][i] = agg.groundwater_newest
+                raw["gw_oldest"][i] = agg.groundwater_oldest
+            raw["trips"][i] = agg.trip_count or 0
+
+        if not covered.all():
+            missing = [v.id for v in villages if not covered[index[v.id]]]
+            self._scan_components(db, missing, index, raw)
+
+        rainfall, groundwater, demand = self._component_scores(raw)
+        population = self._population_scores(np.array([v.population for v in villages], dtype=float))
+        wsi = self._weighted_wsi(rainfall, groundwater, population, demand)
+
+        results = {}
+        for i, v in enumerate(villages):
+            severity = self.get_severity(wsi[i])
+            results[v.id] = {
+                "village_id": v.id,
+                "village_name": v.name,
+                "wsi_score": float(wsi[i]),
+                "severity": severity,
+                "severity_color": self.get_severity_color(severity),
+                "components": {
+                    "rainfall": {"score": float(rainfall[i]), "weight": self.WEIGHTS["rainfall"]},
+                    "groundwater": {"score": float(groundwater[i]), "weight": self.WEIGHTS["groundwater"]},
+                    "population": {"score": float(population[i]), "weight": self.WEIGHTS["population"]},
+                    "demand": {"score": float(demand[i]), "weight": self.WEIGHTS["demand"]},
+                },
+            }
+        return results
+
+    @staticmethod
+    def _component_scores(raw: Dict[str, np.ndarray]):
+        """Vectorized rainfall / groundwater / demand scores from raw window totals."""
+        # No records or no normal baseline = moderate stress
+        known = (raw["rain_count"] > 0) & (raw["rain_normal"] != 0)
+        normal = np.where(known, raw["rain_normal"], 1.0)
+        deviation_pct = ((normal - raw["rain_actual"]) / normal) * 100
+        rainfall = np.where(known, round1(np.clip(deviation_pct * (100 / 60), 0, 100)), 50.0)
+
+        # Positive change = water level dropped (deeper)
+        decline = raw["gw_recent"] - raw["gw_oldest"]
+        groundwater = np.where(raw["gw_count"] >= 2, round1(np.clip((decline / 10) * 100, 0, 100)), 50.0)
+
+        demand = round1(np.minimum(100, (raw["trips"] / 10) * 100))
+        return rainfall, groundwater, demand
+
+    @staticmethod
+    def _population_scores(population: np.ndarray) -> np.ndarray:
+        return round1(np.minimum(100, (population / 50000) * 100))
+
+    def _weighted_wsi(self, rainfall, groundwater, population, demand) -> np.ndarray:
+        wsi = (
+            rainfall * self.WEIGHTS["rainfall"] +
+            groundwater * self.WEIGHTS["groundwater"] +
+            population * self.WEIGHTS["population"] +
+            demand * self.WEIGHTS["demand"]
+        )
+        return round1(np.clip(wsi, 0, 100))
+
+    def _scan_components(self, db: Session, village_ids: List[int], index: Dict[int, int], raw: Dict[str, np.ndarray]):
+        """Fill raw window totals from history with one grouped query per component."""
+        rainfall_cutoff = datetime.utcnow() - timedelta(days=RAINFALL_WINDOW_DAYS)
+        for village_id, total_actual, total_normal, count in db.query(
+            RainfallData.village_id,
+            func.sum(RainfallData.rainfall_mm),
+            func.sum(RainfallData.normal_rainfall_mm),
+            func.count(RainfallData.id),
+        ).filter(
+            RainfallData.village_id.in_(village_ids),
+            RainfallData.date >= rainfall_cutoff
+        ).group_by(RainfallData.village_id).all():
+            i = index[village_id]
+            raw["rain_actual"][i] = total_actual or 0
+            raw["rain_normal"][i] = total_normal or 0
+            raw["rain_count"][i] = count
+
+        ranked = db.query(
+            GroundwaterData.village_id.label("village_id"),
+            GroundwaterData.level_meters.label("level"),
+            func.row_number().over(
+                partition_by=GroundwaterData.village_id,
+                order_by=GroundwaterData.date.desc(),
+            ).label("rn"),
+            func.count().over(partition_by=GroundwaterData.village_id).label("cnt"),
+        ).filter(GroundwaterData.village_id.in_(village_ids)).subquery()
+        window_len = case((ranked.c.cnt < GROUNDWATER_READINGS, ranked.c.cnt), else_=GROUNDWATER_READINGS)
+        for village_id, newest_level, oldest_level, window in db.query(
+            ranked.c.village_id,
+            func.max(case((ranked.c.rn == 1, ranked.c.level))),
+            func.max(case((ranked.c.rn == window_len, ranked.c.level))),
+            func.max(window_len),
+        ).filter(ranked.c.rn <= GROUNDWATER_READINGS).group_by(ranked.c.village_id).all():
+            i = index[village_id]
+            raw["gw_recent"][i], raw["gw_oldest"][i], raw["gw_count"][i] = newest_level, oldest_level, window
+
+        trip_cutoff = datetime.utcnow() - timedelta(days=TRIP_WINDOW_DAYS)
+        for village_id, count in db.query(Trip.village_id, func.count(Trip.id)).filter(
+            Trip.village_id.in_(village_ids),
+            Trip.created_at >= trip_cutoff
+        ).group_by(Trip.village_id).all():
+            raw["trips"][index[village_id]] = count
+
+    def simulate_wsi(self, db: Session, village: Village, rainfall_change_pct: float, base: Optional[Dict] = None) -> Dict:
         """
         What-If simulation: recalculate WSI if rainfall changes by given percentage.
         rainfall_change_pct: negative = less rain (drought), positive = more rain
+        base: precomputed calculate_wsi() result (e.g. from calculate_wsi_batch)
         """
-        base = self.calculate_wsi(db, village)
+        if base is None:
+            base = self.calculate_wsi(db, village)
         base_rainfall = base["components"]["rainfall"]["score"]
 
         # Adjust rainfall component based on simulation
@@ -175,5 +357,132 @@ class WaterStressCalculator:
             "rainfall_change_pct": rainfall_change_pct,
         }
 
+    COMPONENT_ORDER = ("rainfall", "groundwater", "population", "demand")
+
+    def _data_fingerprint(self, db: Session) -> tuple:
+        """Cheap single-round-trip signature of everything the WSI components read."""
+        return tuple(db.query(
+            db.query(func.count(Village.id)).scalar_subquery(),
+            db.query(func.max(Village.id)).scalar_subquery(),
+            db.query(func.sum(Village.population)).scalar_subquery(),
+            db.query(func.count(WSIComponentAggregate.village_id)).scalar_subquery(),
+            db.query(func.max(WSIComponentAggregate.updated_at)).scalar_subquery(),
+            db.query(func.max(RainfallData.id)).scalar_subquery(),
+            db.query(func.max(GroundwaterData.id)).scalar_subquery(),
+            db.query(func.max(Trip.id)).scalar_subquery(),
+        ).one())
+
+    def base_component_matrix(self, db: Session) -> Dict:
+        """
+        Village x component score matrix (columns in COMPONENT_ORDER) plus base WSI.
+        Cached until the underlying rainfall / groundwater / trip / village data changes.
+        """
+        fingerprint = self._data_fingerprint(db)
+        cached = getattr(self, "_base_matrix_cache", None)
+        if cached is not None and cached[0] == fingerprint:
+            return cached[1]
+
+        results = self.calculate_wsi_batch(db)
+        ordered = list(results.values())
+        matrix = {
+            "village_ids": np.array([r["village_id"] for r in ordered], dtype=int),
+            "village_names": [r["village_name"] for r in ordered],
+            "components": np.array(
+                [[r["components"][c]["score"] for c in self.COMPONENT_ORDER] for r in ordered], dtype=float
+            ).reshape(len(ordered), len(self.COMPONENT_ORDER)),
+            "wsi": np.array([r["wsi_score"] for r in ordered], dtype=float),
+            "severity": [r["severity"] for r in ordered],
+        }
+        self._base_matrix_cache = (fingerprint, matrix)
+        return matrix
+
+    def _scenario_wsi(self, components: np.ndarray, rainfall_changes: np.ndarray, groundwater_changes: np.ndarray) -> np.ndarray:
+        """
+        Broadcast every (rainfall, groundwater) scenario over every village.
+        Returns WSI with shape (len(rainfall_changes), len(groundwater_changes), villages).
+        """
+        rainfall = np.clip(components[:, 0][None, :] - rainfall_changes[:, None], 0, 100)[:, None, :]
+        # +1 m groundwater rise = -10 stress points (10 m decline = 100)
+        groundwater = np.clip(components[:, 1][None, :] - groundwater_changes[:, None] * 10, 0, 100)[None, :, :]
+        wsi = (
+            rainfall * self.WEIGHTS["rainfall"] +
+            groundwater * self.WEIGHTS["groundwater"] +
+            components[:, 2] * self.WEIGHTS["population"] +
+            components[:, 3] * self.WEIGHTS["demand"]
+        )
+        return round1(np.clip(wsi, 0, 100))
+
+    def simulate_wsi_batch(self, db: Session, rainfall_change_pct: float) -> List[Dict]:
+        """simulate_wsi() for every village from the cached base matrix."""
+        base = self.base_component_matrix(db)
+        simulated = self._scenario_wsi(base["components"], np.array([rainfall_change_pct]), np.zeros(1))[0, 0]
+
+        results = []
+        for i, village_id in enumerate(base["village_ids"]):
+            severity = self.get_severity(simulated[i])
+            results.append({
+                "village_id": int(village_id),
+                "village_name": base["village_names"][i],
+                "original_wsi": float(base["wsi"][i]),
+                "simulated_wsi": float(simulated[i]),
+                "original_severity": base["severity"][i],
+                "simulated_severity": severity,
+                "severity_color": self.get_severity_color(severity),
+                "rainfall_change_pct": rainfall_change_pct,
+            })
+        return results
+
+    def simulate_sweep(
+        self,
+        db: Session,
+        rainfall_changes: List[float],
+        groundwater_changes: Optional[List[float]] = None,
+    ) -> Dict:
+        """
+        What-If sweep over a grid of scenarios in one NumPy broadcast.
+        rainfall_changes: % rainfall change per scenario (negative = drought)
+        groundwater_changes: metres of water-table change (positive = recharge), default [0]
+        """
+        base = self.base_component_matrix(db)
+        rainfall = np.asarray(rainfall_changes, dtype=float)
+        groundwater = np.asarray(groundwater_changes if groundwater_changes else [0.0], dtype=float)
+
+        wsi = self._scenario_wsi(base["components"], rainfall, groundwater)
+        scenarios_wsi = wsi.reshape(-1, wsi.shape[-1])  # (scenarios, villages)
+
+        original_critical = int((base["wsi"] >= 60).sum())
+        critical = (scenarios_wsi >= 60).sum(axis=1)
+        emergency = (scenarios_wsi >= 80).sum(axis=1)
+        avg = scenarios_wsi.mean(axis=1) if scenarios_wsi.shape[1] else np.zeros(len(scenarios_wsi))
+        rainfall_grid, groundwater_grid = np.meshgrid(rainfall, groundwater, indexing="ij")
+
+        return {
+            "rainfall_change_pct": rainfall.tolist(),
+            "groundwater_change_m": groundwater.tolist(),
+            "villages": [
+                {"village_id": int(vid), "village_name": name, "original_wsi": float(w)}
+                for vid, name, w in zip(base["village_ids"], base["village_names"], base["wsi"])
+            ],
+            # curves[v][s]: simulated WSI of village v under scenario s (scenarios in row-major grid order)
+            "curves": scenarios_wsi.T.tolist(),
+            "scenarios": [
+                {
+                    "rainfall_change_pct": float(r),
+                    "groundwater_change_m": float(g),
+                    "critical_count": int(c),
+                    "emergency_count": int(e),
+                    "change_in_critical": int(c) - original_critical,
+                    "avg_wsi": round(float(a), 1),
+                }
+                for r, g, c, e, a in zip(rainfall_grid.ravel(), groundwater_grid.ravel(), critical, emergency, avg)
+            ],
+            "summary": {
+                "total_villages": len(base["village_ids"]),
+                "total_scenarios": len(scenarios_wsi),
+                "original_critical": original_critical,
+                "avg_original_wsi": round(float(base["wsi"].mean()), 1) if len(base["wsi"]) else 0,
+            },
+        }
+
 
 wsi_calculator = WaterStressCalculator()
@@ -0,0 +1,192 @@
+"""
+Append-only WSI history.
+Every recompute appends a WaterStressRecord per village and moves that village's
+LatestWSI pointer, so current-state reads stay a single indexed join however long
+the history grows. rollup_history() (scheduled daily) folds raw snapshots older
+than RAW_RETENTION_DAYS into daily rollups, and daily rollups older than
+DAILY_RETENTION_DAYS into weekly ones.
+"""
+from typing import Dict, List, Optional
+from datetime import datetime, timedelta
+from sqlalchemy import func, and_, select
+from sqlalchemy.orm import Session
+from app.models import WaterStressRecord, LatestWSI, WSIRollup
+from app.ml.wsi_calculator import WaterStressCalculator
+
+RAW_RETENTION_DAYS = 14
+DAILY_RETENTION_DAYS = 180
+
+
+def latest_records(db: Session, village_ids: Optional[List[int]] = None) -> Dict[int, WaterStressRecord]:
+    """Latest WSI record per village, keyed by village id."""
+    query = db.query(WaterStressRecord).join(LatestWSI, LatestWSI.record_id == WaterStressRecord.id)
+    if village_ids is not None:
+        query = query.filter(LatestWSI.village_id.in_(village_ids))
+    return {r.village_id: r for r in query.all()}
+
+
+def latest_record(db: Session, village_id: int) -> Optional[WaterStressRecord]:
+    return db.query(WaterStressRecord).join(
+        LatestWSI, LatestWSI.record_id == WaterStressRecord.id
+    ).filter(LatestWSI.village_id == village_id).first()
+
+
+def append_snapshots(db: Session, results: Dict[int, Dict], now: Optional[datetime] = None) -> Dict[int, Optional[str]]:
+    """
+    Append one WSI snapshot per calculate_wsi() result and move the latest pointers.
+    Returns each village's previous severity (None if it had no history).
+    Does not commit.
+    """
+    now = now or datetime.utcnow()
+    previous = latest_records(db)
+
+    records = {}
+    for village_id, result in results.items():
+        record = WaterStressRecord(
+            village_id=village_id,
+            date=now,
+            wsi_score=result["wsi_score"],
+            severity=result["severity"],
+            components=result["components"],
+        )
+        db.add(record)
+        records[village_id] = record
+    db.flush()
+
+    pointers = {p.village_id: p for p in db.query(LatestWSI).all()}
+    for village_id, record in records.items():
+        pointer = pointers.get(village_id)
+        if pointer is None:
+            db.add(LatestWSI(village_id=village_id, record_id=record.id, updated_at=now))
+        else:
+            pointer.record_id = record.id
+            pointer.updated_at = now
+
+    return {
+        village_id: previous[village_id].severity if village_id in previous else None
+        for village_id in records
+    }
+
+
+def ensure_latest_pointers(db: Session) -> int:
+    """Point villages without a LatestWSI row at their newest existing record."""
+    newest = db.query(
+        WaterStressRecord.village_id.label("village_id"),
+        func.max(WaterStressRecord.date).label("date"),
+    ).outerjoin(
+        LatestWSI, LatestWSI.village_id == WaterStressRecord.village_id
+    ).filter(LatestWSI.village_id.is_(None)).group_by(WaterStressRecord.village_id).subquery()
+
+    rows = db.query(WaterStressRecord.village_id, func.max(WaterStressRecord.id)).join(
+        newest, and_(
+            WaterStressRecord.village_id == newest.c.village_id,
+            WaterStressRecord.date == newest.c.date,
+        )
+    ).group_by(WaterStressRecord.village_id).all()
+
+    now = datetime.utcnow()
+    for village_id, record_id in rows:
+        db.add(LatestWSI(village_id=village_id, record_id=record_id, updated_at=now))
+    db.commit()
+    return len(rows)
+
+
+def _merge_rollups(db: Session, period: str, buckets: Dict[tuple, List[tuple]]):
+    """Merge (village_id, period_start) -> [(avg, min, max, samples), ...] into stored rollups."""
+    if not buckets:
+        return
+    starts = [key[1] for key in buckets]
+    existing = {
+        (r.village_id, r.period_start): r for r in db.query(WSIRollup).filter(
+            WSIRollup.period == period,
+            WSIRollup.period_start >= min(starts),
+            WSIRollup.period_start <= max(starts),
+        ).all()
+    }
+    for (village_id, period_start), parts in buckets.items():
+        rollup = existing.get((village_id, period_start))
+        if rollup is not None:
+            parts = parts + [(rollup.avg_wsi, rollup.min_wsi, rollup.max_wsi, rollup.samples)]
+        else:
+            rollup = WSIRollup(village_id=village_id, period=period, period_start=period_start)
+            db.add(rollup)
+        samples = sum(p[3] for p in parts)
+        rollup.avg_wsi = round(sum(p[0] * p[3] for p in parts) / samples, 1)
+        rollup.min_wsi = min(p[1] for p in parts)
+        rollup.max_wsi = max(p[2] for p in parts)
+        rollup.samples = samples
+        rollup.severity = WaterStressCalculator.get_severity(rollup.avg_wsi)
+
+
+def rollup_history(db: Session, now: Optional[datetime] = None) -> Dict[str, int]:
+    """Downsample and prune WSI history according to the retention policy."""
+    now = now or datetime.utcnow()
+    today = now.replace(hour=0, minute=0, second=0, microsecond=0)
+    raw_cutoff = today - timedelta(days=RAW_RETENTION_DAYS)
+    daily_cutoff = today - timedelta(days=DAILY_RETENTION_DAYS)
+
+    # Raw snapshots -> daily (never the record a latest pointer references)
+    expired_raw = and_(
+        WaterStressRecord.date < raw_cutoff,
+        WaterStressRecord.id.notin_(select(LatestWSI.record_id)),
+    )
+    daily: Dict[tuple, List[tuple]] = {}
+    for village_id, date, score in db.query(
+        WaterStressRecord.village_id, WaterStressRecord.date, WaterStressRecord.wsi_score
+    ).filter(expired_raw).all():
+        day = date.replace(hour=0, minute=0, second=0, microsecond=0)
+        daily.setdefault((village_id, day), []).append((score, score, score, 1))
+    _merge_rollups(db, "daily", daily)
+    raw_pruned = db.query(WaterStressRecord).filter(expired_raw).delete(synchronize_session=False)
+    db.flush()
+
+    # Daily rollups -> weekly (weeks start on Monday)
+    weekly: Dict[tuple, List[tuple]] = {}
+    expired_daily = db.query(WSIRollup).filter(
+        WSIRollup.period == "daily",
+        WSIRollup.period_start < daily_cutoff,
+    ).all()
+    for r in expired_daily:
+        week = r.period_start - timedelta(days=r.period_start.weekday())
+        weekly.setdefault((r.village_id, week), []).append((r.avg_wsi, r.min_wsi, r.max_wsi, r.samples))
+        db.delete(r)
+    _merge_rollups(db, "weekly", weekly)
+    daily_pruned = len(expired_daily)
+
+    db.commit()
+    return {"raw_pruned": raw_pruned, "daily_pruned": daily_pruned}
+
+
+def village_history(db: Session, village_id: int, days: int = 90) -> List[Dict]:
+    """WSI trend for one village at the finest resolution still retained for each period."""
+    since = datetime.utcnow() - timedelta(days=days)
+    points = [
+        {
+            "date": r.period_start.isoformat(),
+            "wsi": r.avg_wsi,
+            "min": r.min_wsi,
+            "max": r.max_wsi,
+            "severity": r.severity,
+            "resolution": r.period,
+        }
+        for r in db.query(WSIRollup).filter(
+            WSIRollup.village_id == village_id,
+            WSIRollup.period_start >= since,
+        ).all()
+    ]
+    points.extend(
+        {
+            "date": r.date.isoformat(),
+            "wsi": r.wsi_score,
+            "min": r.wsi_score,
+            "max": r.wsi_score,
+            "severity": r.severity,
+            "resolution": "raw",
+        }
+        for r in db.query(WaterStressRecord).filter(
+            WaterStressRecord.village_id == village_id,
+            WaterStressRecord.date >= since,
+        ).all()
+    )
+    points.sort(key=lambda p: p["date"])
+    return points
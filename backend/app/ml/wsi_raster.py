@@ -0,0 +1,201 @@
+"""
+Spatial WSI raster.
+Interpolates the latest village WSI onto a lat/lon grid (inverse distance
+weighting) once per recompute, stores it as a memory-mapped .npy file, and
+serves Web-Mercator z/x/y tiles (PNG or raw float32) from an LRU cache.
+"""
+import io
+import json
+import math
+import os
+import struct
+import zlib
+from datetime import datetime
+from functools import lru_cache
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+from sqlalchemy.orm import Session
+
+from app.config import RASTER_DIR
+from app.models import Village
+from app.ml.wsi_history import latest_records
+
+TILE_SIZE = 256
+GRID_RESOLUTION_DEG = 0.01  # ~1.1 km
+BBOX_PADDING_DEG = 0.15
+IDW_POWER = 2
+KEEP_VERSIONS = 3
+CURRENT_POINTER = "current.json"
+
+# Severity bands (upper bound, RGBA) matching WaterStressCalculator.get_severity_color
+SEVERITY_RGBA = [
+    (20, (16, 185, 129, 150)),
+    (40, (245, 158, 11, 150)),
+    (60, (249, 115, 22, 160)),
+    (80, (239, 68, 68, 170)),
+    (101, (153, 27, 27, 180)),
+]
+
+
+def _idw_grid(lats: np.ndarray, lngs: np.ndarray, values: np.ndarray, bbox: Dict, resolution: float) -> np.ndarray:
+    """Inverse-distance-weighted surface, rows north→south, cols west→east."""
+    grid_lats = np.arange(bbox["north"], bbox["south"] - 1e-9, -resolution)
+    grid_lngs = np.arange(bbox["west"], bbox["east"] + 1e-9, resolution)
+    # Equirectangular distances are plenty accurate at district scale
+    lng_scale = math.cos(math.radians((bbox["north"] + bbox["south"]) / 2))
+
+    grid = np.empty((len(grid_lats), len(grid_lngs)), dtype=np.float32)
+    rows_per_chunk = max(1, 2_000_000 // max(1, len(grid_lngs) * len(values)))
+    for lo in range(0, len(grid_lats), rows_per_chunk):
+        chunk_lats = grid_lats[lo:lo + rows_per_chunk]
+        dlat = chunk_lats[:, None, None] - lats[None, None, :]
+        dlng = (grid_lngs[None, :, None] - lngs[None, None, :]) * lng_scale
+        dist2 = dlat ** 2 + dlng ** 2
+        exact = dist2 < 1e-12
+        weights = 1.0 / np.maximum(dist2, 1e-12) ** (IDW_POWER / 2)
+        surface = (weights * values).sum(axis=2) / weights.sum(axis=2)
+        # Cells sitting on a village take its value exactly
+        hit = exact.any(axis=2)
+        if hit.any():
+            surface[hit] = values[exact[hit].argmax(axis=1)]
+        grid[lo:lo + len(chunk_lats)] = surface
+    return grid
+
+
+def build_raster(db: Session, resolution: float = GRID_RESOLUTION_DEG) -> Optional[Dict]:
+    """Interpolate the latest WSI of every village and persist it as a new raster version."""
+    latest = latest_records(db)
+    villages = [v for v in db.query(Village).all() if v.id in latest]
+    if not villages:
+        return None
+
+    lats = np.array([v.latitude for v in villages])
+    lngs = np.array([v.longitude for v in villages])
+    values = np.array([latest[v.id].wsi_score for v in villages])
+    bbox = {
+        "north": float(lats.max() + BBOX_PADDING_DEG),
+        "south": float(lats.min() - BBOX_PADDING_DEG),
+        "west": float(lngs.min() - BBOX_PADDING_DEG),
+        "east": float(lngs.max() + BBOX_PADDING_DEG),
+    }
+    surface = _idw_grid(lats, lngs, values, bbox, resolution)
+
+    os.makedirs(RASTER_DIR, exist_ok=True)
+    version = datetime.utcnow().strftime("%Y%m%dT%H%M%S%f")
+    grid_path = os.path.join(RASTER_DIR, f"wsi_{version}.npy")
+    stored = np.lib.format.open_memmap(grid_path, mode="w+", dtype=np.float32, shape=surface.shape)
+    stored[:] = surface
+    stored.flush()
+    del stored
+
+    meta = {
+        "version": version,
+        "file": os.path.basename(grid_path),
+        "bbox": bbox,
+        "resolution_deg": resolution,
+        "shape": list(surface.shape),
+        "villages": len(villages),
+        "created_at": datetime.utcnow().isoformat(),
+    }
+    pointer = os.path.join(RASTER_DIR, CURRENT_POINTER)
+    with open(pointer + ".tmp", "w") as f:
+        json.dump(meta, f)
+    os.replace(pointer + ".tmp", pointer)
+    _prune_versions(meta["file"])
+    return meta
+
+
+def _prune_versions(current_file: str):
+    files = sorted(f for f in os.listdir(RASTER_DIR) if f.startswith("wsi_") and f.endswith(".npy"))
+    for old in files[:-KEEP_VERSIONS]:
+        if old != current_file:
+            try:
+                os.remove(os.path.join(RASTER_DIR, old))
+            except OSError:
+                pass
+
+
+def current_meta() -> Optional[Dict]:
+    try:
+        with open(os.path.join(RASTER_DIR, CURRENT_POINTER)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+@lru_cache(maxsize=KEEP_VERSIONS)
+def _open_grid(version: str, filename: str) -> np.ndarray:
+    return np.load(os.path.join(RASTER_DIR, filename), mmap_mode="r")
+
+
+def _tile_bounds(z: int, x: int, y: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Latitude (per pixel row) and longitude (per pixel column) of tile pixel centres."""
+    n = 2 ** z
+    pixels = (np.arange(TILE_SIZE) + 0.5) / TILE_SIZE
+    lngs = (x + pixels) / n * 360.0 - 180.0
+    lats = np.degrees(np.arctan(np.sinh(np.pi * (1 - 2 * (y + pixels) / n))))
+    return lats, lngs
+
+
+def _sample_tile(meta: Dict, z: int, x: int, y: int) -> np.ndarray:
+    """Nearest-cell sample of the raster for one tile; NaN outside the raster."""
+    grid = _open_grid(meta["version"], meta["file"])
+    bbox, res = meta["bbox"], meta["resolution_deg"]
+    lats, lngs = _tile_bounds(z, x, y)
+    rows = np.rint((bbox["north"] - lats) / res).astype(int)
+    cols = np.rint((lngs - bbox["west"]) / res).astype(int)
+    row_ok = (rows >= 0) & (rows < grid.shape[0])
+    col_ok = (cols >= 0) & (cols < grid.shape[1])
+
+    tile = np.full((TILE_SIZE, TILE_SIZE), np.nan, dtype=np.float32)
+    if row_ok.any() and col_ok.any():
+        tile[np.ix_(row_ok, col_ok)] = grid[np.ix_(rows[row_ok], cols[col_ok])]
+    return tile
+
+
+def _encode_png(rgba: np.ndarray) -> bytes:
+    """Minimal RGBA PNG encoder (no imaging dependency)."""
+    height, width, _ = rgba.shape
+    raw = np.hstack([np.zeros((height, 1), dtype=np.uint8), rgba.reshape(height, -1)]).tobytes()
+
+    def chunk(tag: bytes, data: bytes) -> bytes:
+        return struct.pack(">I", len(data)) + tag + data + struct.pack(">I", zlib.crc32(tag + data) & 0xFFFFFFFF)
+
+    header = struct.pack(">IIBBBBB", width, height, 8, 6, 0, 0, 0)
+    return b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", header) + chunk(b"IDAT", zlib.compress(raw, 6)) + chunk(b"IEND", b"")
+
+
+def _colorize(tile: np.ndarray) -> np.ndarray:
+    rgba = np.zeros(tile.shape + (4,), dtype=np.uint8)
+    valid = ~np.isnan(tile)
+    band = np.searchsorted([upper for upper, _ in SEVERITY_RGBA], np.where(valid, tile, 0), side="right")
+    palette = np.array([color for _, color in SEVERITY_RGBA], dtype=np.uint8)
+    rgba[valid] = palette[np.minimum(band, len(palette) - 1)][valid]
+    return rgba
+
+
+@lru_cache(maxsize=1024)
+def _render_tile(version: str, z: int, x: int, y: int, fmt: str) -> bytes:
+    meta = current_meta()
+    if meta is None or meta["version"] != version:
+        raise LookupError("raster version changed")
+    tile = _sample_tile(meta, z, x, y)
+    if fmt == "png":
+        return _encode_png(_colorize(tile))
+    buffer = io.BytesIO()
+    np.save(buffer, tile)
+    return buffer.getvalue()
+
+
+def get_tile(db: Session, z: int, x: int, y: int, fmt: str = "png") -> Optional[Tuple[str, bytes]]:
+    """(raster version, tile bytes) for the current raster (building the first raster on demand)."""
+    meta = current_meta() or build_raster(db)
+    if meta is None:
+        return None
+    try:
+        return meta["version"], _render_tile(meta["version"], z, x, y, fmt)
+    except LookupError:
+        # A recompute swapped the raster between reading the pointer and rendering
+        meta = current_meta()
+        return (meta["version"], _render_tile(meta["version"], z, x, y, fmt)) if meta else None
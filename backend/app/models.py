@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Float, DateTime, ForeignKey, JSON, Text, Enum as SQLEnum
+from sqlalchemy import Column, Integer, String, Float, DateTime, ForeignKey, JSON, Text, Index, UniqueConstraint, Enum as SQLEnum
 from sqlalchemy.orm import relationship
 from datetime import datetime
 import enum
@@ -103,6 +103,53 @@ class WaterStressRecord(Base):
 
     village = relationship("Village", back_populates="wsi_records")
 
+    __table_args__ = (Index("ix_wsi_village_date", "village_id", "date"),)
+
+
+# ─── Latest WSI Pointer (one row per village) ───
+class LatestWSI(Base):
+    __tablename__ = "latest_wsi"
+
+    village_id = Column(Integer, ForeignKey("villages.id"), primary_key=True)
+    record_id = Column(Integer, ForeignKey("water_stress_records.id"), nullable=False)
+    updated_at = Column(DateTime, default=datetime.utcnow)
+
+    record = relationship("WaterStressRecord")
+
+
+# ─── WSI Rollups (downsampled history) ───
+class WSIRollup(Base):
+    __tablename__ = "wsi_rollups"
+
+    id = Column(Integer, primary_key=True, index=True)
+    village_id = Column(Integer, ForeignKey("villages.id"), nullable=False)
+    period = Column(String(10), nullable=False)  # daily, weekly
+    period_start = Column(DateTime, nullable=False)
+    avg_wsi = Column(Float, nullable=False)
+    min_wsi = Column(Float, nullable=False)
+    max_wsi = Column(Float, nullable=False)
+    samples = Column(Integer, nullable=False)
+    severity = Column(String(20))  # severity of avg_wsi
+
+    __table_args__ = (UniqueConstraint("village_id", "period", "period_start", name="uq_wsi_rollup_period"),)
+
+
+# ─── WSI Component Aggregates (incrementally maintained) ───
+class WSIComponentAggregate(Base):
+    __tablename__ = "wsi_component_aggregates"
+
+    village_id = Column(Integer, ForeignKey("villages.id"), primary_key=True)
+    rainfall_window_start = Column(DateTime)
+    rainfall_actual_sum = Column(Float, default=0.0)
+    rainfall_normal_sum = Column(Float, default=0.0)
+    rainfall_count = Column(Integer, default=0)
+    groundwater_window = Column(JSON)  # [[iso date, level], ...] newest first
+    groundwater_newest = Column(Float)
+    groundwater_oldest = Column(Float)
+    trip_window_start = Column(DateTime)
+    trip_count = Column(Integer, default=0)
+    updated_at = Column(DateTime, default=datetime.utcnow)
+
 
 # ─── Tankers ───
 class Tanker(Base):
@@ -147,6 +194,28 @@ class Trip(Base):
     village = relationship("Village", back_populates="trips")
 
 
+# ─── Allocation Runs (one per auto-allocate, keyed for idempotent retries) ───
+class AllocationRun(Base):
+    __tablename__ = "allocation_runs"
+
+    id = Column(Integer, primary_key=True, index=True)
+    idempotency_key = Column(String(64), unique=True, nullable=False)
+    district = Column(String(100))
+    status = Column(String(20), default="running")  # running, completed
+    trips_created = Column(Integer, default=0)
+    result = Column(JSON)  # response replayed for repeated keys
+    created_at = Column(DateTime, default=datetime.utcnow)
+    completed_at = Column(DateTime)
+
+
+# ─── Allocation Run Trips (trips reserved by a run; only these expire) ───
+class AllocationRunTrip(Base):
+    __tablename__ = "allocation_run_trips"
+
+    trip_id = Column(Integer, ForeignKey("trips.id"), primary_key=True)
+    run_id = Column(Integer, ForeignKey("allocation_runs.id"), nullable=False, index=True)
+
+
 # ─── Water Requests ───
 class WaterRequest(Base):
     __tablename__ = "water_requests"
@@ -185,6 +254,28 @@ class Prediction(Base):
     village = relationship("Village", back_populates="predictions")
 
 
+# ─── Materialized Predictions (one row per village, horizon and model version) ───
+class MaterializedPrediction(Base):
+    __tablename__ = "materialized_predictions"
+
+    id = Column(Integer, primary_key=True, index=True)
+    village_id = Column(Integer, ForeignKey("villages.id"), nullable=False)
+    horizon_days = Column(Integer, nullable=False)
+    model_version = Column(String(20), nullable=False)
+    prediction_date = Column(DateTime, nullable=False)
+    target_date = Column(DateTime, nullable=False)
+    predicted_wsi = Column(Float)
+    predicted_severity = Column(String(20))
+    predicted_demand_liters = Column(Integer)
+    predicted_tanker_trips = Column(Integer)
+    confidence = Column(Float)  # 0-1
+    details = Column(JSON)  # full predictor output, served as-is
+
+    __table_args__ = (
+        UniqueConstraint("village_id", "horizon_days", "model_version", name="uq_materialized_prediction_horizon"),
+    )
+
+
 # ─── Rainfall Data (Time Series) ───
 class RainfallData(Base):
     __tablename__ = "rainfall_data"
@@ -0,0 +1,58 @@
+"""
+WSI Raster Routes — interpolated stress surface as map tiles.
+"""
+from fastapi import APIRouter, Depends, HTTPException, Path, Request, Response
+from sqlalchemy.orm import Session
+from app.database import get_db
+from app.ml.wsi_raster import build_raster, current_meta, get_tile
+
+raster_router = APIRouter(prefix="/api/wsi", tags=["raster"])
+
+# Tile URLs carry no raster version: cache briefly, then revalidate against the version ETag
+TILE_CACHE_CONTROL = "public, max-age=60, must-revalidate"
+
+
+def _tile_response(request: Request, db: Session, z: int, x: int, y: int, fmt: str, media_type: str) -> Response:
+    if x >= 2 ** z or y >= 2 ** z:
+        raise HTTPException(status_code=404, detail="Tile out of range")
+    tile = get_tile(db, z, x, y, fmt)
+    if tile is None:
+        raise HTTPException(status_code=404, detail="No WSI data to render")
+    version, content = tile
+    headers = {"Cache-Control": TILE_CACHE_CONTROL, "ETag": f'"{version}"'}
+    if request.headers.get("if-none-match") == headers["ETag"]:
+        return Response(status_code=304, headers=headers)
+    return Response(content=content, media_type=media_type, headers=headers)
+
+
+@raster_router.get("/raster")
+def raster_meta(db: Session = Depends(get_db)):
+    """Metadata (version, bbox, grid shape) of the current WSI raster."""
+    meta = current_meta() or build_raster(db)
+    if meta is None:
+        raise HTTPException(status_code=404, detail="No WSI data to render")
+    return meta
+
+
+@raster_router.get("/tiles/{z}/{x}/{y}.png")
+def wsi_tile_png(
+    request: Request,
+    z: int = Path(..., ge=0, le=18),
+    x: int = Path(..., ge=0),
+    y: int = Path(..., ge=0),
+    db: Session = Depends(get_db),
+):
+    """Severity-coloured 256x256 WSI tile (transparent outside the raster)."""
+    return _tile_response(request, db, z, x, y, "png", "image/png")
+
+
+@raster_router.get("/tiles/{z}/{x}/{y}.npy")
+def wsi_tile_array(
+    request: Request,
+    z: int = Path(..., ge=0, le=18),
+    x: int = Path(..., ge=0),
+    y: int = Path(..., ge=0),
+    db: Session = Depends(get_db),
+):
+    """Raw float32 WSI values for a 256x256 tile as a .npy payload (NaN outside the raster)."""
+    return _tile_response(request, db, z, x, y, "npy", "application/octet-stream")
@@ -1,21 +1,36 @@
 """
 API routes for JalMitra backend.
 """
-from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi import APIRouter, Depends, Header, HTTPException, Query
 from sqlalchemy.orm import Session
 from sqlalchemy import func, desc
 from typing import Optional, List
 from datetime import datetime, timedelta
+import math
+import time
+import uuid
+
+import numpy as np
 
 from app.database import get_db
 from app.models import (
-    Village, WaterStressRecord, Tanker, Trip, WaterRequest,
+    Village, Tanker, Trip, WaterRequest,
     Prediction, RainfallData, GroundwaterData, Grievance, User
 )
 from app.ml.wsi_calculator import wsi_calculator
+from app.ml.wsi_history import latest_records, village_history
 from app.ml.allocation_engine import allocation_engine
+from app.ml.priority_queue import priority_index
+from app.ml.schedule_planner import schedule_planner
+from app.ml import prediction_store
 from app.ml.drought_predictor import drought_predictor
-from app.ml.route_optimizer import optimize_routes
+from app.ml.route_optimizer import optimize_routes, optimize_fleet_routes, default_schedule, RURAL_MIN_PER_KM
+from app.ml.time_windows import blocked_dates, minutes_per_km, village_deadlines
+from app.ml.route_plans import route_plans
+from app.ml.route_cache import route_cache, plan_fingerprint
+from app.ml.spatial_index import spatial_index
+from app.config import ROUTE_SOLVER_TIME_LIMIT_S, ROUTE_IMPROVE_TIME_BUDGET_MS
+from app.websocket import manager
 
 router = APIRouter(prefix="/api")
 
@@ -28,16 +43,8 @@ def get_dashboard_overview(db: Session = Depends(get_db)):
     """Get aggregated dashboard statistics."""
     total_villages = db.query(func.count(Village.id)).scalar()
 
-    # WSI distribution
-    wsi_records = db.query(WaterStressRecord).order_by(
-        WaterStressRecord.village_id, WaterStressRecord.date.desc()
-    ).all()
-
-    # Get latest WSI per village
-    latest_wsi = {}
-    for r in wsi_records:
-        if r.village_id not in latest_wsi:
-            latest_wsi[r.village_id] = r
+    # WSI distribution (latest WSI per village)
+    latest_wsi = latest_records(db)
 
     severity_counts = {"normal": 0, "watch": 0, "warning": 0, "critical": 0, "emergency": 0}
     total_wsi = 0
@@ -111,12 +118,11 @@ def get_villages(
         query = query.filter(Village.district == district)
 
     villages = query.all()
+    latest_wsi = latest_records(db, [v.id for v in villages]) if district else latest_records(db)
     result = []
 
     for v in villages:
-        wsi = db.query(WaterStressRecord).filter(
-            WaterStressRecord.village_id == v.id
-        ).order_by(WaterStressRecord.date.desc()).first()
+        wsi = latest_wsi.get(v.id)
 
         if severity and wsi and wsi.severity != severity:
             continue
@@ -151,7 +157,7 @@ def get_village_detail(village_id: int, db: Session = Depends(get_db)):
         raise HTTPException(status_code=404, detail="Village not found")
 
     # WSI
-    wsi_data = wsi_calculator.calculate_wsi(db, village)
+    wsi_data = wsi_calculator.calculate_wsi_batch(db, [village.id])[village.id]
 
     # Rainfall history
     rainfall = db.query(RainfallData).filter(
@@ -163,8 +169,8 @@ def get_village_detail(village_id: int, db: Session = Depends(get_db)):
         GroundwaterData.village_id == village_id
     ).order_by(GroundwaterData.date.asc()).all()
 
-    # Predictions
-    predictions = db.query(Prediction).filter(
+    # Predictions (current model's materialized rows once they exist, seeded ones before)
+    predictions = prediction_store.village_predictions(db, village_id) or db.query(Prediction).filter(
         Prediction.village_id == village_id
     ).order_by(Prediction.target_date.asc()).all()
 
@@ -205,6 +211,25 @@ def get_village_detail(village_id: int, db: Session = Depends(get_db)):
     }
 
 
+@router.get("/villages/{village_id}/wsi-history")
+def get_village_wsi_history(
+    village_id: int,
+    days: int = Query(default=90, ge=1, le=3650),
+    db: Session = Depends(get_db)
+):
+    """WSI trend for a village: raw snapshots, then daily/weekly rollups further back."""
+    village = db.query(Village).filter(Village.id == village_id).first()
+    if not village:
+        raise HTTPException(status_code=404, detail="Village not found")
+
+    return {
+        "village_id": village.id,
+        "village_name": village.name,
+        "days": days,
+        "history": village_history(db, village_id, days),
+    }
+
+
 # ═══════════════════════════════════════════
 # PREDICTIONS
 # ═══════════════════════════════════════════
@@ -213,8 +238,42 @@ def get_predictions(
     days_ahead: int = Query(default=30, ge=7, le=90),
     db: Session = Depends(get_db)
 ):
-    """Get drought predictions for all villages."""
-    return drought_predictor.predict_all_villages(db, days_ahead)
+    """Get drought predictions for all villages (materialized for 30/60/90 days)."""
+    return prediction_store.get_predictions(db, days_ahead)
+
+
+@router.get("/predictions/matrix")
+def get_prediction_matrix(
+    horizons: Optional[List[int]] = Query(default=None),
+    step_days: int = Query(default=7, ge=1, le=90),
+    max_days: int = Query(default=90, ge=1, le=365),
+    db: Session = Depends(get_db)
+):
+    """
+    Predictions for all villages at many horizons in one pass, as columns
+    (default: every `step_days` up to `max_days`, or an explicit `horizons` list).
+    """
+    if horizons:
+        if any(h < 1 or h > 365 for h in horizons):
+            raise HTTPException(status_code=422, detail="horizons must be between 1 and 365 days")
+        days = sorted(set(horizons))
+    else:
+        days = list(range(step_days, max_days + 1, step_days))
+        if not days or days[-1] != max_days:
+            days.append(max_days)
+    return drought_predictor.predict_matrix(db, days)
+
+
+@router.get("/predictions/ensemble")
+def get_ensemble_predictions(
+    days_ahead: int = Query(default=30, ge=7, le=90),
+    samples: Optional[int] = Query(default=None, ge=100, le=20000),
+    workers: Optional[int] = Query(default=None, ge=1, le=64),
+    seed: Optional[int] = None,
+    db: Session = Depends(get_db)
+):
+    """Monte Carlo drought ensemble: P10/P50/P90 WSI and demand per village."""
+    return drought_predictor.predict_ensemble(db, days_ahead, samples, workers, seed)
 
 
 @router.get("/predictions/district-summary")
@@ -223,7 +282,8 @@ def get_district_summary(
     db: Session = Depends(get_db)
 ):
     """Get aggregated predictions by district."""
-    return drought_predictor.get_district_summary(db, days_ahead)
+    predictions = prediction_store.get_predictions(db, days_ahead)
+    return drought_predictor.get_district_summary(db, days_ahead, predictions)
 
 
 # ═══════════════════════════════════════════
@@ -251,6 +311,53 @@ def get_tankers(db: Session = Depends(get_db)):
     ]
 
 
+@router.get("/tankers/nearest")
+def get_nearest_tankers(
+    village_id: Optional[int] = None,
+    lat: Optional[float] = Query(default=None, ge=-90, le=90),
+    lng: Optional[float] = Query(default=None, ge=-180, le=180),
+    k: int = Query(default=5, ge=1, le=100),
+    max_km: Optional[float] = Query(default=None, gt=0),
+    district: Optional[str] = None,
+    db: Session = Depends(get_db)
+):
+    """Closest available tankers to a village or a point (spatial index lookup)."""
+    if village_id is not None:
+        position = spatial_index.village_position(db, village_id)
+        if position is None:
+            raise HTTPException(status_code=404, detail="Village not found")
+        lat, lng = position
+    elif lat is None or lng is None:
+        raise HTTPException(status_code=400, detail="Pass village_id or lat and lng")
+
+    started = time.perf_counter()
+    tankers = spatial_index.nearest_tankers(db, lat, lng, k=k, max_km=max_km, district=district)
+    return {
+        "village_id": village_id,
+        "lat": lat,
+        "lng": lng,
+        "tankers": tankers,
+        "lookup_ms": round((time.perf_counter() - started) * 1000, 3),
+    }
+
+
+@router.post("/tankers/{tanker_id}/location")
+def update_tanker_location(
+    tanker_id: int,
+    lat: float = Query(ge=-90, le=90),
+    lng: float = Query(ge=-180, le=180),
+    db: Session = Depends(get_db)
+):
+    """Record a tanker's current GPS position."""
+    tanker = db.query(Tanker).filter(Tanker.id == tanker_id).first()
+    if not tanker:
+        raise HTTPException(status_code=404, detail="Tanker not found")
+    tanker.current_latitude = lat
+    tanker.current_longitude = lng
+    db.commit()
+    return {"id": tanker.id, "current_lat": lat, "current_lng": lng, "status": tanker.status}
+
+
 # ═══════════════════════════════════════════
 # ALLOCATION
 # ═══════════════════════════════════════════
@@ -260,13 +367,34 @@ def get_priorities(
     db: Session = Depends(get_db)
 ):
     """Get prioritized village list for tanker allocation."""
-    return allocation_engine.get_prioritized_villages(db, limit)
+    return priority_index.top(db, limit)
+
+
+@router.get("/allocation/schedule")
+def get_schedule(
+    horizon_days: int = Query(default=7, ge=7, le=14),
+    db: Session = Depends(get_db)
+):
+    """Day-by-day tanker trip schedule over a rolling 7-14 day horizon."""
+    return schedule_planner.plan(db, horizon_days)
 
 
 @router.post("/allocation/auto-allocate")
-def auto_allocate(db: Session = Depends(get_db)):
-    """Auto-allocate available tankers to highest-priority villages."""
-    return allocation_engine.allocate_tankers(db)
+def auto_allocate(
+    district: Optional[str] = None,
+    dry_run: bool = False,
+    idempotency_key: Optional[str] = Header(default=None, max_length=64),
+    db: Session = Depends(get_db)
+):
+    """
+    Auto-allocate available tankers to highest-priority villages.
+    Persists the plan (Trip rows, tankers marked on_trip) in one transaction;
+    retries with the same Idempotency-Key header return the original run.
+    dry_run=true only previews the assignment.
+    """
+    if dry_run:
+        return {"allocations": allocation_engine.allocate_tankers(db, district), "dry_run": True}
+    return allocation_engine.run_auto_allocation(db, idempotency_key, district)
 
 
 # ═══════════════════════════════════════════
@@ -276,11 +404,35 @@ def auto_allocate(db: Session = Depends(get_db)):
 async def optimize_tanker_routes(
     district: Optional[str] = None,
     num_vehicles: int = Query(default=3, ge=1, le=10),
+    mode: str = Query(default="cvrp", pattern="^(cvrp|greedy|vrptw)$"),
+    max_distance_km: float = Query(default=300, gt=0, le=1000),
+    time_limit_s: float = Query(default=ROUTE_SOLVER_TIME_LIMIT_S, gt=0, le=60),
+    improve_budget_ms: float = Query(default=ROUTE_IMPROVE_TIME_BUDGET_MS, ge=0, le=10000),
+    time_budget_ms: Optional[float] = Query(default=None, gt=0, le=60000),
+    workers: Optional[int] = Query(default=None, ge=1, le=32),
+    search_id: Optional[str] = Query(default=None, pattern="^[A-Za-z0-9_-]{1,64}$"),
     db: Session = Depends(get_db)
 ):
-    """Optimize routes for tanker dispatch in a district."""
+    """
+    Optimize routes for tanker dispatch in a district (multi-depot capacitated VRP, greedy fallback).
+    mode=vrptw also schedules deliveries: request-urgency deadlines, depot hours and
+    days the weather forecast marks unsafe for tankers.
+    time_budget_ms (cvrp / greedy) runs a multi-start search across `workers`
+    processes; each improving plan is pushed over the WebSocket as a
+    "route_incumbent" event tagged with search_id. Pass your own search_id to
+    match events that arrive before the response (one is generated otherwise).
+    Unchanged plans are answered from the route cache.
+    """
+    started = time.perf_counter()
+    generation = route_cache.generation
+    cache_key = (district, num_vehicles, mode, max_distance_km, time_limit_s, improve_budget_ms, time_budget_ms, workers)
+    cached = route_cache.lookup(cache_key)
+    if cached is not None:
+        cached["cache"] = {"status": "hit", "lookup_ms": round((time.perf_counter() - started) * 1000, 3)}
+        return cached
+
     # Get priority villages
-    priorities = allocation_engine.get_prioritized_villages(db, limit=15)
+    priorities = priority_index.top(db, limit=15)
 
     if district:
         priorities = [p for p in priorities if p["district"] == district]
@@ -288,18 +440,6 @@ async def optimize_tanker_routes(
     if not priorities:
         return {"routes": [], "status": "no_villages_to_serve"}
 
-    # Get depot location (first tanker's depot in district)
-    tanker_query = db.query(Tanker).filter(Tanker.status == "available")
-    if district:
-        tanker_query = tanker_query.filter(Tanker.district == district)
-    first_tanker = tanker_query.first()
-
-    depot = {
-        "lat": first_tanker.depot_latitude if first_tanker else 21.1458,
-        "lng": first_tanker.depot_longitude if first_tanker else 79.0882,
-        "name": f"{district or 'Main'} Depot"
-    }
-
     # Prepare villages for optimizer
     villages_for_routing = []
     for p in priorities[:15]:
@@ -314,16 +454,96 @@ async def optimize_tanker_routes(
                 "priority": p["priority_score"],
             })
 
-    result = await optimize_routes(depot, villages_for_routing, num_vehicles)
-    result["depot"] = depot
+    schedule = None
+    if mode == "vrptw":
+        deadlines = village_deadlines(db, [v["id"] for v in villages_for_routing])
+        for v in villages_for_routing:
+            v.update(deadlines.get(v["id"], {}))
+        from app.services.weather_api_service import get_forecast_district
+        try:
+            forecast = await get_forecast_district(district or "Nagpur")
+        except Exception:
+            forecast = {}
+        schedule = default_schedule(
+            blocked_dates=blocked_dates(forecast),
+            min_per_km=minutes_per_km(db, RURAL_MIN_PER_KM),
+        )
+
+    # Available tankers nearest the villages to serve, each routed from its own depot
+    default_depot = {"lat": 21.1458, "lng": 79.0882, "name": f"{district or 'Main'} Depot"}
+    tankers, vehicles = [], []
+    if villages_for_routing:
+        center_lat = sum(v["lat"] for v in villages_for_routing) / len(villages_for_routing)
+        center_lng = sum(v["lng"] for v in villages_for_routing) / len(villages_for_routing)
+        tankers = spatial_index.nearest_tankers(db, center_lat, center_lng, k=num_vehicles, district=district)
+
+    if tankers:
+        vehicles = [
+            {
+                "id": t["id"],
+                "capacity": t["capacity"],
+                "depot": {
+                    "lat": t["depot_lat"] if t["depot_lat"] is not None else t["lat"],
+                    "lng": t["depot_lng"] if t["depot_lng"] is not None else t["lng"],
+                    "name": f"{t['district'] or 'Main'} Depot",
+                },
+                "start": {"lat": t["lat"], "lng": t["lng"]},
+            }
+            for t in tankers
+        ]
+
+    options = {
+        "district": district, "mode": mode, "max_distance_km": max_distance_km, "time_limit_s": time_limit_s,
+        "improve_budget_ms": improve_budget_ms, "num_vehicles": num_vehicles,
+        "time_budget_ms": time_budget_ms, "workers": workers,
+        "blocked_dates": schedule["calendar"].blocked_dates if schedule else None,
+        "min_per_km": schedule["min_per_km"] if schedule else None,
+    }
+    fleet = vehicles or [{"depot": default_depot, "start": default_depot}]
+    fingerprint = plan_fingerprint(villages_for_routing, fleet, options)
+    cached = route_cache.match(fingerprint, cache_key, generation)
+    if cached is not None:
+        cached["cache"] = {"status": "hit", "lookup_ms": round((time.perf_counter() - started) * 1000, 3)}
+        return cached
+
+    search_id = search_id or uuid.uuid4().hex[:12]
+
+    async def stream_incumbent(incumbent: dict):
+        await manager.broadcast({"type": "route_incumbent", "data": {"search_id": search_id, **incumbent}})
+
+    search = {"time_budget_ms": time_budget_ms, "workers": workers, "on_incumbent": stream_incumbent}
+    if vehicles:
+        result = await optimize_fleet_routes(
+            vehicles, villages_for_routing, max_distance_km,
+            time_limit_s=time_limit_s,
+            mode=mode,
+            improve_budget_ms=improve_budget_ms,
+            schedule=schedule,
+            **search,
+        )
+        result["depot"] = result["depots"][0] if result.get("depots") else vehicles[0]["depot"]
+    else:
+        result = await optimize_routes(
+            default_depot, villages_for_routing, num_vehicles, max_distance_km,
+            time_limit_s=time_limit_s,
+            mode=mode,
+            improve_budget_ms=improve_budget_ms,
+            schedule=schedule,
+            **search,
+        )
+        result["depot"] = default_depot
+    if schedule is not None:
+        result.setdefault("schedule", {})["weather_forecast"] = "tanker_safe_days" in forecast
 
     # Fetch road geometry for each route (premium visualization)
     from app.services.mapping_service import mapping_service
     
     for route in result.get("routes", []):
         all_coords = []
-        # Current location starts at depot
-        curr_lat, curr_lng = depot["lat"], depot["lng"]
+        # Tankers start at their current position (or the depot) and return to their own depot
+        depot = route.get("depot", result["depot"])
+        start = route.get("start", depot)
+        curr_lat, curr_lng = start["lat"], start["lng"]
         
         for stop in route["stops"]:
             # Segment: curr -> stop
@@ -347,6 +567,89 @@ async def optimize_tanker_routes(
             
         route["geometry_coords"] = all_coords
 
+    # Kept for incremental edits (urgent insertions / cancellations)
+    used = {route.get("vehicle_id") for route in result.get("routes", [])}
+    idle = [
+        {
+            "vehicle_id": k,
+            "tanker_id": vehicle["id"],
+            "capacity_liters": vehicle["capacity"],
+            "depot": vehicle["depot"],
+            "start": vehicle["start"],
+            "stops": [],
+        }
+        for k, vehicle in enumerate(vehicles) if k not in used
+    ]
+    result["plan_id"] = route_plans.save(result, max_distance_km, schedule, idle)
+    route_cache.store(
+        fingerprint, cache_key, result["plan_id"],
+        [v["id"] for v in villages_for_routing], [t["id"] for t in tankers], generation,
+    )
+    # search_id belongs to this request only; the stored plan is shared by cache hits
+    search = {"search_id": search_id} if time_budget_ms and mode != "vrptw" else {}
+    return {**result, **search, "cache": {"status": "miss"}}
+
+
+@router.get("/routes/plans/{plan_id}")
+def get_route_plan(plan_id: str):
+    """Current state of an optimized plan, including edits made since."""
+    plan = route_plans.get(plan_id)
+    if plan is None:
+        raise HTTPException(status_code=404, detail="Route plan not found")
+    return plan
+
+
+@router.post("/routes/plans/{plan_id}/insert")
+def insert_route_stop(
+    plan_id: str,
+    request_id: Optional[int] = None,
+    village_id: Optional[int] = None,
+    demand_liters: Optional[int] = Query(default=None, gt=0),
+    db: Session = Depends(get_db)
+):
+    """
+    Insert an urgent request (or a village) into the live routes of a plan at the
+    cheapest feasible position. Returns only the routes that changed.
+    """
+    urgency = None
+    deadline = None
+    if request_id is not None:
+        request = db.query(WaterRequest).filter(WaterRequest.id == request_id).first()
+        if not request:
+            raise HTTPException(status_code=404, detail="Request not found")
+        village_id = request.village_id
+        demand_liters = demand_liters or request.quantity_needed_liters
+        pressing = village_deadlines(db, [village_id]).get(village_id, {})
+        urgency, deadline = pressing.get("urgency"), pressing.get("deadline")
+    elif village_id is None:
+        raise HTTPException(status_code=400, detail="Pass request_id or village_id")
+
+    village = db.query(Village).filter(Village.id == village_id).first()
+    if not village:
+        raise HTTPException(status_code=404, detail="Village not found")
+    entry = next(iter(allocation_engine.score_villages(db, [village_id])), {})
+
+    result = route_plans.insert_stop(plan_id, {
+        "id": village.id,
+        "name": village.name,
+        "lat": village.latitude,
+        "lng": village.longitude,
+        "demand": demand_liters or entry.get("recommended_liters", 0),
+        "priority": entry.get("priority_score", 0),
+        "urgency": urgency,
+        "deadline": deadline,
+    })
+    if result is None:
+        raise HTTPException(status_code=404, detail="Route plan not found")
+    return result
+
+
+@router.delete("/routes/plans/{plan_id}/stops/{village_id}")
+def remove_route_stop(plan_id: str, village_id: int):
+    """Remove a cancelled stop from a plan and repair its route. Returns only the changed route."""
+    result = route_plans.remove_stop(plan_id, village_id)
+    if result is None:
+        raise HTTPException(status_code=404, detail="Route plan not found")
     return result
 
 
@@ -395,11 +698,7 @@ def run_simulation(
     db: Session = Depends(get_db)
 ):
     """What-If simulation: how does a rainfall change affect WSI across all villages?"""
-    villages = db.query(Village).all()
-    results = []
-    for v in villages:
-        sim = wsi_calculator.simulate_wsi(db, v, rainfall_change_pct)
-        results.append(sim)
+    results = wsi_calculator.simulate_wsi_batch(db, rainfall_change_pct)
 
     results.sort(key=lambda x: x["simulated_wsi"], reverse=True)
 
@@ -421,6 +720,40 @@ def run_simulation(
     }
 
 
+@router.post("/simulate/sweep")
+def run_simulation_sweep(
+    rainfall_change_pct: Optional[List[float]] = Query(default=None),
+    rainfall_min: float = Query(default=-50, ge=-100, le=100),
+    rainfall_max: float = Query(default=20, ge=-100, le=100),
+    rainfall_step: float = Query(default=5, gt=0),
+    groundwater_change_m: Optional[List[float]] = Query(default=None),
+    db: Session = Depends(get_db)
+):
+    """
+    What-If sweep: WSI curves for many rainfall (and optional groundwater) scenarios at once.
+    Pass explicit rainfall_change_pct values, or a rainfall_min..rainfall_max range by rainfall_step.
+    """
+    if rainfall_change_pct:
+        count = len(rainfall_change_pct)
+    else:
+        if rainfall_min > rainfall_max:
+            raise HTTPException(status_code=400, detail="rainfall_min must not exceed rainfall_max")
+        # Whole steps that stay within rainfall_max (tolerating float error on an exact hit)
+        count = math.floor((rainfall_max - rainfall_min) / rainfall_step + 1e-9) + 1
+
+    # Checked before the range is materialized: a tiny step would otherwise build billions of values
+    if count * len(groundwater_change_m or [0]) > 2000:
+        raise HTTPException(status_code=400, detail="Too many scenarios (max 2000)")
+
+    if rainfall_change_pct:
+        rainfall = rainfall_change_pct
+    else:
+        values = np.minimum(rainfall_min + np.arange(count) * rainfall_step, rainfall_max)
+        rainfall = np.round(values, 4).tolist()
+
+    return wsi_calculator.simulate_sweep(db, rainfall, groundwater_change_m)
+
+
 # ═══════════════════════════════════════════
 # WATER REQUESTS (Gram Panchayat)
 # ═══════════════════════════════════════════
@@ -585,6 +918,22 @@ def get_trips(
     return result
 
 
+@router.post("/trips/{trip_id}/status")
+def update_trip_status(
+    trip_id: int,
+    status: str = Query(pattern="^(in_transit|delivered|cancelled)$"),
+    db: Session = Depends(get_db)
+):
+    """Advance a trip (in_transit, delivered or cancelled); finished trips free their tanker."""
+    try:
+        result = allocation_engine.update_trip_status(db, trip_id, status)
+    except ValueError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    if result is None:
+        raise HTTPException(status_code=404, detail="Trip not found")
+    return result
+
+
 # ═══════════════════════════════════════════
 # AUTH (simplified for hackathon)
 # ═══════════════════════════════════════════
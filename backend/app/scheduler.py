@@ -4,7 +4,13 @@ Runs silently in the background.
 
 Schedule:
   Every 1 hour  → Fetch live rainfall from Open-Meteo + WeatherAPI
-  Every 6 hours → Recalculate WSI for all villages from live data
+  Every 1 hour  → Expire data that slid out of the WSI aggregate windows
+  Every 6 hours → Recalculate WSI for all villages, rebuild the WSI raster
+                  refit seasonal models whose data changed and
+                  materialize 30/60/90-day predictions
+  Every 15 min  → Rebuild the allocation priority heap and spatial index
+                  (event-driven in between)
+  Every 1 day   → Roll old WSI snapshots into daily/weekly history
   Every 7 days  → Fetch NASA POWER historical baselines (slow API)
   On startup    → Full initial data load
 """
@@ -14,8 +20,17 @@ from datetime import datetime
 import logging
 
 from app.database import SessionLocal
-from app.models import Village, WaterStressRecord, RainfallData
+from app.models import Village, RainfallData
 from app.ml.wsi_calculator import WaterStressCalculator
+from app.ml.wsi_aggregates import expire_aggregates, rebuild_aggregates
+from app.ml.wsi_history import append_snapshots, rollup_history
+from app.ml.wsi_raster import build_raster
+from app.ml.allocation_engine import allocation_engine
+from app.ml.priority_queue import priority_index, REBUILD_INTERVAL_SECONDS
+from app.ml.spatial_index import spatial_index
+from app.ml.route_cache import route_cache
+from app.ml.prediction_store import materialize_predictions
+from app.ml.drought_predictor import drought_predictor
 from app.services.weather_aggregator import get_wsi_inputs_for_all_districts, get_live_rainfall_all_districts
 from app.websocket import manager
 
@@ -44,6 +59,48 @@ async def refresh_live_weather():
         logger.error(f"❌ Weather refresh failed: {e}")
 
 
+async def expire_wsi_aggregates():
+    """Hourly: Drop rainfall and trips that fell out of the trailing WSI windows."""
+    db = SessionLocal()
+    try:
+        expired = expire_aggregates(db)
+        logger.info(f"✅ WSI aggregates expired for {expired} village windows")
+    except Exception as e:
+        logger.error(f"❌ WSI aggregate expiry failed: {e}")
+        db.rollback()
+    finally:
+        db.close()
+
+
+async def expire_tanker_reservations():
+    """Hourly: Cancel allocated trips that never started and return their tankers to the pool."""
+    db = SessionLocal()
+    try:
+        result = allocation_engine.expire_reservations(db)
+        logger.info(
+            f"✅ Tanker reservations expired: {result['trips_cancelled']} trips cancelled, "
+            f"{result['tankers_released']} tankers released"
+        )
+    except Exception as e:
+        logger.error(f"❌ Tanker reservation expiry failed: {e}")
+        db.rollback()
+    finally:
+        db.close()
+
+
+async def rebuild_wsi_aggregates():
+    """Daily: Recompute WSI aggregates from raw history (repairs bulk edits the flush hooks can't see)."""
+    db = SessionLocal()
+    try:
+        count = rebuild_aggregates(db)
+        logger.info(f"✅ WSI aggregates rebuilt for {count} villages")
+    except Exception as e:
+        logger.error(f"❌ WSI aggregate rebuild failed: {e}")
+        db.rollback()
+    finally:
+        db.close()
+
+
 async def recalculate_all_wsi():
     """Every 6 hours: Pull live weather inputs and update WSI for all villages."""
     db = SessionLocal()
@@ -53,41 +110,43 @@ async def recalculate_all_wsi():
         wsi_inputs = await get_wsi_inputs_for_all_districts()
         villages = db.query(Village).all()
 
-        updated = 0
+        # Database-driven WSI calculation, one grouped query per component
+        all_wsi = calculator.calculate_wsi_batch(db)
+
+        # Append a snapshot per village; history is kept, the latest pointer moves
+        previous_severity = append_snapshots(db, all_wsi)
+
+        updated = len(all_wsi)
         escalated = []
 
         for village in villages:
-            try:
-                # Use database-driven WSI calculation
-                new_wsi = calculator.calculate_wsi(db, village)
-
-                # Check if severity escalated
-                existing = db.query(WaterStressRecord).filter(
-                    WaterStressRecord.village_id == village.id
-                ).first()
-
-                if existing:
-                    old_severity = existing.severity
-                    new_severity = new_wsi["severity"]
-
-                    existing.wsi_score = new_wsi["wsi_score"]
-                    existing.severity = new_severity
-
-                    if old_severity != new_severity:
-                        escalated.append({
-                            "village": village.name,
-                            "district": village.district,
-                            "from": old_severity,
-                            "to": new_severity,
-                            "wsi": new_wsi["wsi_score"],
-                        })
-                updated += 1
-            except Exception:
-                pass
+            new_wsi = all_wsi.get(village.id)
+            old_severity = previous_severity.get(village.id)
+            if new_wsi and old_severity and old_severity != new_wsi["severity"]:
+                escalated.append({
+                    "village": village.name,
+                    "district": village.district,
+                    "from": old_severity,
+                    "to": new_wsi["severity"],
+                    "wsi": new_wsi["wsi_score"],
+                })
 
         db.commit()
         logger.info(f"✅ WSI updated for {updated} villages, {len(escalated)} escalations")
 
+        # Re-interpolate the stress surface once; tiles are served from this grid
+        raster = build_raster(db)
+        if raster:
+            logger.info(f"🗺️ WSI raster {raster['version']} built ({raster['shape'][0]}x{raster['shape'][1]})")
+
+        # Predictions depend on the latest WSI and seasonal models; refit only
+        # villages with new rainfall / groundwater data, then refresh the horizons
+        refitted = drought_predictor.refit_models(db)
+        if refitted:
+            logger.info(f"📈 Seasonal models refitted for {refitted} villages")
+        stored = materialize_predictions(db)
+        logger.info(f"✅ {stored} predictions materialized")
+
         # Broadcast escalations immediately via WebSocket
         if escalated:
             for alert in escalated:
@@ -113,6 +172,34 @@ async def recalculate_all_wsi():
         db.close()
 
 
+async def rollup_wsi_history():
+    """Daily: Downsample old WSI snapshots into daily/weekly rollups."""
+    db = SessionLocal()
+    try:
+        pruned = rollup_history(db)
+        logger.info(f"✅ WSI history rolled up: {pruned['raw_pruned']} snapshots, {pruned['daily_pruned']} daily rollups")
+    except Exception as e:
+        logger.error(f"❌ WSI history rollup failed: {e}")
+        db.rollback()
+    finally:
+        db.close()
+
+
+async def rebuild_priority_index():
+    """Every 15 minutes: Full rebuild of the allocation priority heap and spatial index, route cache reset (drift guard)."""
+    db = SessionLocal()
+    try:
+        count = priority_index.rebuild(db)
+        logger.info(f"✅ Allocation priorities rebuilt for {count} villages")
+        points = spatial_index.rebuild(db)
+        logger.info(f"✅ Spatial index rebuilt with {points} points")
+        route_cache.clear()
+    except Exception as e:
+        logger.error(f"❌ Priority rebuild failed: {e}")
+    finally:
+        db.close()
+
+
 async def initial_data_load():
     """Runs once on startup — loads initial weather data."""
     logger.info("🚀 Initial weather data load...")
@@ -135,6 +222,33 @@ def start_scheduler():
         replace_existing=True,
     )
 
+    # Hourly WSI aggregate window expiry
+    scheduler.add_job(
+        expire_wsi_aggregates,
+        trigger=IntervalTrigger(hours=1),
+        id="wsi_aggregate_expiry",
+        name="Hourly WSI Aggregate Expiry",
+        replace_existing=True,
+    )
+
+    # Hourly tanker reservation expiry
+    scheduler.add_job(
+        expire_tanker_reservations,
+        trigger=IntervalTrigger(hours=1),
+        id="tanker_reservation_expiry",
+        name="Hourly Tanker Reservation Expiry",
+        replace_existing=True,
+    )
+
+    # Daily — WSI aggregate rebuild (drift guard)
+    scheduler.add_job(
+        rebuild_wsi_aggregates,
+        trigger=IntervalTrigger(days=1),
+        id="wsi_aggregate_rebuild",
+        name="Daily WSI Aggregate Rebuild",
+        replace_existing=True,
+    )
+
     # Every 6 hours — WSI recalculation
     scheduler.add_job(
         recalculate_all_wsi,
@@ -144,10 +258,33 @@ def start_scheduler():
         replace_existing=True,
     )
 
+    # Daily — WSI history rollup & retention
+    scheduler.add_job(
+        rollup_wsi_history,
+        trigger=IntervalTrigger(days=1),
+        id="wsi_history_rollup",
+        name="Daily WSI History Rollup",
+        replace_existing=True,
+    )
+
+    # Every 15 minutes — allocation priority heap rebuild
+    scheduler.add_job(
+        rebuild_priority_index,
+        trigger=IntervalTrigger(seconds=REBUILD_INTERVAL_SECONDS),
+        id="priority_rebuild",
+        name="Allocation Priority Rebuild",
+        replace_existing=True,
+    )
+
     scheduler.start()
     logger.info("✅ JalMitra background scheduler started")
     logger.info("   → Hourly: Live weather refresh (Open-Meteo + WeatherAPI)")
+    logger.info("   → Hourly: WSI aggregate window expiry")
+    logger.info("   → Hourly: Tanker reservation expiry")
     logger.info("   → Every 6h: WSI recalculation for all villages")
+    logger.info("   → Every 15m: Allocation priority + spatial index rebuild")
+    logger.info("   → Daily: WSI history rollup")
+    logger.info("   → Daily: WSI aggregate rebuild")
 
 
 def stop_scheduler():
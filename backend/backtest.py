@@ -0,0 +1,69 @@
+"""
+JalMitra Drought Predictor Backtest
+Replays historical rainfall / groundwater with rolling origins and writes a
+JSON report (MAE and severity hit-rate per horizon, wall time and peak memory
+per 1k villages) for run-over-run comparison.
+Run: python backtest.py [--horizons 30 60 90] [--workers 4] [--baseline reports/old.json]
+"""
+import argparse
+import json
+import os
+import sys
+from datetime import datetime
+
+# Make sure app modules are importable
+sys.path.insert(0, os.path.dirname(__file__))
+
+from app.database import SessionLocal
+from app.ml.backtest import run_backtest, compare_reports, DEFAULT_HORIZONS, MIN_HISTORY_MONTHS
+from app.ml.process_pool import shutdown_pool
+from app.config import ENSEMBLE_WORKERS
+
+REPORT_DIR = os.path.join(os.path.dirname(__file__), "backtest_reports")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Backtest the drought predictor")
+    parser.add_argument("--horizons", type=int, nargs="+", default=list(DEFAULT_HORIZONS))
+    parser.add_argument("--workers", type=int, default=ENSEMBLE_WORKERS)
+    parser.add_argument("--min-history", type=int, default=MIN_HISTORY_MONTHS, help="months before the first origin")
+    parser.add_argument("--output", help="report path (default: backtest_reports/backtest_<timestamp>.json)")
+    parser.add_argument("--baseline", help="earlier report to compare against")
+    args = parser.parse_args()
+
+    db = SessionLocal()
+    try:
+        report = run_backtest(db, args.horizons, args.workers, args.min_history)
+    finally:
+        db.close()
+        shutdown_pool()
+
+    if "error" in report:
+        print(f"⚠️  {report['error']}")
+        return 1
+
+    output = args.output or os.path.join(REPORT_DIR, f"backtest_{datetime.utcnow():%Y%m%dT%H%M%S}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+
+    print(f"📊 {len(report['folds'])} folds over {report['villages']} villages ({report['history']['from']} → {report['history']['to']})")
+    for name, by_horizon in report["metrics"].items():
+        for h, m in by_horizon.items():
+            print(f"  {name:>13} {h:>4}d  MAE {m['mae']}  hit-rate {m['severity_hit_rate']}  (n={m['samples']})")
+    for key, value in report["throughput"].items():
+        print(f"  {key}: {value}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        print(f"\n🔁 vs {args.baseline}")
+        for line in compare_reports(report, baseline):
+            print(f"  {line}")
+
+    print(f"✅ Report written to {output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -20,6 +20,7 @@ sys.path.insert(0, os.path.dirname(__file__))
 from app.database import SessionLocal, engine
 from app.models import Base, Village, RainfallData, GroundwaterData, Tanker, WaterStressRecord
 from app.ml.wsi_calculator import WSICalculator
+from app.ml.wsi_aggregates import rebuild_aggregates
 
 DATA_DIR = os.path.join(os.path.dirname(__file__), "data")
 calculator = WSICalculator()
@@ -245,6 +246,10 @@ def main():
         print("\n🚛 Importing tankers...")
         import_tankers(db)
 
+        # The bulk deletes above bypass the incremental aggregate updates
+        print("\n📊 Rebuilding WSI aggregates...")
+        print(f"  ✅ Rebuilt aggregates for {rebuild_aggregates(db)} villages")
+
         print("\n🧮 Recalculating Water Stress Index...")
         recalculate_wsi(db)
 
@@ -10,9 +10,15 @@ from app.database import engine, Base, SessionLocal
 from app.routes import router
 from app.weather_routes import weather_router
 from app.route_routes import router as route_router
+from app.raster_routes import raster_router
 from app.seed_data import seed_database
 from app.websocket import manager
-from app.scheduler import start_scheduler, stop_scheduler, initial_data_load
+from app.scheduler import start_scheduler, stop_scheduler
+from app.ml.wsi_aggregates import ensure_aggregates
+from app.ml.wsi_history import ensure_latest_pointers
+from app.ml.process_pool import shutdown_pool
+from app.ml.prediction_store import materialize_predictions
+from app.ml.drought_predictor import drought_predictor
 
 
 @asynccontextmanager
@@ -22,6 +28,10 @@ async def lifespan(app: FastAPI):
     db = SessionLocal()
     try:
         seed_database(db)
+        ensure_aggregates(db)
+        ensure_latest_pointers(db)
+        drought_predictor.refit_models(db)
+        materialize_predictions(db)
     finally:
         db.close()
 
@@ -32,6 +42,7 @@ async def lifespan(app: FastAPI):
 
     # Shutdown
     stop_scheduler()
+    shutdown_pool()
 
 
 app = FastAPI(
@@ -53,6 +64,7 @@ app.add_middleware(
 app.include_router(router)
 app.include_router(weather_router)
 app.include_router(route_router)
+app.include_router(raster_router)
 
 
 @app.get("/")
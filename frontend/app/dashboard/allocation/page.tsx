@@ -1,5 +1,5 @@
 "use client";
-import { useState } from "react";
+import { useRef, useState } from "react";
 import { motion, AnimatePresence } from "framer-motion";
 import { Truck, Zap, MapPin, ArrowRight, Send, CheckCircle2 } from "lucide-react";
 import { api } from "@/lib/api";
@@ -9,13 +9,17 @@ export default function AllocationPage() {
     const [loading, setLoading] = useState(false);
     const [bulkDispatching, setBulkDispatching] = useState(false);
     const [dispatchedCount, setDispatchedCount] = useState(0);
+    // One key per allocation attempt, reused on retries until the server answers
+    const allocationKey = useRef<string | null>(null);
 
     const runAllocation = async () => {
         setLoading(true);
         setDispatchedCount(0);
         try {
-            const data = await api.autoAllocate();
-            setAllocations(data);
+            if (!allocationKey.current) allocationKey.current = crypto.randomUUID();
+            const data = await api.autoAllocate(allocationKey.current);
+            allocationKey.current = null;
+            setAllocations(data.allocations);
         } catch {
             // Demo data for Nagpur Pilot
             setAllocations([
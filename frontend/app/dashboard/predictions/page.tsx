@@ -46,6 +46,7 @@ const riskTrendData = [
 export default function PredictionsPage() {
     const [predictions, setPredictions] = useState<any[]>(demoPredictions);
     const [daysAhead, setDaysAhead] = useState(30);
+    const [riskTrend, setRiskTrend] = useState(riskTrendData);
 
     useEffect(() => {
         api.getPredictions(daysAhead).then(data => {
@@ -53,6 +54,20 @@ export default function PredictionsPage() {
         }).catch(() => { });
     }, [daysAhead]);
 
+    useEffect(() => {
+        // One matrix call covers every horizon on the chart
+        api.getPredictionMatrix(10, 90).then(matrix => {
+            const rows: number[][] = matrix?.predicted_wsi || [];
+            if (!rows.length) return;
+            const avg = (j: number) => rows.reduce((s, r) => s + r[j], 0) / rows.length;
+            const current: number[] = matrix.villages.current_wsi;
+            setRiskTrend([
+                { day: "Day 0", risk: Math.round(current.reduce((s, v) => s + v, 0) / current.length) },
+                ...matrix.horizons.map((h: number, j: number) => ({ day: `Day ${h}`, risk: Math.round(avg(j)) })),
+            ]);
+        }).catch(() => { });
+    }, []);
+
     const escalating = predictions.filter(p =>
         SEVERITY_COLORS[p.predicted_severity] !== SEVERITY_COLORS[p.current_severity] &&
         (p.predicted_wsi > p.current_wsi)
@@ -137,7 +152,7 @@ export default function PredictionsPage() {
                     <div className="section-title">📈 Aggregate Risk Velocity</div>
                     <div style={{ padding: "1rem", height: 300 }}>
                         <ResponsiveContainer width="100%" height="100%">
-                            <AreaChart data={riskTrendData}>
+                            <AreaChart data={riskTrend}>
                                 <defs>
                                     <linearGradient id="colorRisk" x1="0" y1="0" x2="0" y2="1">
                                         <stop offset="5%" stopColor="#8b5cf6" stopOpacity={0.3} />
@@ -146,7 +161,7 @@ export default function PredictionsPage() {
                                 </defs>
                                 <CartesianGrid strokeDasharray="3 3" stroke="rgba(75,85,99,0.1)" vertical={false} />
                                 <XAxis dataKey="day" tick={{ fill: "#9ca3af", fontSize: 10 }} />
-                                <YAxis tick={{ fill: "#9ca3af", fontSize: 11 }} domain={[40, 100]} />
+                                <YAxis tick={{ fill: "#9ca3af", fontSize: 11 }} domain={[0, 100]} />
                                 <Tooltip contentStyle={{ background: "#111827", border: "1px solid #374151", borderRadius: 8 }} />
                                 <Area type="monotone" dataKey="risk" stroke="#8b5cf6" fillOpacity={1} fill="url(#colorRisk)" name="Risk Score" />
                             </AreaChart>
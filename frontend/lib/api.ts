@@ -25,21 +25,34 @@ export const api = {
 
     // Predictions
     getPredictions: (daysAhead = 30) => fetchAPI(`/api/predictions?days_ahead=${daysAhead}`),
+    getPredictionMatrix: (stepDays = 7, maxDays = 90) =>
+        fetchAPI(`/api/predictions/matrix?step_days=${stepDays}&max_days=${maxDays}`),
     getDistrictSummary: (daysAhead = 30) => fetchAPI(`/api/predictions/district-summary?days_ahead=${daysAhead}`),
 
     // Tankers
     getTankers: () => fetchAPI("/api/tankers"),
+    getNearestTankers: (villageId: number, k = 5) =>
+        fetchAPI(`/api/tankers/nearest?village_id=${villageId}&k=${k}`),
 
     // Allocation
     getPriorities: (limit = 20) => fetchAPI(`/api/allocation/priorities?limit=${limit}`),
-    autoAllocate: () => fetchAPI("/api/allocation/auto-allocate", { method: "POST" }),
+    autoAllocate: (idempotencyKey: string) =>
+        fetchAPI("/api/allocation/auto-allocate", { method: "POST", headers: { "Idempotency-Key": idempotencyKey } }),
 
     // Routes
-    optimizeRoutes: (district?: string, numVehicles = 3) => {
-        const params = new URLSearchParams({ num_vehicles: String(numVehicles) });
+    // searchId tags the "route_incumbent" WebSocket events streamed while a timed search runs
+    optimizeRoutes: (district?: string, numVehicles = 3, mode: "cvrp" | "greedy" | "vrptw" = "cvrp", timeBudgetMs?: number, searchId?: string) => {
+        const params = new URLSearchParams({ num_vehicles: String(numVehicles), mode });
         if (district) params.set("district", district);
+        if (timeBudgetMs) params.set("time_budget_ms", String(timeBudgetMs));
+        if (searchId) params.set("search_id", searchId);
         return fetchAPI(`/api/routes/optimize?${params}`, { method: "POST" });
     },
+    getRoutePlan: (planId: string) => fetchAPI(`/api/routes/plans/${planId}`),
+    insertRouteStop: (planId: string, requestId: number) =>
+        fetchAPI(`/api/routes/plans/${planId}/insert?request_id=${requestId}`, { method: "POST" }),
+    removeRouteStop: (planId: string, villageId: number) =>
+        fetchAPI(`/api/routes/plans/${planId}/stops/${villageId}`, { method: "DELETE" }),
     getRoute: (start: [number, number], end: [number, number]) =>
         fetchAPI(`/api/routes/calculate?start_lat=${start[0]}&start_lon=${start[1]}&end_lat=${end[0]}&end_lon=${end[1]}`),
     dispatchTanker: (data: any) =>
@@ -79,6 +92,8 @@ export const api = {
         const query = status ? `?status=${status}` : "";
         return fetchAPI(`/api/trips${query}`);
     },
+    updateTripStatus: (tripId: number, status: "in_transit" | "delivered" | "cancelled") =>
+        fetchAPI(`/api/trips/${tripId}/status?status=${status}`, { method: "POST" }),
 
     // Auth
     login: (email: string, password: string) =>